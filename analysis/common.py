@@ -1,6 +1,12 @@
-from typing import Optional, Dict, Iterable
+from typing import Optional, Dict, Iterable, Tuple
 import abc
-from metrics.common import Timeseries
+import numpy as np
+from metrics.common import (
+    Timeseries,
+    decode_series_with_metadata,
+    encode_series,
+)
+from utils.serialization import decode_columns, encode_columns
 from utils.tasks import AsyncTask, AsyncExecutionError
 
 
@@ -33,6 +39,59 @@ class Trend(object):
         """method to get trend_vals"""
         return self._trend_vals
 
+    def to_dict(self) -> dict:
+        """method to get json serializable keys and values of trend"""
+        return {
+            'keys': [
+                key.item() if isinstance(key, np.generic) else key
+                for key in self._trend_vals
+            ],
+            'values': [float(val) for val in self._trend_vals.values()],
+        }
+
+    def to_bytes(self) -> bytes:
+        """
+        method to encode the trend into a compact binary format
+        (see utils.serialization), decoded with from_bytes
+        """
+        trend = self.to_dict()
+        return encode_columns(
+            columns={'value': np.array(trend['values'], dtype=float)},
+            metadata={'keys': trend['keys']},
+        )
+
+    @staticmethod
+    def from_dict(trend: dict):
+        """
+        method to generate Trend object from keys and values of
+        to_dict
+
+        Parameters
+        ----------
+        trend: dict
+            keys and values of the trend
+        """
+        return Trend(trend_vals=dict(zip(trend['keys'], trend['values'])))
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        """
+        method to decode Trend object encoded with to_bytes
+
+        Parameters
+        ----------
+        data: bytes
+            encoded trend
+        """
+        columns, metadata = decode_columns(data=data)
+        try:
+            return Trend.from_dict({
+                'keys': metadata['keys'],
+                'values': columns['value'].tolist(),
+            })
+        except KeyError as e:
+            raise ValueError(f'invalid trend container: {e}')
+
 
 class Report(object):
     """
@@ -46,17 +105,31 @@ class Report(object):
         Trend data for day of the week
     hourly_trend: Optional[Trend] (default None)
         Trend data for hour of the day
+    forecast_bounds: Optional[Dict[str, Tuple[Timeseries, Timeseries]]]
+        (default None)
+        lower and upper bound of the uncertainty interval of forecasts
+        by name of the forecast
+    anomaly_scores: Optional[Dict[str, Timeseries]] (default None)
+        anomaly score of each historical point (its distance from the
+        in-sample prediction in standard deviations) by name of the
+        series
     """
 
     def __init__(
         self,
         forecasts: Optional[Iterable[Timeseries]] = None,
         daily_trend: Optional[Trend] = None,
-        hourly_trend: Optional[Trend] = None
+        hourly_trend: Optional[Trend] = None,
+        forecast_bounds: Optional[
+            Dict[str, Tuple[Timeseries, Timeseries]]
+        ] = None,
+        anomaly_scores: Optional[Dict[str, Timeseries]] = None,
     ) -> None:
         self._forecasts = forecasts
         self._daily_trend = daily_trend
         self._hourly_trend = hourly_trend
+        self._forecast_bounds = forecast_bounds
+        self._anomaly_scores = anomaly_scores
 
     def contains_forecasts(self) -> bool:
         """method to check if report contains forecast"""
@@ -70,15 +143,104 @@ class Report(object):
         """method to check if report contains hourly trends"""
         return self._hourly_trend is not None
 
+    def contains_forecast_bounds(self) -> bool:
+        """method to check if report contains forecast uncertainty bounds"""
+        return self._forecast_bounds is not None
+
+    def contains_anomaly_scores(self) -> bool:
+        """method to check if report contains anomaly scores"""
+        return self._anomaly_scores is not None
+
     def get_forecasts(self) -> Optional[Iterable[Timeseries]]:
         return self._forecasts
 
+    def get_forecast_bounds(
+        self,
+    ) -> Optional[Dict[str, Tuple[Timeseries, Timeseries]]]:
+        return self._forecast_bounds
+
     def get_daily_trends(self) -> Optional[Trend]:
         return self._daily_trend
 
     def get_hourly_trends(self) -> Optional[Trend]:
         return self._hourly_trend
 
+    def get_anomaly_scores(self) -> Optional[Dict[str, Timeseries]]:
+        return self._anomaly_scores
+
+    def to_bytes(self) -> bytes:
+        """
+        method to encode the report into a compact binary format
+        (see utils.serialization), decoded with from_bytes. forecasts,
+        bounds and anomaly scores are stored as columns, trends as
+        metadata
+        """
+        forecasts = list(self._forecasts or [])
+        bounds = self._forecast_bounds or {}
+        scores = self._anomaly_scores or {}
+        series = forecasts + [
+            bound for name in bounds for bound in bounds[name]
+        ] + list(scores.values())
+        trends = {
+            'daily_trend': self._daily_trend,
+            'hourly_trend': self._hourly_trend,
+        }
+        return encode_series(series=series, metadata={
+            'forecasts': (
+                len(forecasts) if self._forecasts is not None else None
+            ),
+            'bounds': list(bounds) if self._forecast_bounds else None,
+            'anomalies': (
+                list(scores) if self._anomaly_scores is not None else None
+            ),
+            **{
+                key: trend.to_dict() if trend is not None else None
+                for key, trend in trends.items()
+            },
+        })
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        """
+        method to decode Report object encoded with to_bytes. arrays
+        of its series are read-only views of data
+
+        Parameters
+        ----------
+        data: bytes
+            encoded report
+        """
+        series, metadata = decode_series_with_metadata(data=data)
+        try:
+            count = metadata['forecasts']
+            start = count or 0
+            bounds = None
+            if metadata['bounds'] is not None:
+                bounds = {
+                    name: tuple(series[start + 2 * i:start + 2 * i + 2])
+                    for i, name in enumerate(metadata['bounds'])
+                }
+                start += 2 * len(bounds)
+            scores = None
+            if metadata['anomalies'] is not None:
+                scores = {
+                    name: series[start + i]
+                    for i, name in enumerate(metadata['anomalies'])
+                }
+            trends = {
+                key: Trend.from_dict(metadata[key])
+                if metadata[key] is not None else None
+                for key in ('daily_trend', 'hourly_trend')
+            }
+        except (KeyError, TypeError) as e:
+            raise ValueError(f'invalid report container: {e}')
+        return Report(
+            forecasts=series[:count] if count is not None else None,
+            forecast_bounds=bounds,
+            anomaly_scores=scores,
+            **trends,
+        )
+
 
 class Reporter(AsyncTask, metaclass=abc.ABCMeta):
     """
@@ -0,0 +1,353 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import timedelta
+from typing import Iterable, List, Optional, Tuple
+import asyncio
+import multiprocessing
+import os
+import threading
+import numpy as np
+from metrics.common import Timeseries
+from utils.imports import LazyModule, import_lazy_modules
+from utils.instrumentation import time_stage
+from utils.tasks import AsyncTask
+from analysis.common import ReporterError
+from analysis.forecast import PredictMode
+
+fbprophet = LazyModule('fbprophet')
+pd = LazyModule('pandas')
+
+# pool backtest folds run in, shared by evaluations of the process
+# and created again in processes forked after it was created
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_key: Optional[Tuple[int, int]] = None
+_pool_lock = threading.Lock()
+# min number of points a fold is fit on (prophet can not fit fewer)
+MIN_FIT_POINTS = 2
+
+
+class Accuracy(object):
+    """
+    Accuracy is how well forecasts of a series matched what happened
+    over the folds of a backtest
+
+    Parameters
+    ----------
+    name: str
+        name of the series
+    folds: int
+        number of folds evaluated (0 if the series is too short)
+    points: int
+        number of points forecast over all folds
+    mape: Optional[float] (default: None)
+        mean absolute percentage error over points that are not 0
+    rmse: Optional[float] (default: None)
+        root mean squared error
+    coverage: Optional[float] (default: None)
+        share of points within the uncertainty interval, if
+        uncertainty was simulated
+    """
+
+    def __init__(
+        self,
+        name: str,
+        folds: int,
+        points: int,
+        mape: Optional[float] = None,
+        rmse: Optional[float] = None,
+        coverage: Optional[float] = None,
+    ) -> None:
+        self._name = name
+        self._folds = folds
+        self._points = points
+        self._mape = mape
+        self._rmse = rmse
+        self._coverage = coverage
+
+    def get_name(self) -> str:
+        """method to get name of the series"""
+        return self._name
+
+    def get_folds(self) -> int:
+        """method to get number of folds evaluated"""
+        return self._folds
+
+    def get_points(self) -> int:
+        """method to get number of points forecast over all folds"""
+        return self._points
+
+    def get_mape(self) -> Optional[float]:
+        """method to get mean absolute percentage error"""
+        return self._mape
+
+    def get_rmse(self) -> Optional[float]:
+        """method to get root mean squared error"""
+        return self._rmse
+
+    def get_coverage(self) -> Optional[float]:
+        """method to get share of points within uncertainty intervals"""
+        return self._coverage
+
+    def to_dict(self) -> dict:
+        """method to get json serializable accuracy"""
+        return {
+            'name': self._name,
+            'folds': self._folds,
+            'points': self._points,
+            'mape': self._mape,
+            'rmse': self._rmse,
+            'coverage': self._coverage,
+        }
+
+
+class Backtester(AsyncTask):
+    """
+    Backtester evaluates FBProphetForecaster forecasts of series
+    with rolling origin backtests: for each cutoff the model is fit
+    on the history up to the cutoff and its forecast of the horizon
+    after the cutoff is compared to what happened. folds of all
+    series run in parallel in a pool of processes
+
+    Parameters
+    ----------
+    series: Iterable[Timeseries]
+        list of timeseries data to evaluate
+    horizon_days: Optional[float] (default: 1)
+        number of days forecast from each cutoff. cutoffs are
+        horizon_days apart, ending horizon_days before the last
+        point of each series
+    folds: Optional[int] (default: 4)
+        max number of cutoffs to evaluate per series
+    initial_days: Optional[float] (default: 3)
+        min number of days of history to fit on
+    predict_mode: Optional[PredictMode] (default: FAST)
+        uncertainty simulation to run. coverage is not evaluated
+        if NONE
+    workers: Optional[int] (default: 0)
+        number of processes to run folds in. folds run one after
+        another in the calling process if 0
+    """
+
+    def __init__(
+        self,
+        series: Iterable[Timeseries],
+        horizon_days: Optional[float] = 1,
+        folds: Optional[int] = 4,
+        initial_days: Optional[float] = 3,
+        predict_mode: Optional[PredictMode] = PredictMode.FAST,
+        workers: Optional[int] = 0,
+    ) -> None:
+        self._series = list(series)
+        self._horizon = int(timedelta(days=horizon_days).total_seconds())
+        self._initial = int(timedelta(days=initial_days).total_seconds())
+        self._folds = folds
+        self._samples = predict_mode.get_uncertainty_samples()
+        self._workers = workers
+
+    async def execute(self) -> List[Accuracy]:
+        """method to execute async task"""
+        try:
+            with time_stage(stage='backtest'):
+                return await self._evaluate()
+        except Exception as e:
+            raise ReporterError(reporter='Backtester', error=str(e))
+
+    async def _evaluate(self) -> List[Accuracy]:
+        """helper method to run the folds of all series"""
+        loop = asyncio.get_running_loop()
+        pool = get_pool(workers=self._workers) if self._workers else None
+        tasks = []
+        counts = []
+        for data in self._series:
+            cutoffs = gen_cutoffs(
+                timestamps=data.get_timestamps(),
+                horizon=self._horizon,
+                folds=self._folds,
+                initial=self._initial,
+            )
+            counts.append(len(cutoffs))
+            if len(cutoffs) == 0:
+                continue
+            # series are sent to worker processes in their compact
+            # binary encoding rather than pickled point by point
+            encoded = data.to_bytes()
+            for cutoff in cutoffs.tolist():
+                args = (encoded, cutoff, self._horizon, self._samples)
+                if pool is None:
+                    tasks.append(run_fold(*args))
+                else:
+                    tasks.append(loop.run_in_executor(pool, run_fold, *args))
+        if pool is not None:
+            tasks = await asyncio.gather(*tasks)
+        accuracies = []
+        start = 0
+        for data, count in zip(self._series, counts):
+            accuracies.append(gen_accuracy(
+                name=data.get_name(),
+                folds=tasks[start:start + count],
+                with_bounds=self._samples > 0,
+            ))
+            start += count
+        return accuracies
+
+
+def gen_cutoffs(
+    timestamps: np.ndarray,
+    horizon: int,
+    folds: int,
+    initial: int,
+) -> np.ndarray:
+    """
+    function to generate cutoffs of a rolling origin backtest in
+    ascending order. cutoffs are horizon seconds apart, the last
+    one horizon seconds before the last timestamp, and leave at
+    least initial seconds of history before them. cutoffs with
+    fewer than MIN_FIT_POINTS points before them or no points in
+    the horizon after them (i.e after gaps in the series) are
+    left out
+
+    Parameters
+    ----------
+    timestamps: np.ndarray
+        sorted timestamps of the series
+    horizon: int
+        seconds forecast from each cutoff
+    folds: int
+        max number of cutoffs
+    initial: int
+        min seconds of history before each cutoff
+    """
+    if len(timestamps) == 0 or folds < 1:
+        return np.empty(0, dtype=np.int64)
+    last = int(timestamps[-1]) - horizon
+    cutoffs = last - horizon * np.arange(folds - 1, -1, -1, dtype=np.int64)
+    fit = np.searchsorted(timestamps, cutoffs, side='right')
+    end = np.searchsorted(timestamps, cutoffs + horizon, side='right')
+    keep = (cutoffs >= int(timestamps[0]) + initial)
+    keep &= (fit >= MIN_FIT_POINTS) & (end > fit)
+    return cutoffs[keep]
+
+
+def run_fold(
+    data: bytes,
+    cutoff: int,
+    horizon: int,
+    samples: int,
+) -> Tuple[np.ndarray, ...]:
+    """
+    function to fit a series up to a cutoff and forecast the points
+    of the horizon after it. returns the actual values, forecast
+    values and lower and upper bounds (None without uncertainty
+    samples) of those points. runs in worker processes
+
+    Parameters
+    ----------
+    data: bytes
+        series encoded with Timeseries.to_bytes
+    cutoff: int
+        timestamp of the last point to fit on
+    horizon: int
+        seconds after the cutoff to forecast
+    samples: int
+        number of uncertainty samples to simulate
+    """
+    series = Timeseries.from_bytes(data=data)
+    timestamps = series.get_timestamps()
+    values = series.get_values()
+    fit = timestamps <= cutoff
+    test = ~fit & (timestamps <= cutoff + horizon)
+    model = fbprophet.Prophet(uncertainty_samples=samples)
+    with time_stage(stage='fit'):
+        model.fit(pd.DataFrame({
+            'ds': pd.to_datetime(timestamps[fit], unit='s'),
+            'y': values[fit],
+        }))
+    with time_stage(stage='predict'):
+        future = model.predict(pd.DataFrame({
+            'ds': pd.to_datetime(timestamps[test], unit='s'),
+        }))
+    bounds = (None, None)
+    if samples > 0:
+        bounds = tuple(
+            future[f'yhat_{bound}'].to_numpy(dtype=float)
+            for bound in ('lower', 'upper')
+        )
+    return (values[test], future['yhat'].to_numpy(dtype=float), *bounds)
+
+
+def gen_accuracy(
+    name: str,
+    folds: List[Tuple[np.ndarray, ...]],
+    with_bounds: bool,
+) -> Accuracy:
+    """
+    function to generate accuracy of forecasts over the folds of
+    a series from their actual, forecast, lower and upper values
+
+    Parameters
+    ----------
+    name: str
+        name of the series
+    folds: List[Tuple[np.ndarray, ...]]
+        results of run_fold for each fold
+    with_bounds: bool
+        whether folds come with uncertainty bounds
+    """
+    if not folds:
+        return Accuracy(name=name, folds=0, points=0)
+    actual, predicted, lower, upper = (
+        np.concatenate(column) if with_bounds or index < 2 else None
+        for index, column in enumerate(zip(*folds))
+    )
+    if len(actual) == 0:
+        return Accuracy(name=name, folds=len(folds), points=0)
+    errors = predicted - actual
+    nonzero = actual != 0
+    mape = None
+    if nonzero.any():
+        mape = float(np.mean(np.abs(errors[nonzero] / actual[nonzero])))
+    coverage = None
+    if with_bounds:
+        coverage = float(np.mean((actual >= lower) & (actual <= upper)))
+    return Accuracy(
+        name=name,
+        folds=len(folds),
+        points=len(actual),
+        mape=mape,
+        rmse=float(np.sqrt(np.mean(errors ** 2))),
+        coverage=coverage,
+    )
+
+
+def get_pool(workers: int) -> Executor:
+    """
+    function to get the pool of processes backtest folds run in.
+    the pool is kept for later evaluations. worker processes are
+    spawned rather than forked, so they do not inherit threads of
+    the server, and import the heavy modules once when they start
+
+    Parameters
+    ----------
+    workers: int
+        number of processes in the pool
+    """
+    global _pool, _pool_key
+    key = (os.getpid(), workers)
+    with _pool_lock:
+        if _pool is None or _pool_key != key:
+            if _pool is not None and _pool_key[0] == key[0]:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+            _pool_key = key
+        return _pool
+
+
+def _init_worker() -> None:
+    """
+    function to import the modules declared lazily by this module
+    (and the modules it imports) when a worker process starts
+    """
+    import_lazy_modules()
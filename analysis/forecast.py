@@ -1,9 +1,11 @@
 import abc
+from enum import Enum
 from typing import Iterable, Optional, Tuple
 from datetime import timedelta
-from fbprophet import Prophet
-import pandas as pd
+import numpy as np
 from metrics.common import Timeseries
+from utils.imports import LazyModule
+from utils.instrumentation import time_stage
 from analysis.common import (
     Reporter,
     Report,
@@ -11,6 +13,39 @@ from analysis.common import (
     Trend
 )
 
+# fbprophet pulls in pystan and matplotlib, so it is only imported
+# once an analysis needs it
+fbprophet = LazyModule('fbprophet')
+pd = LazyModule('pandas')
+
+
+class PredictMode(Enum):
+    """
+    PredictMode is how much uncertainty simulation FBProphetForecaster
+    runs when predicting. prophet estimates uncertainty intervals by
+    simulating future trends, which is most of the cost of predicting
+    long horizons
+    """
+    # NONE skips uncertainty simulation, only yhat is predicted
+    NONE = 'none'
+    # FAST estimates uncertainty intervals from a few samples
+    FAST = 'fast'
+    # FULL estimates uncertainty intervals from as many samples as
+    # prophet does by default
+    FULL = 'full'
+
+    def get_uncertainty_samples(self) -> int:
+        """method to get number of uncertainty samples to simulate"""
+        return UNCERTAINTY_SAMPLES[self]
+
+
+# number of uncertainty samples of each predict mode
+UNCERTAINTY_SAMPLES = {
+    PredictMode.NONE: 0,
+    PredictMode.FAST: 100,
+    PredictMode.FULL: 1000,
+}
+
 
 class Forecaster(Reporter, metaclass=abc.ABCMeta):
     """
@@ -36,16 +71,45 @@ class FBProphetForecaster(Forecaster):
     """
     ProphetForecaster uses fbprophet library to forecast
     and analyze Timeseries data
+
+    Parameters
+    ----------
+    series: Iterable[Timeseries]
+        list of timeseries data to analyze
+    forecast_days: Optional[int] (default: 7)
+        number of days to forecast for
+    predict_mode: Optional[PredictMode] (default: NONE)
+        uncertainty simulation to run. forecasts come with lower and
+        upper bounds of their uncertainty interval unless NONE
+    hourly_days: Optional[int] (default: 7)
+        number of days of the horizon to forecast hourly. the rest
+        of the horizon is forecast every coarse_hours
+    coarse_hours: Optional[int] (default: 6)
+        hours between forecast points after hourly_days
+    score_anomalies: Optional[bool] (default: False)
+        whether to score historical points against the in-sample
+        prediction of the fitted model (see score_history)
     """
 
     def __init__(
         self,
         series: Iterable[Timeseries],
         forecast_days: Optional[int] = 7,
+        predict_mode: Optional[PredictMode] = PredictMode.NONE,
+        hourly_days: Optional[int] = 7,
+        coarse_hours: Optional[int] = 6,
+        score_anomalies: Optional[bool] = False,
     ) -> None:
         self._series = series
+        self._score_anomalies = score_anomalies
         delta = timedelta(days=forecast_days).total_seconds()
         self._periods = int(delta / 3600)
+        self._samples = predict_mode.get_uncertainty_samples()
+        self._offsets = gen_horizon_offsets(
+            periods=self._periods,
+            hourly_periods=hourly_days * 24,
+            coarse_hours=coarse_hours,
+        )
 
     async def forecast(self) -> Optional[Report]:
         """
@@ -62,18 +126,41 @@ class FBProphetForecaster(Forecaster):
     async def _analyze(self) -> Report:
         """helper method to perform analysis"""
         forecasts = []
+        bounds = {}
         daily = []
         hourly = []
+        scores = {}
         for data in self._series:
             model = await self._build_model(data=data)
             future = await self._forecast_single(model=model)
-            h, d = await self._process_trends_single(future=future)
-            forecasts.append(Timeseries.from_df(
-                name=data.get_name() + '_forecast',
+            if self._score_anomalies:
+                with time_stage(stage='predict'):
+                    scores[data.get_name()] = score_history(
+                        name=data.get_name() + '_anomaly_score',
+                        model=model,
+                    )
+            with time_stage(stage='trends'):
+                h, d = await self._process_trends_single(future=future)
+            name = data.get_name() + '_forecast'
+            forecast = Timeseries.from_df(
+                name=name,
                 df=future,
                 time_col='ds',
                 val_col='yhat',
-            ))
+            )
+            forecasts.append(forecast)
+            if self._samples > 0:
+                # bounds share the timestamps column of the forecast
+                bounds[name] = tuple(
+                    Timeseries(
+                        name=f'{name}_{bound}',
+                        columns=(
+                            forecast.get_timestamps(),
+                            future[f'yhat_{bound}'].to_numpy(dtype=float),
+                        ),
+                    )
+                    for bound in ('lower', 'upper')
+                )
             daily.append(d)
             hourly.append(h)
         daily_agg = pd.concat(daily).groupby(level=0).mean()
@@ -82,30 +169,113 @@ class FBProphetForecaster(Forecaster):
             forecasts=forecasts,
             daily_trend=Trend(trend_vals=daily_agg.to_dict()),
             hourly_trend=Trend(trend_vals=hourly_agg.to_dict()),
+            forecast_bounds=bounds or None,
+            anomaly_scores=scores if self._score_anomalies else None,
         )
 
     async def _build_model(
         self,
         data: Timeseries
-    ) -> Prophet:
+    ) -> 'fbprophet.Prophet':
         """helper method to build model for single metric"""
-        model = Prophet()
-        model.fit(data.get_dataframe())
+        model = fbprophet.Prophet(uncertainty_samples=self._samples)
+        with time_stage(stage='fit'):
+            model.fit(data.get_dataframe())
         return model
 
     async def _forecast_single(
         self,
-        model: Prophet
-    ) -> pd.DataFrame:
+        model: 'fbprophet.Prophet'
+    ) -> 'pd.DataFrame':
         """helper method to build model and forecast for single metric"""
-        future = model.make_future_dataframe(self._periods, 'H', False)
-        return model.predict(future)
+        last = model.history_dates.max()
+        future = pd.DataFrame({
+            'ds': last + pd.to_timedelta(self._offsets, unit='h'),
+        })
+        with time_stage(stage='predict'):
+            return model.predict(future)
 
     async def _process_trends_single(
         self,
-        future: pd.DataFrame
-    ) -> Tuple[pd.Series, pd.Series]:
-        """helper method to process trend data from single forecast"""
-        daily = future.groupby(future['ds'].dt.day_name())['trend'].agg('mean')
-        hourly = future.groupby(future['ds'].dt.hour)['trend'].agg('mean')
+        future: 'pd.DataFrame'
+    ) -> Tuple['pd.Series', 'pd.Series']:
+        """
+        helper method to process trend data from single forecast.
+        the trend is linear between forecast points, so it is
+        interpolated onto every hour of the horizon to aggregate
+        coarse forecast points the same as hourly ones
+        """
+        first = future['ds'].iloc[0] - pd.Timedelta(self._offsets[0], 'h')
+        hours = np.arange(1, self._periods + 1)
+        trend = np.interp(hours, self._offsets, future['trend'].to_numpy())
+        ds = first + pd.to_timedelta(hours, unit='h')
+        daily = pd.Series(trend).groupby(ds.day_name()).mean()
+        hourly = pd.Series(trend).groupby(ds.hour).mean()
         return (hourly, daily)
+
+
+def score_history(name: str, model: 'fbprophet.Prophet') -> Timeseries:
+    """
+    function to score each point of the history of a fitted model
+    by how many standard deviations of the fitted observation noise
+    it is from the in-sample prediction. prophet's intervals of
+    historical points only simulate that noise, so the deviation is
+    read off the model instead of sampled, and scores beyond 3 are
+    outside a 99.7% interval. the in-sample prediction reuses the
+    fitted parameters, so nothing is fit again
+
+    Parameters
+    ----------
+    name: str
+        name of the series of scores
+    model: fbprophet.Prophet
+        model fitted on the series to score
+    """
+    history = model.history
+    samples = model.uncertainty_samples
+    # intervals of the history are not needed, skip their simulation
+    model.uncertainty_samples = 0
+    try:
+        fitted = model.predict(history[['ds']])
+    finally:
+        model.uncertainty_samples = samples
+    sigma = float(np.mean(model.params['sigma_obs'])) * model.y_scale
+    residuals = history['y'].to_numpy(dtype=float) - fitted['yhat'].to_numpy()
+    if sigma > 0:
+        scores = residuals / sigma
+    else:
+        scores = np.zeros(len(residuals))
+    return Timeseries.from_df(
+        name=name,
+        df=pd.DataFrame({'ds': history['ds'], 'score': scores}),
+        val_col='score',
+    )
+
+
+def gen_horizon_offsets(
+    periods: int,
+    hourly_periods: int,
+    coarse_hours: int,
+) -> np.ndarray:
+    """
+    function to generate hours after the last point of the history
+    to forecast. hourly for the first hourly_periods hours and every
+    coarse_hours after that, always ending at the end of the horizon
+
+    Parameters
+    ----------
+    periods: int
+        number of hours to forecast for
+    hourly_periods: int
+        number of hours to forecast hourly
+    coarse_hours: int
+        hours between forecast points after hourly_periods
+    """
+    hourly = min(periods, hourly_periods)
+    offsets = np.arange(1, hourly + 1)
+    if periods > hourly:
+        coarse = np.arange(hourly + coarse_hours, periods + 1, coarse_hours)
+        if len(coarse) == 0 or coarse[-1] != periods:
+            coarse = np.append(coarse, periods)
+        offsets = np.concatenate([offsets, coarse])
+    return offsets
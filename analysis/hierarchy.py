@@ -0,0 +1,207 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from metrics.common import Timeseries, sum_series
+from analysis.common import Report, ReporterError, Trend
+from analysis.forecast import FBProphetForecaster, Forecaster, PredictMode
+
+# name of the aggregate of all series, aggregates of groups are
+# named after it like total{job="api"}
+TOTAL_SERIES_NAME = 'total'
+
+
+class HierarchicalForecaster(Forecaster):
+    """
+    HierarchicalForecaster forecasts the sum of series (or the sums
+    of groups of series sharing a label) and distributes each
+    forecast back to its members by their share of the historical
+    total, so hundreds of series take a handful of fits while still
+    getting a forecast each. forecasts of aggregates are part of the
+    report too
+
+    Parameters
+    ----------
+    series: Iterable[Timeseries]
+        list of timeseries data to analyze
+    group_by: Optional[str] (default: None)
+        label to group series by, each group is fit on its own.
+        all series are fit as a single total if not set
+    forecast_days: Optional[int] (default: 7)
+        number of days to forecast for
+    predict_mode: Optional[PredictMode] (default: NONE)
+        uncertainty simulation to run. bounds of members are the
+        bounds of their aggregate scaled by their share
+    hourly_days: Optional[int] (default: 7)
+        number of days of the horizon to forecast hourly
+    coarse_hours: Optional[int] (default: 6)
+        hours between forecast points after hourly_days
+    score_anomalies: Optional[bool] (default: False)
+        whether to score historical points of the aggregates
+        against their in-sample prediction
+    """
+
+    def __init__(
+        self,
+        series: Iterable[Timeseries],
+        group_by: Optional[str] = None,
+        forecast_days: Optional[int] = 7,
+        predict_mode: Optional[PredictMode] = PredictMode.NONE,
+        hourly_days: Optional[int] = 7,
+        coarse_hours: Optional[int] = 6,
+        score_anomalies: Optional[bool] = False,
+    ) -> None:
+        self._series = list(series)
+        self._groups = group_series(series=self._series, group_by=group_by)
+        self._forecaster = FBProphetForecaster(
+            series=[aggregate for aggregate, _ in self._groups],
+            forecast_days=forecast_days,
+            predict_mode=predict_mode,
+            hourly_days=hourly_days,
+            coarse_hours=coarse_hours,
+            score_anomalies=score_anomalies,
+        )
+
+    def get_aggregates(self) -> List[Timeseries]:
+        """method to get the aggregated series that are fit"""
+        return [aggregate for aggregate, _ in self._groups]
+
+    async def forecast(self) -> Optional[Report]:
+        """
+        method to fetch result for the query
+        """
+        report = await self._forecaster.forecast()
+        try:
+            return self._disaggregate(report=report)
+        except Exception as e:
+            raise ReporterError(
+                reporter='HierarchicalForecaster',
+                error=str(e)
+            )
+
+    def _disaggregate(self, report: Report) -> Report:
+        """
+        helper method to distribute forecasts of aggregates to their
+        members
+        """
+        aggregates = {f.get_name(): f for f in report.get_forecasts()}
+        aggregate_bounds = report.get_forecast_bounds() or {}
+        forecasts = []
+        bounds = {}
+        for aggregate, members in self._groups:
+            name = aggregate.get_name() + '_forecast'
+            forecasts.append(aggregates[name])
+            if name in aggregate_bounds:
+                bounds[name] = aggregate_bounds[name]
+            for member, share in zip(members, gen_shares(series=members)):
+                member_name = member.get_name() + '_forecast'
+                forecasts.append(scale_series(
+                    name=member_name,
+                    series=aggregates[name],
+                    factor=share,
+                ))
+                if name in aggregate_bounds:
+                    bounds[member_name] = tuple(
+                        scale_series(
+                            name=f'{member_name}_{bound}',
+                            series=series,
+                            factor=share,
+                        )
+                        for bound, series in zip(
+                            ('lower', 'upper'),
+                            aggregate_bounds[name],
+                        )
+                    )
+        # trends of the report are the average over aggregates, the
+        # average over members is their sum divided by the members
+        factor = len(self._groups) / max(len(self._series), 1)
+        return Report(
+            forecasts=forecasts,
+            daily_trend=scale_trend(report.get_daily_trends(), factor),
+            hourly_trend=scale_trend(report.get_hourly_trends(), factor),
+            forecast_bounds=bounds or None,
+            anomaly_scores=report.get_anomaly_scores(),
+        )
+
+
+def group_series(
+    series: Iterable[Timeseries],
+    group_by: Optional[str] = None,
+) -> List[Tuple[Timeseries, List[Timeseries]]]:
+    """
+    function to group series by the value of a label, in order of
+    first appearance, and sum each group. series without the label
+    are grouped under an empty value
+
+    Parameters
+    ----------
+    series: Iterable[Timeseries]
+        series to group
+    group_by: Optional[str] (default: None)
+        label to group series by. all series are a single group
+        if not set
+    """
+    groups: Dict[str, List[Timeseries]] = {}
+    for data in series:
+        name = TOTAL_SERIES_NAME
+        if group_by:
+            value = data.get_labels().get(group_by, '')
+            name = f'{TOTAL_SERIES_NAME}{{{group_by}="{value}"}}'
+        groups.setdefault(name, []).append(data)
+    return [
+        (sum_series(name=name, series=members), members)
+        for name, members in groups.items()
+    ]
+
+
+def gen_shares(series: Iterable[Timeseries]) -> List[float]:
+    """
+    function to generate the share of each series in the historical
+    total of their sum: the sum of its values over the sum of all of
+    their values. series that only existed for part of the history
+    get the share they contributed over all of it. series share
+    equally if the total is 0
+
+    Parameters
+    ----------
+    series: Iterable[Timeseries]
+        series to generate shares of
+    """
+    sums = np.array([s.get_values().sum() for s in series], dtype=float)
+    total = sums.sum()
+    if len(sums) == 0 or not np.isfinite(total) or total == 0:
+        return [1.0 / max(len(sums), 1)] * len(sums)
+    return (sums / total).tolist()
+
+
+def scale_series(name: str, series: Timeseries, factor: float) -> Timeseries:
+    """
+    function to scale values of a series by a factor
+
+    Parameters
+    ----------
+    name: str
+        name of the scaled series
+    series: Timeseries
+        series to scale
+    factor: float
+        factor to multiply values by
+    """
+    return Timeseries(
+        name=name,
+        columns=(series.get_timestamps(), series.get_values() * factor),
+    )
+
+
+def scale_trend(trend: Trend, factor: float) -> Trend:
+    """
+    function to scale values of a trend by a factor
+
+    Parameters
+    ----------
+    trend: Trend
+        trend to scale
+    factor: float
+        factor to multiply values by
+    """
+    return Trend(trend_vals={
+        key: val * factor for key, val in trend.get_trend_vals().items()
+    })
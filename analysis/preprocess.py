@@ -0,0 +1,126 @@
+from enum import Enum
+from typing import Iterable, List, Optional
+import numpy as np
+from metrics.common import Timeseries
+from utils.instrumentation import time_stage
+
+
+class Aggregation(Enum):
+    """
+    Aggregation is how the points of a series falling in the same
+    interval are combined when resampling
+    """
+    MEAN = 'mean'
+    MAX = 'max'
+    # P95 is the 95th percentile, interpolated linearly between
+    # the closest points like numpy.percentile does
+    P95 = 'p95'
+
+
+class GapFill(Enum):
+    """
+    GapFill is how intervals without points between the first and
+    last point of a series are handled when resampling
+    """
+    # DROP leaves gaps out of the resampled series
+    DROP = 'drop'
+    # LINEAR interpolates gaps from the intervals around them
+    LINEAR = 'linear'
+    # PREVIOUS carries the last interval before a gap forward
+    PREVIOUS = 'previous'
+
+
+class Resampler(object):
+    """
+    Resampler preprocesses Timeseries before they are analyzed. each
+    series is resampled to a fixed resolution, so forecasters fit on
+    a consistent grid whose size only depends on the lookback no
+    matter what resolution the datasource returned. points with
+    missing values are dropped and points with the same timestamp
+    are aggregated like any other points of an interval
+
+    Parameters
+    ----------
+    resolution: int
+        seconds between points of resampled series. 0 means series
+        are passed through as is
+    aggregation: Optional[Aggregation] (default: MEAN)
+        how points in the same interval are combined
+    fill: Optional[GapFill] (default: DROP)
+        how intervals without points are handled
+    """
+
+    def __init__(
+        self,
+        resolution: int,
+        aggregation: Optional[Aggregation] = Aggregation.MEAN,
+        fill: Optional[GapFill] = GapFill.DROP,
+    ) -> None:
+        self._resolution = resolution
+        self._aggregation = aggregation
+        self._fill = fill
+
+    def get_resolution(self) -> int:
+        """method to get seconds between points of resampled series"""
+        return self._resolution
+
+    def resample(self, series: Iterable[Timeseries]) -> List[Timeseries]:
+        """
+        method to resample Timeseries data
+
+        Parameters
+        ----------
+        series: Iterable[Timeseries]
+            list of timeseries data to resample
+        """
+        if self._resolution <= 0:
+            return list(series)
+        resampled = []
+        for data in series:
+            with time_stage(stage='resample'):
+                resampled.append(self._resample_single(data=data))
+        return resampled
+
+    def _resample_single(self, data: Timeseries) -> Timeseries:
+        """helper method to resample a single timeseries"""
+        timestamps = data.get_timestamps()
+        values = data.get_values()
+        present = ~np.isnan(values)
+        if not present.any():
+            return Timeseries(
+                name=data.get_name(),
+                values={},
+                labels=data.get_labels(),
+            )
+        bins = timestamps[present] // self._resolution * self._resolution
+        values = values[present]
+        # sort by interval then value, so every interval is a run of
+        # sorted values and quantiles are positions in the run
+        order = np.lexsort((values, bins))
+        bins = bins[order]
+        values = values[order]
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        counts = np.diff(np.r_[starts, len(bins)])
+        keys = bins[starts]
+        if self._aggregation == Aggregation.MEAN:
+            vals = np.add.reduceat(values, starts) / counts
+        elif self._aggregation == Aggregation.MAX:
+            vals = values[starts + counts - 1]
+        else:
+            pos = starts + 0.95 * (counts - 1)
+            low = np.floor(pos).astype(np.int64)
+            high = np.ceil(pos).astype(np.int64)
+            vals = values[low] + (values[high] - values[low]) * (pos - low)
+        if self._fill != GapFill.DROP:
+            grid = np.arange(keys[0], keys[-1] + 1, self._resolution)
+            if self._fill == GapFill.LINEAR:
+                vals = np.interp(grid, keys, vals)
+            else:
+                vals = vals[np.searchsorted(keys, grid, side='right') - 1]
+            keys = grid
+        return Timeseries.from_arrays(
+            name=data.get_name(),
+            timestamps=keys,
+            values=vals,
+            labels=data.get_labels(),
+        )
@@ -1,22 +1,50 @@
-from typing import Optional, Tuple
+from contextlib import nullcontext
+from typing import List, Optional, Tuple
+import hmac
+import os
+import threading
+import tracemalloc
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import ALL, Input, Output, State
 from dash.dash import no_update
+from flask import Response, abort, jsonify, request
 from structlog import get_logger
 from config import Config
 from utils.tasks import AsyncExecutionError
+from utils.instrumentation import (
+    collect_stage_timings,
+    collect_stage_memory,
+    record_worker_recycle,
+    render_metrics,
+)
+from utils.profiling import Profiler
+from utils.watchdog import RSSWatchdog
+from analysis.forecast import PredictMode
+from analysis.evaluation import Accuracy
 from helpers import (
+    gen_capped_message,
     is_valid_data,
-    get_current_data,
-    generate_analysis_report,
-    gen_forecast_graph_figure,
-    gen_weekly_trend_graph_figure,
-    gen_daily_trend_graph_figure
+    run_analysis,
+    run_evaluation,
+    warm_up,
 )
 
+# header clients can set to log stage timings for their request
+TIMINGS_HEADER = 'X-Capmon-Timings'
+# max number of queries compared in a single analysis
+MAX_QUERIES = 5
+# value of predict mode dropdown using datasource defaults
+DEFAULT_PREDICT_MODE = 'default'
+# values of forecast level dropdown forecasting each series, or
+# totals distributed to series
+SERIES_FORECAST_LEVEL = 'series'
+TOTAL_FORECAST_LEVEL = 'total'
+# value of anomaly checklist option marking anomalies
+ANOMALIES_OPTION = 'anomalies'
+
 # setup app
 app = dash.Dash(
     external_stylesheets=[dbc.themes.BOOTSTRAP]
@@ -28,6 +56,40 @@ server = app.server
 conf = Config()
 # setup logger
 logger = get_logger()
+# setup profiler (only used when profiling is enabled)
+profiler = Profiler(output_dir=conf.get_profile_dir())
+# setup memory accounting
+if conf.get_trace_memory() and not tracemalloc.is_tracing():
+    tracemalloc.start()
+watchdog = RSSWatchdog(max_rss=conf.get_max_worker_rss())
+# set once warm up finished (see warm_up_app)
+ready = threading.Event()
+
+
+def gen_query_fields(index: int) -> html.Div:
+    """
+    function to generate the form fields of a query to analyze
+
+    Parameters
+    ----------
+    index: int
+        index of the query in the form
+    """
+    return html.Div([
+        dbc.Label(f'Query {index + 1}:' if index else 'Query:'),
+        dbc.Input(
+            id={'type': 'query-input', 'index': index},
+            placeholder='Type query here..',
+        ),
+        html.Br(),
+        dbc.Label('Datasource:'),
+        dcc.Dropdown(
+            id={'type': 'query-source', 'index': index},
+            options=conf.gen_source_options(),
+        ),
+        html.Br(),
+    ])
+
 
 # setup app layout
 app.layout = html.Div([
@@ -44,18 +106,15 @@ app.layout = html.Div([
         dbc.Col(
             dbc.FormGroup([
                 html.Br(),
-                # text box to get user query
-                dbc.Label('Query:'),
-                dbc.Input(
-                    id='query-input',
-                    placeholder='Type query here..',
+                # text boxes and datasources of queries to compare
+                html.Div(id='query-fields', children=[gen_query_fields(0)]),
+                dbc.Button(
+                    'Add query',
+                    color='secondary',
+                    size='sm',
+                    id='add-query',
                 ),
                 html.Br(),
-                dbc.Label('Datasource:'),
-                dcc.Dropdown(
-                    id='dropdown',
-                    options=conf.gen_source_options(),
-                ),
                 html.Br(),
                 dbc.Label('Days of metrics to analyze:'),
                 dcc.Slider(
@@ -87,6 +146,63 @@ app.layout = html.Div([
                     id='forecast-slider',
                 ),
                 html.Br(),
+                dbc.Label('Uncertainty intervals:'),
+                dcc.Dropdown(
+                    id='predict-mode-dropdown',
+                    options=[
+                        {
+                            'label': 'Datasource default',
+                            'value': DEFAULT_PREDICT_MODE,
+                        },
+                        {'label': 'None (fastest)', 'value': 'none'},
+                        {'label': 'Fast (100 samples)', 'value': 'fast'},
+                        {'label': 'Full (1000 samples)', 'value': 'full'},
+                    ],
+                    value=DEFAULT_PREDICT_MODE,
+                    clearable=False,
+                ),
+                html.Br(),
+                dbc.Label('Max series per query:'),
+                dbc.Input(
+                    id='max-series-input',
+                    type='number',
+                    min=1,
+                    step=1,
+                    placeholder='Datasource default',
+                ),
+                html.Br(),
+                dbc.Label('Forecast:'),
+                dcc.Dropdown(
+                    id='forecast-level-dropdown',
+                    options=[
+                        {
+                            'label': 'Each series',
+                            'value': SERIES_FORECAST_LEVEL,
+                        },
+                        {
+                            'label': 'Total, split by history',
+                            'value': TOTAL_FORECAST_LEVEL,
+                        },
+                    ],
+                    value=SERIES_FORECAST_LEVEL,
+                    clearable=False,
+                ),
+                dbc.Input(
+                    id='group-label-input',
+                    type='text',
+                    placeholder='Total by label (optional)',
+                ),
+                html.Br(),
+                dbc.Checklist(
+                    id='anomaly-checklist',
+                    options=[{
+                        'label': 'Mark anomalies',
+                        'value': ANOMALIES_OPTION,
+                    }],
+                    value=[],
+                    switch=True,
+                ),
+                html.Br(),
                 dbc.FormText(
                     'Scroll to see trends',
                     color='secondary'
@@ -97,6 +213,15 @@ app.layout = html.Div([
                     dbc.FormText('', color='secondary'),
                     html.Div(id='loading-output-1'),
                 ]),
+                html.Br(),
+                dbc.Spinner([
+                    dbc.Button(
+                        'Evaluate accuracy',
+                        color='secondary',
+                        id='evaluate-query',
+                    ),
+                    html.Div(id='evaluation-status'),
+                ]),
             ]),
             width={'size': 2, 'offset': 1},
             style={
@@ -170,7 +295,15 @@ app.layout = html.Div([
                     ),
                     # end of daily trend graph #
                     # =================================================== #
-                ])
+                ]),
+                # start of accuracy table #
+                # =================================================== #
+                html.Div(
+                    id='evaluation-output',
+                    style={'width': '90%'},
+                ),
+                # end of accuracy table #
+                # =================================================== #
             ]),
             width=9,
             style={
@@ -204,15 +337,64 @@ def handle_query_error(
         no_update,
         no_update,
         no_update,
-        dbc.Alert(
-            'Error: ' + message,
-            color='danger',
-            fade=True,
-            dismissable=True,
-        )
+        gen_error_alert(message=message),
+    )
+
+
+def handle_evaluation_error(message: str) -> Tuple[object, dbc.Alert]:
+    """
+    function to show clients errors for evaluations, leaving the
+    accuracy table as it is
+
+    Parameters
+    ----------
+    message: str
+        message is error message to show clients
+    """
+    return (no_update, gen_error_alert(message=message))
+
+
+def gen_error_alert(message: str) -> dbc.Alert:
+    """
+    function to generate alert showing clients an error
+
+    Parameters
+    ----------
+    message: str
+        message is error message to show clients
+    """
+    return dbc.Alert(
+        'Error: ' + message,
+        color='danger',
+        fade=True,
+        dismissable=True,
     )
 
 
+@app.callback(
+    Output('query-fields', 'children'),
+    [Input('add-query', 'n_clicks')],
+    [State('query-fields', 'children')],
+)
+def add_query_fields(
+    clicks: Optional[int],
+    fields: List[object],
+) -> List[object]:
+    """
+    function to add fields for another query to compare to the form
+
+    Parameters
+    ----------
+    clicks: Optional[int] (default: None)
+        clicks is the number of times add query button was clicked
+    fields: List[object]
+        fields of queries in the form
+    """
+    if clicks is None or len(fields) >= MAX_QUERIES:
+        raise dash.exceptions.PreventUpdate('no update necessary')
+    return fields + [gen_query_fields(len(fields))]
+
+
 @app.callback(
     [
         Output('forecast-graph', 'figure'),
@@ -222,18 +404,32 @@ def handle_query_error(
     ],
     [
         Input('submit-query', 'n_clicks'),
-        Input('dropdown', 'value'),
-        Input('query-input', 'value'),
+        Input({'type': 'query-source', 'index': ALL}, 'value'),
+        Input({'type': 'query-input', 'index': ALL}, 'value'),
         Input('lookback-slider', 'value'),
-        Input('forecast-slider', 'value')
+        Input('forecast-slider', 'value'),
+    ],
+    # analysis options only apply on the next submit, so typing in
+    # them does not refetch and refit
+    [
+        State('predict-mode-dropdown', 'value'),
+        State('max-series-input', 'value'),
+        State('forecast-level-dropdown', 'value'),
+        State('group-label-input', 'value'),
+        State('anomaly-checklist', 'value'),
     ]
 )
 def handle_query(
     clicks: Optional[int],
-    source: Optional[str],
-    query: Optional[str],
+    sources: List[Optional[str]],
+    queries: List[Optional[str]],
     lookback_days: int,
-    forecast_days: int
+    forecast_days: int,
+    predict_mode: Optional[str] = DEFAULT_PREDICT_MODE,
+    max_series: Optional[int] = None,
+    forecast_level: Optional[str] = SERIES_FORECAST_LEVEL,
+    group_label: Optional[str] = None,
+    anomaly_options: Optional[List[str]] = None,
 ) -> Tuple[
     object,
     object,
@@ -247,74 +443,109 @@ def handle_query(
     ----------
     clicks: Optional[int] (default: None)
         clicks is the number of times analysis button was clicked
-    source: Optional[str] (default: None)
-        selected datasource
-    query: Optional[str] (default: None)
-        query to send to datasource
+    sources: List[Optional[str]]
+        selected datasource of each query
+    queries: List[Optional[str]]
+        queries to send to datasources
     lookback_days: int
         number of days of data to analyze
     forecast_days: int
         number of days to forecast for
+    predict_mode: Optional[str] (default: default)
+        uncertainty simulation to run (a PredictMode value), or
+        default to use the defaults of the datasources
+    max_series: Optional[int] (default: None)
+        max number of series to fetch per query, or None to use the
+        series caps of the datasources
+    forecast_level: Optional[str] (default: series)
+        whether to forecast each series, or totals of series split
+        to each series by their historical share
+    group_label: Optional[str] (default: None)
+        label to total series by when forecasting totals
+    anomaly_options: Optional[List[str]] (default: None)
+        checked anomaly options, anomalies are marked on the
+        forecast graph if ANOMALIES_OPTION is checked
     """
     # initial load will cause this to be none
     if clicks is None:
         raise dash.exceptions.PreventUpdate('no update necessary')
     # setup logger
     bound_logger = logger.bind(
-        query=query,
-        source_name=source,
+        queries=queries,
+        source_names=sources,
         lookback_days=lookback_days,
         forecast_days=forecast_days,
+        predict_mode=predict_mode,
+        max_series=max_series,
+        forecast_level=forecast_level,
+        group_label=group_label,
+        anomaly_options=anomaly_options,
     )
     bound_logger.info('recieved analysis query for capmon')
-    # validate input
-    valid, input_error = is_valid_data(
-        source=source,
-        query=query
-    )
-    if not valid:
+    pairs, input_error = parse_form_queries(sources=sources, queries=queries)
+    if input_error is not None:
         return handle_query_error(
             message=input_error
         )
+    if max_series is not None:
+        if max_series < 1:
+            return handle_query_error(message='max series must be positive')
+        max_series = int(max_series)
+    # stage timings are only collected when profiling is enabled
+    # and the client opts in for this request
+    timer = nullcontext()
+    if conf.get_profiling_enabled() and TIMINGS_HEADER in request.headers:
+        timer = collect_stage_timings()
     try:
-        bound_logger.info('fetching query data')
-        # get current data
-        series = get_current_data(
-            conf=conf,
-            source_name=source,
-            query=query,
-            lookback_days=lookback_days,
-        )
-        bound_logger.info('running analysis for data')
-        # generate forecast and trends
-        report = generate_analysis_report(
-            series=series,
-            forecast_days=forecast_days,
-        )
-        bound_logger.info('setting up graphs')
-        # setup graphs
-        forecast_graph = gen_forecast_graph_figure(
-            series=series,
-            report=report,
-        )
+        with timer as timings, collect_stage_memory() as peaks:
+            with profiler.profile(label=gen_profile_label(pairs)):
+                (
+                    forecast_graph,
+                    weekly_graph,
+                    daily_graph,
+                    capped,
+                ) = run_analysis(
+                    conf=conf,
+                    logger=bound_logger,
+                    queries=pairs,
+                    lookback_days=lookback_days,
+                    forecast_days=forecast_days,
+                    predict_mode=parse_predict_mode(predict_mode),
+                    max_series=max_series,
+                    hierarchical=forecast_level == TOTAL_FORECAST_LEVEL,
+                    group_by=parse_group_label(group_label),
+                    anomalies=ANOMALIES_OPTION in (anomaly_options or ()),
+                )
+        if timings is not None:
+            bound_logger = bound_logger.bind(stage_timings=timings)
+        if peaks is not None:
+            bound_logger = bound_logger.bind(stage_peak_memory=peaks)
+        bound_logger.info('finished analysis')
         if forecast_graph is None:
             forecast_graph = no_update
-        weekly_graph = gen_weekly_trend_graph_figure(report=report)
         if weekly_graph is None:
             weekly_graph = no_update
-        daily_graph = gen_daily_trend_graph_figure(report=report)
         if daily_graph is None:
             daily_graph = no_update
-        return (
-            forecast_graph,
-            weekly_graph,
-            daily_graph,
-            dbc.Alert(
+        if capped:
+            status = dbc.Alert(
+                'Finished. Too many series, ' + gen_capped_message(capped),
+                color='warning',
+                fade=True,
+                dismissable=True,
+            )
+        else:
+            status = dbc.Alert(
                 'Finished',
                 color="success",
                 fade=True,
                 dismissable=True,
             )
+        return (
+            forecast_graph,
+            weekly_graph,
+            daily_graph,
+            status,
         )
     except AsyncExecutionError as err:
         bound_logger.error(err.get_message())
@@ -323,6 +554,491 @@ def handle_query(
         )
 
 
+@app.callback(
+    [
+        Output('evaluation-output', 'children'),
+        Output('evaluation-status', 'children'),
+    ],
+    [Input('evaluate-query', 'n_clicks')],
+    [
+        State({'type': 'query-source', 'index': ALL}, 'value'),
+        State({'type': 'query-input', 'index': ALL}, 'value'),
+        State('lookback-slider', 'value'),
+        State('predict-mode-dropdown', 'value'),
+        State('max-series-input', 'value'),
+    ]
+)
+def handle_evaluation(
+    clicks: Optional[int],
+    sources: List[Optional[str]],
+    queries: List[Optional[str]],
+    lookback_days: int,
+    predict_mode: Optional[str] = DEFAULT_PREDICT_MODE,
+    max_series: Optional[int] = None,
+) -> Tuple[object, dbc.Alert]:
+    """
+    function to handle user requests to evaluate the accuracy of
+    forecasts of the queries in the form
+
+    Parameters
+    ----------
+    clicks: Optional[int] (default: None)
+        clicks is the number of times evaluate button was clicked
+    sources: List[Optional[str]]
+        selected datasource of each query
+    queries: List[Optional[str]]
+        queries to send to datasources
+    lookback_days: int
+        number of days of data to backtest on
+    predict_mode: Optional[str] (default: default)
+        uncertainty simulation to run (a PredictMode value), or
+        default to simulate a few samples
+    max_series: Optional[int] (default: None)
+        max number of series to fetch per query, or None to use the
+        series caps of the datasources
+    """
+    if clicks is None:
+        raise dash.exceptions.PreventUpdate('no update necessary')
+    bound_logger = logger.bind(
+        queries=queries,
+        source_names=sources,
+        lookback_days=lookback_days,
+        predict_mode=predict_mode,
+        max_series=max_series,
+        evaluation=True,
+    )
+    bound_logger.info('recieved evaluation query for capmon')
+    pairs, input_error = parse_form_queries(sources=sources, queries=queries)
+    if input_error is None and max_series is not None and max_series < 1:
+        input_error = 'max series must be positive'
+    if input_error is not None:
+        return handle_evaluation_error(message=input_error)
+    try:
+        accuracies, capped = run_evaluation(
+            conf=conf,
+            logger=bound_logger,
+            queries=pairs,
+            lookback_days=lookback_days,
+            predict_mode=parse_predict_mode(predict_mode),
+            max_series=int(max_series) if max_series is not None else None,
+        )
+    except AsyncExecutionError as err:
+        bound_logger.error(err.get_message())
+        return handle_evaluation_error(message=err.get_message())
+    bound_logger.info('finished evaluation')
+    message = 'Evaluated'
+    if capped:
+        message += '. Too many series, ' + gen_capped_message(capped)
+    return (
+        gen_accuracy_table(accuracies=accuracies),
+        dbc.Alert(
+            message,
+            color='warning' if capped else 'success',
+            fade=True,
+            dismissable=True,
+        ),
+    )
+
+
+def gen_accuracy_table(accuracies: List[Accuracy]) -> dbc.Table:
+    """
+    function to generate table of the accuracy of forecasts of
+    each series
+
+    Parameters
+    ----------
+    accuracies: List[Accuracy]
+        accuracy of each series
+    """
+    header = html.Thead(html.Tr([
+        html.Th(column) for column in (
+            'Series', 'Folds', 'MAPE', 'RMSE', 'Interval coverage',
+        )
+    ]))
+    rows = [
+        html.Tr([
+            html.Td(accuracy.get_name()),
+            html.Td(accuracy.get_folds() or 'not enough history'),
+            html.Td(format_metric(accuracy.get_mape(), percent=True)),
+            html.Td(format_metric(accuracy.get_rmse())),
+            html.Td(format_metric(accuracy.get_coverage(), percent=True)),
+        ])
+        for accuracy in accuracies
+    ]
+    return dbc.Table(
+        [header, html.Tbody(rows)],
+        bordered=True,
+        size='sm',
+    )
+
+
+def format_metric(value: Optional[float], percent: bool = False) -> str:
+    """
+    function to format an accuracy metric for display
+
+    Parameters
+    ----------
+    value: Optional[float]
+        value of the metric, None if it was not evaluated
+    percent: bool (default: False)
+        whether to show the value as a percentage
+    """
+    if value is None:
+        return '-'
+    if percent:
+        return f'{value * 100:.1f}%'
+    return f'{value:.4g}'
+
+
+def parse_form_queries(
+    sources: List[Optional[str]],
+    queries: List[Optional[str]],
+) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+    """
+    function to validate queries entered in the form, skipping
+    fields added but left empty. returns datasource and query of
+    each query, and an error message if any of them is invalid
+
+    Parameters
+    ----------
+    sources: List[Optional[str]]
+        selected datasource of each query
+    queries: List[Optional[str]]
+        queries to send to datasources
+    """
+    pairs = []
+    for index, (source, query) in enumerate(zip(sources, queries)):
+        if index > 0 and not source and not query:
+            continue
+        valid, input_error = is_valid_data(source=source, query=query)
+        if not valid:
+            return (pairs, input_error)
+        pairs.append((source, query))
+    return (pairs, None)
+
+
+def parse_body_queries(
+    body: dict,
+) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+    """
+    function to validate queries of a json request body, given as
+    {"source", "query"} or {"queries": [{"source", "query"}, ...]}.
+    returns datasource and query of each query, and an error
+    message if they are invalid
+
+    Parameters
+    ----------
+    body: dict
+        json request body
+    """
+    queries = body.get('queries') or [body]
+    if not isinstance(queries, list) or len(queries) > MAX_QUERIES:
+        return ([], f'queries must be a list of up to {MAX_QUERIES} queries')
+    pairs = []
+    for query in queries:
+        if not isinstance(query, dict):
+            return ([], 'queries must have source and query')
+        pair = (query.get('source'), query.get('query'))
+        valid, input_error = is_valid_data(source=pair[0], query=pair[1])
+        if not valid:
+            return ([], input_error)
+        pairs.append(pair)
+    return (pairs, None)
+
+
+def parse_predict_mode(value: Optional[str]) -> Optional[PredictMode]:
+    """
+    function to parse predict mode selected for a request. returns
+    None to use the defaults of the datasources
+
+    Parameters
+    ----------
+    value: Optional[str]
+        PredictMode value or DEFAULT_PREDICT_MODE
+    """
+    if value is None or value == DEFAULT_PREDICT_MODE:
+        return None
+    return PredictMode(value)
+
+
+def parse_group_label(value: Optional[str]) -> Optional[str]:
+    """
+    function to parse label to total series by for a request.
+    returns None to total all series together
+
+    Parameters
+    ----------
+    value: Optional[str]
+        label entered
+    """
+    if value is None or not value.strip():
+        return None
+    return value.strip()
+
+
+def gen_profile_label(queries: List[Tuple[str, str]]) -> str:
+    """
+    function to generate label of profiles of an analysis
+
+    Parameters
+    ----------
+    queries: List[Tuple[str, str]]
+        datasource and query of each query analyzed
+    """
+    return ', '.join(f'{source}: {query}' for source, query in queries)
+
+
+@server.after_request
+def recycle_worker_over_rss_budget(response: Response) -> Response:
+    """
+    function to gracefully recycle the gunicorn worker after the
+    request if it is over its RSS budget
+    """
+    if not watchdog.is_enabled():
+        return response
+    software = request.environ.get('SERVER_SOFTWARE', '')
+    if not software.startswith('gunicorn'):
+        return response
+    rss = watchdog.check()
+    if rss is not None:
+        record_worker_recycle()
+        logger.warning(
+            'recycling worker over rss budget',
+            pid=os.getpid(),
+            rss=rss,
+            max_rss=conf.get_max_worker_rss(),
+        )
+    return response
+
+
+def warm_up_app() -> None:
+    """
+    function to warm up the analysis stack (unless disabled) and
+    mark the app ready. gunicorn_conf.py runs it in the master when
+    the app is preloaded, so forked workers share the warm state
+    """
+    if ready.is_set():
+        return
+    if conf.get_warm_up():
+        try:
+            timings = warm_up()
+            logger.info(
+                'finished warm up',
+                pid=os.getpid(),
+                stage_timings=timings,
+            )
+        except Exception as err:
+            # a failed warm up only costs the first request its speed
+            logger.error('unable to warm up', pid=os.getpid(), error=str(err))
+    ready.set()
+
+
+@server.route('/ready')
+def readiness() -> Response:
+    """
+    endpoint to check if the app finished warming up and is ready
+    to serve analyses
+    """
+    if not ready.is_set():
+        return jsonify(ready=False), 503
+    return jsonify(ready=True)
+
+
+@server.route('/metrics')
+def metrics() -> Response:
+    """
+    endpoint to expose capmon metrics in prometheus format
+    """
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+def is_authorized(token: str) -> bool:
+    """
+    function to check if request carries a token as bearer token
+
+    Parameters
+    ----------
+    token: str
+        token the request must carry
+    """
+    expected = 'Bearer ' + token
+    received = request.headers.get('Authorization', '')
+    return hmac.compare_digest(received.encode(), expected.encode())
+
+
+@server.route('/debug/profile', methods=['GET', 'POST'])
+def debug_profile() -> Response:
+    """
+    endpoint to profile analyses under cProfile. disabled unless
+    CAPMON_PROFILING_TOKEN is set and requires it as bearer token.
+
+    GET lists saved profile summaries. POST with {"analyses": N}
+    profiles the next N analyses handled by the worker serving the
+    request. POST with {"source", "query", "lookback_days",
+    "forecast_days"} profiles that analysis right away and returns
+    its summary. queries to compare can be given as {"queries":
+    [{"source", "query"}, ...]} instead of source and query,
+    "predict_mode" selects the uncertainty simulation to run,
+    "max_series" caps the number of series fetched per query and
+    "forecast_level" of "total" forecasts totals of series (by the
+    label "group_by" if set) split to each series and "anomalies"
+    of true scores historical points against the fitted models
+    """
+    if not conf.get_profiling_enabled():
+        abort(404)
+    if not is_authorized(conf.get_profiling_token()):
+        abort(401)
+    if request.method == 'GET':
+        return jsonify(
+            pid=os.getpid(),
+            remaining=profiler.get_remaining(),
+            results=profiler.get_saved_results(),
+        )
+    body = request.get_json(silent=True) or {}
+    try:
+        if 'query' not in body and 'queries' not in body:
+            profiler.arm(count=int(body.get('analyses', 1)))
+            return jsonify(pid=os.getpid(), remaining=profiler.get_remaining())
+        lookback_days = int(body.get('lookback_days', 7))
+        forecast_days = int(body.get('forecast_days', 7))
+        max_series = body.get('max_series')
+        if max_series is not None:
+            max_series = int(max_series)
+    except (TypeError, ValueError):
+        return jsonify(
+            error='analyses, days and max_series must be integers',
+        ), 400
+    try:
+        predict_mode = parse_predict_mode(body.get('predict_mode'))
+    except ValueError:
+        return jsonify(error='unsupported predict_mode'), 400
+    forecast_level = body.get('forecast_level', SERIES_FORECAST_LEVEL)
+    if forecast_level not in (SERIES_FORECAST_LEVEL, TOTAL_FORECAST_LEVEL):
+        return jsonify(error='unsupported forecast_level'), 400
+    group_by = body.get('group_by')
+    if group_by is not None and not isinstance(group_by, str):
+        return jsonify(error='group_by must be a label'), 400
+    anomalies = body.get('anomalies', False)
+    if not isinstance(anomalies, bool):
+        return jsonify(error='anomalies must be a boolean'), 400
+    pairs, input_error = parse_body_queries(body=body)
+    if input_error is not None:
+        return jsonify(error=input_error), 400
+    bound_logger = logger.bind(
+        queries=pairs,
+        lookback_days=lookback_days,
+        forecast_days=forecast_days,
+        profiling=True,
+    )
+    bound_logger.info('recieved profiling query for capmon')
+    try:
+        with collect_stage_timings() as timings:
+            label = gen_profile_label(pairs)
+            with profiler.profile(label=label, force=True):
+                run_analysis(
+                    conf=conf,
+                    logger=bound_logger,
+                    queries=pairs,
+                    lookback_days=lookback_days,
+                    forecast_days=forecast_days,
+                    predict_mode=predict_mode,
+                    max_series=max_series,
+                    hierarchical=forecast_level == TOTAL_FORECAST_LEVEL,
+                    group_by=parse_group_label(group_by),
+                    anomalies=anomalies,
+                )
+    except AsyncExecutionError as err:
+        bound_logger.error(err.get_message())
+        return jsonify(error=err.get_message()), 502
+    result = profiler.get_last_result().to_dict()
+    result['stage_timings'] = timings
+    bound_logger.info('finished profiling', path=result['path'])
+    return jsonify(result)
+
+
+@server.route('/api/v1/evaluate', methods=['POST'])
+def evaluate() -> Response:
+    """
+    endpoint to evaluate the accuracy of forecasts of queries with
+    rolling origin backtests. POST with {"source", "query",
+    "lookback_days"} (or {"queries": [{"source", "query"}, ...]} to
+    evaluate several queries) returns MAPE, RMSE and coverage of
+    uncertainty intervals of each series. "predict_mode" selects the
+    uncertainty simulation to run, "max_series" caps the number of
+    series fetched per query, "horizon_days" sets the days forecast
+    by each fold and "folds" the max number of folds per series.
+    disabled unless CAPMON_EVALUATION_TOKEN is set and requires it
+    as bearer token, since each evaluation fits models in a pool of
+    processes
+    """
+    if not conf.get_evaluation_token():
+        abort(404)
+    if not is_authorized(conf.get_evaluation_token()):
+        abort(401)
+    body = request.get_json(silent=True) or {}
+    try:
+        lookback_days = int(body.get('lookback_days', 7))
+        max_series = body.get('max_series')
+        if max_series is not None:
+            max_series = int(max_series)
+        horizon_days = body.get('horizon_days')
+        if horizon_days is not None:
+            horizon_days = float(horizon_days)
+        folds = body.get('folds')
+        if folds is not None:
+            folds = int(folds)
+    except (TypeError, ValueError):
+        return jsonify(
+            error='days, max_series and folds must be numbers',
+        ), 400
+    if lookback_days < 1 or (max_series is not None and max_series < 1):
+        return jsonify(
+            error='lookback_days and max_series must be positive',
+        ), 400
+    if (horizon_days is not None and horizon_days <= 0) or (
+        folds is not None and folds < 1
+    ):
+        return jsonify(error='horizon_days and folds must be positive'), 400
+    try:
+        predict_mode = parse_predict_mode(body.get('predict_mode'))
+    except ValueError:
+        return jsonify(error='unsupported predict_mode'), 400
+    pairs, input_error = parse_body_queries(body=body)
+    if input_error is not None:
+        return jsonify(error=input_error), 400
+    bound_logger = logger.bind(
+        queries=pairs,
+        lookback_days=lookback_days,
+        horizon_days=horizon_days,
+        folds=folds,
+        evaluation=True,
+    )
+    bound_logger.info('recieved evaluation query for capmon')
+    try:
+        accuracies, capped = run_evaluation(
+            conf=conf,
+            logger=bound_logger,
+            queries=pairs,
+            lookback_days=lookback_days,
+            predict_mode=predict_mode,
+            max_series=max_series,
+            horizon_days=horizon_days,
+            folds=folds,
+        )
+    except AsyncExecutionError as err:
+        bound_logger.error(err.get_message())
+        return jsonify(error=err.get_message()), 502
+    bound_logger.info('finished evaluation')
+    return jsonify(
+        series=[accuracy.to_dict() for accuracy in accuracies],
+        capped={
+            label: {'kept': kept, 'total': total}
+            for label, (kept, total) in capped.items()
+        },
+    )
+
+
 if __name__ == "__main__":
     logger.info(
         'starting application',
@@ -332,6 +1048,7 @@ if __name__ == "__main__":
         port=conf.get_port(),
         workers=conf.get_workers(),
     )
+    threading.Thread(target=warm_up_app, daemon=True).start()
     app.run_server(
         host=conf.get_host(),
         debug=conf.get_debug(),
@@ -0,0 +1,277 @@
+from typing import Dict, Iterable, Optional
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# suffixes of result metrics where lower values are better
+LOWER_IS_BETTER = ('_s', '_bytes')
+# suffixes of result metrics where higher values are better
+HIGHER_IS_BETTER = ('_ops',)
+# absolute changes below these are treated as noise
+MIN_DELTA = {
+    '_s': 0.01,
+    '_bytes': 1024 * 1024,
+}
+
+
+def quiet_logs() -> None:
+    """
+    function to silence chatty library loggers (i.e cmdstanpy)
+    so benchmark output stays readable
+    """
+    for name in ('cmdstanpy', 'fbprophet', 'prophet', 'aiohttp.access'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def median_results(
+    runs: Iterable[Dict[str, float]]
+) -> Dict[str, float]:
+    """
+    function to reduce repeated runs to the median of each metric
+
+    Parameters
+    ----------
+    runs: Iterable[Dict[str, float]]
+        metrics for each run
+    """
+    runs = list(runs)
+    keys = sorted({key for run in runs for key in run})
+    return {
+        key: statistics.median(run[key] for run in runs if key in run)
+        for key in keys
+    }
+
+
+def gen_meta() -> Dict[str, str]:
+    """function to describe the environment results were taken in"""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = 'unknown'
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'revision': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def write_results(
+    path: str,
+    suite: str,
+    results: Dict[str, Dict[str, float]],
+    params: Optional[Dict[str, object]] = None,
+) -> None:
+    """
+    function to write benchmark results as json
+
+    Parameters
+    ----------
+    path: str
+        file to write results to
+    suite: str
+        name of the benchmark suite
+    results: Dict[str, Dict[str, float]]
+        metrics for each scenario
+    params: Optional[Dict[str, object]] (default: None)
+        parameters the suite was run with
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as results_file:
+        json.dump(
+            {
+                'suite': suite,
+                'meta': gen_meta(),
+                'params': params or {},
+                'results': results,
+            },
+            results_file,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def load_results(path: str) -> Dict[str, Dict[str, float]]:
+    """
+    function to load results of a benchmark suite from json
+
+    Parameters
+    ----------
+    path: str
+        file to load results from
+    """
+    with open(path) as results_file:
+        return json.load(results_file)['results']
+
+
+def compare_to_baseline(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> Iterable[str]:
+    """
+    function to find metrics that regressed against a baseline by
+    more than the tolerance. only scenarios and metrics present in
+    both are compared and changes below MIN_DELTA are ignored
+
+    Parameters
+    ----------
+    results: Dict[str, Dict[str, float]]
+        metrics for each scenario
+    baseline: Dict[str, Dict[str, float]]
+        baseline metrics for each scenario
+    tolerance: float
+        allowed relative regression (i.e 0.2 for 20%)
+    """
+    regressions = []
+    for scenario in sorted(results):
+        if scenario not in baseline:
+            continue
+        for key, value in sorted(results[scenario].items()):
+            base = baseline[scenario].get(key)
+            if not base:
+                continue
+            change = (value - base) / base
+            if key.endswith(HIGHER_IS_BETTER):
+                change = -change
+            elif not key.endswith(LOWER_IS_BETTER):
+                continue
+            min_delta = next(
+                (
+                    delta for suffix, delta in MIN_DELTA.items()
+                    if key.endswith(suffix)
+                ),
+                0.0,
+            )
+            if abs(value - base) < min_delta:
+                continue
+            if change > tolerance:
+                regressions.append(
+                    f'{scenario} {key}: {value:.6g} vs baseline '
+                    f'{base:.6g} ({change:+.0%} worse)'
+                )
+    return regressions
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    """
+    function to print results as a readable table
+
+    Parameters
+    ----------
+    results: Dict[str, Dict[str, float]]
+        metrics for each scenario
+    """
+    for scenario in sorted(results):
+        print(scenario)
+        for key, value in sorted(results[scenario].items()):
+            print(f'    {key:<40} {value:>16.6g}')
+
+
+def add_result_args(
+    parser: argparse.ArgumentParser,
+    suite: str,
+    tolerance: Optional[float] = 0.25,
+) -> None:
+    """
+    function to add arguments for writing results and comparing
+    them against a baseline to a suite's argument parser
+
+    Parameters
+    ----------
+    parser: argparse.ArgumentParser
+        argument parser of the suite
+    suite: str
+        name of the benchmark suite
+    tolerance: Optional[float] (default: 0.25)
+        default allowed relative regression against baseline
+    """
+    parser.add_argument(
+        '--output',
+        default=f'benchmarks/results/{suite}.json',
+        help='file to write results to',
+    )
+    parser.add_argument(
+        '--baseline',
+        default=None,
+        help='baseline results file to compare against',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=tolerance,
+        help='allowed relative regression against baseline',
+    )
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help='write results to the baseline file instead of comparing',
+    )
+
+
+def report_results(
+    suite: str,
+    results: Dict[str, Dict[str, float]],
+    args: argparse.Namespace,
+) -> int:
+    """
+    function to print and write results of a suite and compare them
+    against the baseline (or save them as the baseline). returns the
+    exit code for the suite, which is 1 if anything regressed
+
+    Parameters
+    ----------
+    suite: str
+        name of the benchmark suite
+    results: Dict[str, Dict[str, float]]
+        metrics for each scenario
+    args: argparse.Namespace
+        parsed arguments including those from add_result_args
+    """
+    params = vars(args)
+    print_results(results)
+    write_results(
+        path=args.output,
+        suite=suite,
+        results=results,
+        params=params,
+    )
+    if args.baseline is None:
+        return 0
+    if args.save_baseline:
+        write_results(
+            path=args.baseline,
+            suite=suite,
+            results=results,
+            params=params,
+        )
+        return 0
+    if not os.path.exists(args.baseline):
+        print(
+            f'no baseline at {args.baseline}, '
+            'record one with --save-baseline',
+            file=sys.stderr,
+        )
+        return 0
+    regressions = compare_to_baseline(
+        results=results,
+        baseline=load_results(args.baseline),
+        tolerance=args.tolerance,
+    )
+    for regression in regressions:
+        print(f'REGRESSION {regression}', file=sys.stderr)
+    return 1 if regressions else 0
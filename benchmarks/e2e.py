@@ -0,0 +1,324 @@
+"""
+end to end benchmark of capmon against local stand-ins for
+prometheus and graphite. measures get_current_data ->
+generate_analysis_report -> figure generation with per-stage
+timings and memory.
+
+usage: python -m benchmarks.e2e --help
+"""
+from typing import Dict, Iterable
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import yaml
+from benchmarks.common import (
+    quiet_logs,
+    median_results,
+    add_result_args,
+    report_results,
+)
+from benchmarks.fake_sources import FakeDatasourceServer
+from analysis.forecast import PredictMode
+from config import Config
+from helpers import (
+    get_current_data,
+    generate_analysis_report,
+    gen_forecast_graph_figure,
+    gen_weekly_trend_graph_figure,
+    gen_daily_trend_graph_figure,
+)
+from utils.instrumentation import (
+    collect_stage_timings,
+    collect_stage_memory,
+    time_stage,
+)
+
+# datasources configured against the fake server, with their format
+SOURCES = {
+    'prometheus': ('prometheus', 'json'),
+    'prometheus-remote-read': ('prometheus', 'protobuf'),
+    'graphite': ('graphite', 'json'),
+    'graphite-msgpack': ('graphite', 'msgpack'),
+    'graphite-pickle': ('graphite', 'pickle'),
+}
+# forecast levels, forecasting each series or their total split
+# to each series
+FORECAST_LEVELS = ('series', 'total')
+
+
+def write_config(url: str, sources: Iterable[str]) -> str:
+    """
+    function to write capmon datasource config pointing at the fake
+    server and return its path
+
+    Parameters
+    ----------
+    url: str
+        base url of the fake server
+    sources: Iterable[str]
+        names of datasources to configure (keys of SOURCES)
+    """
+    datasources = []
+    for name in sources:
+        source_type, render_format = SOURCES[name]
+        datasource = {'name': name, 'source': url, 'type': source_type}
+        if render_format != 'json':
+            datasource['format'] = render_format
+        datasources.append(datasource)
+    handle, path = tempfile.mkstemp(prefix='capmon-bench-', suffix='.yml')
+    with os.fdopen(handle, 'w') as config_file:
+        yaml.safe_dump({'datasources': datasources}, config_file)
+    return path
+
+
+def gen_query(source: str, series: int, index: int = 0) -> str:
+    """
+    function to generate query the fake server answers with series.
+    queries of different index are different queries for the same
+    series
+    """
+    parts = ['capmon', 'bench'] + ([f'q{index}'] if index else [])
+    separator = '_' if source.startswith('prometheus') else '.'
+    return separator.join(parts + [str(series)])
+
+
+def run_once(
+    conf: Config,
+    source: str,
+    queries: Iterable[str],
+    lookback_days: int,
+    forecast_days: int,
+    predict_mode: PredictMode,
+    hierarchical: bool = False,
+) -> Dict[str, float]:
+    """
+    function to run a single analysis and time each phase and stage
+
+    Parameters
+    ----------
+    conf: Config
+        capmon config with the fake datasources
+    source: str
+        datasource to query
+    queries: Iterable[str]
+        queries to run and analyze together
+    lookback_days: int
+        number of days of data to analyze
+    forecast_days: int
+        number of days to forecast for
+    predict_mode: PredictMode
+        uncertainty simulation to run when forecasting
+    hierarchical: bool (default: False)
+        whether to forecast the total of series split to each series
+    """
+    with collect_stage_timings() as stages, collect_stage_memory() as peaks:
+        start = time.perf_counter()
+        series, _ = get_current_data(
+            conf=conf,
+            queries=[(source, query) for query in queries],
+            lookback_days=lookback_days,
+        )
+        fetched = time.perf_counter()
+        series = conf.get_resampler().resample(series=series)
+        resampled = time.perf_counter()
+        report = generate_analysis_report(
+            series=series,
+            forecast_days=forecast_days,
+            predict_mode=predict_mode,
+            hourly_days=conf.get_forecast_hourly_days(),
+            coarse_hours=conf.get_forecast_coarse_hours(),
+            hierarchical=hierarchical,
+        )
+        analyzed = time.perf_counter()
+        with time_stage(stage='figure'):
+            gen_forecast_graph_figure(series=series, report=report)
+            gen_weekly_trend_graph_figure(report=report)
+            gen_daily_trend_graph_figure(report=report)
+        done = time.perf_counter()
+    result = {
+        'get_current_data_s': fetched - start,
+        'resample_s': resampled - fetched,
+        'generate_analysis_report_s': analyzed - resampled,
+        'figures_s': done - analyzed,
+        'total_s': done - start,
+        'series': float(len(series)),
+        'points': float(sum(s.get_length() for s in series)),
+    }
+    for stage, elapsed in stages.items():
+        result[f'stage_{stage}_s'] = elapsed
+    for stage, peak in (peaks or {}).items():
+        result[f'stage_{stage}_peak_bytes'] = float(peak)
+    return result
+
+
+def run_scenario(
+    conf: Config,
+    source: str,
+    series: int,
+    queries: int,
+    lookback_days: int,
+    forecast_days: int,
+    predict_mode: PredictMode,
+    repeat: int,
+    memory: bool,
+    hierarchical: bool = False,
+) -> Dict[str, float]:
+    """
+    function to run a scenario repeatedly and reduce to medians. if
+    memory is set, an extra traced run measures per stage peaks so
+    tracing does not skew the timings
+    """
+    queries = [
+        gen_query(source=source, series=series, index=index)
+        for index in range(queries)
+    ]
+    runs = [
+        run_once(
+            conf=conf,
+            source=source,
+            queries=queries,
+            lookback_days=lookback_days,
+            forecast_days=forecast_days,
+            predict_mode=predict_mode,
+            hierarchical=hierarchical,
+        )
+        for _ in range(repeat)
+    ]
+    result = median_results(runs)
+    if memory:
+        tracemalloc.start()
+        try:
+            traced = run_once(
+                conf=conf,
+                source=source,
+                queries=queries,
+                lookback_days=lookback_days,
+                forecast_days=forecast_days,
+                predict_mode=predict_mode,
+                hierarchical=hierarchical,
+            )
+            result['peak_bytes'] = float(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+        for key, value in traced.items():
+            if key.endswith('_bytes'):
+                result[key] = value
+    return result
+
+
+def parse_args() -> argparse.Namespace:
+    """function to parse command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sources',
+        nargs='+',
+        default=['prometheus', 'graphite'],
+        choices=sorted(SOURCES),
+        help='datasource types to benchmark',
+    )
+    parser.add_argument(
+        '--series',
+        nargs='+',
+        type=int,
+        default=[1, 10],
+        help='number of series per query',
+    )
+    parser.add_argument(
+        '--queries',
+        nargs='+',
+        type=int,
+        default=[1],
+        help='number of queries fetched concurrently and analyzed together',
+    )
+    parser.add_argument('--lookback-days', type=int, default=7)
+    parser.add_argument('--forecast-days', type=int, default=7)
+    parser.add_argument(
+        '--predict-modes',
+        nargs='+',
+        default=[PredictMode.NONE.value],
+        choices=[mode.value for mode in PredictMode],
+        help='uncertainty simulation to run when forecasting',
+    )
+    parser.add_argument(
+        '--forecast-levels',
+        nargs='+',
+        default=['series'],
+        choices=FORECAST_LEVELS,
+        help='forecast each series or their total split to each series',
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.05,
+        help='seconds of simulated datasource latency',
+    )
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0.02,
+        help='max seconds of extra random datasource latency',
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--no-memory',
+        action='store_true',
+        help='skip the traced run measuring memory',
+    )
+    add_result_args(parser=parser, suite='e2e')
+    return parser.parse_args()
+
+
+def main() -> int:
+    """function to run the end to end benchmark suite"""
+    args = parse_args()
+    quiet_logs()
+    with FakeDatasourceServer(
+        latency=args.latency,
+        jitter=args.jitter,
+    ) as server:
+        config_path = write_config(url=server.get_url(), sources=args.sources)
+        os.environ['CAPMON_CONFIG_PATH'] = config_path
+        try:
+            conf = Config()
+            results = {}
+            for source in args.sources:
+                for series, queries, mode, level in itertools.product(
+                    args.series,
+                    args.queries,
+                    map(PredictMode, args.predict_modes),
+                    args.forecast_levels,
+                ):
+                    name = (
+                        f'{source}/series={series}/'
+                        + (f'queries={queries}/' if queries > 1 else '')
+                        + f'lookback={args.lookback_days}d/'
+                        f'forecast={args.forecast_days}d'
+                    )
+                    if mode != PredictMode.NONE:
+                        name += f'/predict={mode.value}'
+                    if level != 'series':
+                        name += f'/forecast_level={level}'
+                    print(f'running {name}', file=sys.stderr)
+                    results[name] = run_scenario(
+                        conf=conf,
+                        source=source,
+                        series=series,
+                        queries=queries,
+                        lookback_days=args.lookback_days,
+                        forecast_days=args.forecast_days,
+                        predict_mode=mode,
+                        repeat=args.repeat,
+                        memory=not args.no_memory,
+                        hierarchical=level == 'total',
+                    )
+        finally:
+            os.remove(config_path)
+    return report_results(suite='e2e', results=results, args=args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,492 @@
+from typing import Dict, Iterable, Optional, Tuple
+import asyncio
+import pickle
+import re
+import threading
+import time
+import numpy as np
+import msgpack
+import snappy
+from aiohttp import web
+from metrics.prompb import decode_message, get_message_class
+from utils.cache import TTL_HEADER, MemoryCache
+
+# seconds per unit for prometheus/graphite style durations
+DURATION_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+}
+# graphite summarize target (i.e summarize(bench.10,"1h"))
+SUMMARIZE_RE = re.compile(
+    r'^summarize\((?P<query>.+?),"(?P<step>\w+)"(,"(?P<func>\w+)")?\)$'
+)
+# promql and graphite functions ranking series (i.e (bench_10) and
+# topk(5, avg_over_time(...)) or highestAverage(bench.10,5)). series
+# are ranked by their average over the range either way
+RANK_RES = (
+    re.compile(
+        r'^\((?P<query>.+?)\) and (?P<func>topk|bottomk)'
+        r'\((?P<limit>\d+), avg_over_time\(.+\)\)$'
+    ),
+    re.compile(
+        r'^(?P<func>highestAverage|lowestAverage)'
+        r'\((?P<query>.+),(?P<limit>\d+)\)$'
+    ),
+)
+# promql and graphite functions aggregating series into one
+AGGREGATE_RE = re.compile(
+    r'^(?P<func>count|sum|countSeries|sumSeries)\((?P<query>.+)\)$'
+)
+# number of series to generate can be given at the end of queries
+# (i.e bench_10 or bench.10), otherwise server default is used
+SERIES_COUNT_RE = re.compile(r'[_.](?P<count>\d+)$')
+# seconds between raw samples returned by prometheus remote reads
+SCRAPE_INTERVAL = 60
+# max bytes the stand-in cache service keeps per cache
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def parse_duration(duration: str) -> int:
+    """
+    function to parse duration (i.e 1h or 3600) into seconds
+
+    Parameters
+    ----------
+    duration: str
+        duration to parse
+    """
+    duration = duration.strip()
+    if duration[-1] in DURATION_UNITS:
+        return int(float(duration[:-1]) * DURATION_UNITS[duration[-1]])
+    return int(float(duration))
+
+
+def gen_seasonal_values(
+    timestamps: np.ndarray,
+    index: int,
+    seed: Optional[int] = 0,
+) -> np.ndarray:
+    """
+    function to generate synthetic seasonal metric values with a
+    daily and weekly cycle, a linear trend and noise
+
+    Parameters
+    ----------
+    timestamps: np.ndarray
+        unix timestamps to generate values for
+    index: int
+        index of the series, used to vary shape between series
+    seed: Optional[int] (default: 0)
+        seed for the noise
+    """
+    rng = np.random.default_rng(seed + index)
+    hours = (timestamps - timestamps[0]) / 3600.0
+    base = 100.0 + 10.0 * index
+    daily = 20.0 * np.sin(2 * np.pi * (hours + index) / 24.0)
+    weekly = 10.0 * np.sin(2 * np.pi * hours / 168.0)
+    trend = 0.05 * hours
+    noise = rng.normal(0.0, 2.0, len(timestamps))
+    return base + daily + weekly + trend + noise
+
+
+def gen_series(
+    count: int,
+    start: int,
+    end: int,
+    step: int,
+    seed: Optional[int] = 0,
+) -> Iterable[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    function to generate synthetic seasonal series
+
+    Parameters
+    ----------
+    count: int
+        number of series to generate
+    start: int
+        unix timestamp of first point
+    end: int
+        unix timestamp of last point
+    step: int
+        seconds between points
+    seed: Optional[int] (default: 0)
+        seed for the noise
+    """
+    start = start - (start % step)
+    timestamps = np.arange(start, end + 1, step, dtype=np.int64)
+    return [
+        (
+            f'capmon_bench_{i}',
+            timestamps,
+            gen_seasonal_values(timestamps=timestamps, index=i, seed=seed),
+        )
+        for i in range(count)
+    ]
+
+
+def gen_prometheus_response(
+    series: Iterable[Tuple[str, np.ndarray, np.ndarray]]
+) -> dict:
+    """
+    function to generate prometheus range query response for series
+
+    Parameters
+    ----------
+    series: Iterable[Tuple[str, np.ndarray, np.ndarray]]
+        name, timestamps and values of each series
+    """
+    result = []
+    for name, timestamps, values in series:
+        result.append({
+            'metric': {
+                '__name__': name,
+                'instance': 'localhost:9090',
+                'job': 'capmon_bench',
+            },
+            'values': [
+                [ts, repr(val)]
+                for ts, val in zip(timestamps.tolist(), values.tolist())
+            ],
+        })
+    return {
+        'status': 'success',
+        'data': {
+            'resultType': 'matrix',
+            'result': result,
+        },
+    }
+
+
+def gen_prometheus_read_response(
+    series: Iterable[Tuple[str, np.ndarray, np.ndarray]]
+) -> bytes:
+    """
+    function to generate snappy compressed prometheus remote read
+    response with raw samples of series
+
+    Parameters
+    ----------
+    series: Iterable[Tuple[str, np.ndarray, np.ndarray]]
+        name, timestamps and values of each series
+    """
+    response = get_message_class('ReadResponse')()
+    result = response.results.add()
+    for name, timestamps, values in series:
+        timeseries = result.timeseries.add()
+        timeseries.labels.add(name='__name__', value=name)
+        timeseries.labels.add(name='job', value='capmon_bench')
+        sample_class = get_message_class('Sample')
+        timeseries.samples.extend(
+            sample_class(value=val, timestamp=ts * 1000)
+            for ts, val in zip(timestamps.tolist(), values.tolist())
+        )
+    return snappy.compress(response.SerializeToString())
+
+
+def gen_graphite_json(
+    series: Iterable[Tuple[str, np.ndarray, np.ndarray]]
+) -> Iterable[dict]:
+    """
+    function to generate graphite json render response for series
+
+    Parameters
+    ----------
+    series: Iterable[Tuple[str, np.ndarray, np.ndarray]]
+        name, timestamps and values of each series
+    """
+    return [
+        {
+            'target': name,
+            'tags': {'name': name},
+            'datapoints': [
+                [val, ts]
+                for ts, val in zip(timestamps.tolist(), values.tolist())
+            ],
+        }
+        for name, timestamps, values in series
+    ]
+
+
+def gen_graphite_info(
+    series: Iterable[Tuple[str, np.ndarray, np.ndarray]]
+) -> Iterable[Dict[str, object]]:
+    """
+    function to generate graphite msgpack/pickle render response
+    for evenly spaced series
+
+    Parameters
+    ----------
+    series: Iterable[Tuple[str, np.ndarray, np.ndarray]]
+        name, timestamps and values of each series
+    """
+    infos = []
+    for name, timestamps, values in series:
+        step = 1
+        if len(timestamps) > 1:
+            step = int(timestamps[1] - timestamps[0])
+        infos.append({
+            'name': name,
+            'pathExpression': name,
+            'start': int(timestamps[0]),
+            'end': int(timestamps[-1]) + step,
+            'step': step,
+            'values': values.tolist(),
+        })
+    return infos
+
+
+class FakeDatasourceServer(object):
+    """
+    FakeDatasourceServer is a local stand-in for prometheus
+    (/api/v1/query_range and /api/v1/read) and graphite (/render)
+    serving synthetic seasonal series. it runs in a background
+    thread with its own event loop so synchronous capmon code can
+    query it. remote reads return raw samples every SCRAPE_INTERVAL
+    seconds like a prometheus scraping the series would. it also
+    stands in for the network cache service of http caches under
+    /cache (without simulated latency)
+
+    Parameters
+    ----------
+    series: Optional[int] (default: 10)
+        number of series to return for queries that do not end with
+        a series count (i.e bench_25 returns 25 series)
+    latency: Optional[float] (default: 0.05)
+        seconds to wait before responding to each request
+    jitter: Optional[float] (default: 0.0)
+        max extra seconds of random latency per request
+    host: Optional[str] (default: 127.0.0.1)
+        host to bind server to
+    port: Optional[int] (default: 0)
+        port to bind server to (0 picks a free port)
+    """
+
+    def __init__(
+        self,
+        series: Optional[int] = 10,
+        latency: Optional[float] = 0.05,
+        jitter: Optional[float] = 0.0,
+        host: Optional[str] = '127.0.0.1',
+        port: Optional[int] = 0,
+    ) -> None:
+        self._series = series
+        self._latency = latency
+        self._jitter = jitter
+        self._host = host
+        self._port = port
+        self._rng = np.random.default_rng(0)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._started = threading.Event()
+        self._caches: Dict[str, MemoryCache] = {}
+
+    def get_url(self) -> str:
+        """method to get base url of the server"""
+        return f'http://{self._host}:{self._port}'
+
+    def get_cache_url(self) -> str:
+        """method to get base url of the stand-in cache service"""
+        return f'{self.get_url()}/cache'
+
+    def start(self) -> None:
+        """method to start server in a background thread"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self) -> None:
+        """method to stop server"""
+        if self._loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(
+            self._runner.cleanup(),
+            self._loop,
+        )
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def create_app(self) -> web.Application:
+        """method to setup the fake datasource application"""
+        app = web.Application()
+        app.router.add_get('/api/v1/query_range', self._handle_query_range)
+        app.router.add_post('/api/v1/read', self._handle_read)
+        app.router.add_get('/render', self._handle_render)
+        app.router.add_get('/cache/{name}/{key}', self._handle_cache_get)
+        app.router.add_put('/cache/{name}/{key}', self._handle_cache_put)
+        return app
+
+    def _run(self) -> None:
+        """helper method to run server loop"""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.create_app())
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self._host, self._port)
+        self._loop.run_until_complete(site.start())
+        self._port = self._runner.addresses[0][1]
+        self._started.set()
+        self._loop.run_forever()
+
+    async def _wait(self) -> None:
+        """helper method to simulate datasource latency"""
+        delay = self._latency
+        if self._jitter:
+            delay += self._rng.uniform(0.0, self._jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _count_for_query(self, query: str) -> int:
+        """helper method to get number of series to return for query"""
+        match = SERIES_COUNT_RE.search(query)
+        if match is None:
+            return self._series
+        return int(match.group('count'))
+
+    def _gen_query_series(
+        self,
+        query: str,
+        start: int,
+        end: int,
+        step: int,
+    ) -> Iterable[Tuple[str, np.ndarray, np.ndarray]]:
+        """
+        helper method to generate series of a query, evaluating the
+        functions series caps are pushed down with
+        """
+        match = AGGREGATE_RE.match(query)
+        if match is not None:
+            series = self._gen_query_series(
+                query=match.group('query'),
+                start=start,
+                end=end,
+                step=step,
+            )
+            timestamps = series[0][1]
+            if match.group('func').startswith('count'):
+                values = np.full(len(timestamps), float(len(series)))
+            else:
+                values = np.sum([values for _, _, values in series], axis=0)
+            return [(match.group('func'), timestamps, values)]
+        for rank_re in RANK_RES:
+            match = rank_re.match(query)
+            if match is None:
+                continue
+            series = self._gen_query_series(
+                query=match.group('query'),
+                start=start,
+                end=end,
+                step=step,
+            )
+            means = np.array([np.mean(values) for _, _, values in series])
+            if match.group('func') in ('topk', 'highestAverage'):
+                means = -means
+            keep = np.argsort(means)[:int(match.group('limit'))]
+            return [series[i] for i in sorted(keep)]
+        return gen_series(
+            count=self._count_for_query(query),
+            start=start,
+            end=end,
+            step=step,
+        )
+
+    async def _handle_query_range(self, request: web.Request) -> web.Response:
+        """helper method to serve prometheus range queries"""
+        await self._wait()
+        params = request.query
+        series = self._gen_query_series(
+            query=params['query'],
+            start=int(float(params['start'])),
+            end=int(float(params['end'])),
+            step=parse_duration(params['step']),
+        )
+        return web.json_response(data=gen_prometheus_response(series))
+
+    async def _handle_read(self, request: web.Request) -> web.Response:
+        """helper method to serve prometheus remote reads"""
+        await self._wait()
+        read_request = decode_message(
+            name='ReadRequest',
+            body=snappy.uncompress(await request.read()),
+        )
+        query = read_request.queries[0]
+        names = [
+            matcher.value for matcher in query.matchers
+            if matcher.name == '__name__'
+        ]
+        series = gen_series(
+            count=self._count_for_query(names[0] if names else ''),
+            start=query.start_timestamp_ms // 1000,
+            end=query.end_timestamp_ms // 1000,
+            step=SCRAPE_INTERVAL,
+        )
+        return web.Response(
+            body=gen_prometheus_read_response(series),
+            content_type='application/x-protobuf',
+            headers={'Content-Encoding': 'snappy'},
+        )
+
+    async def _handle_render(self, request: web.Request) -> web.Response:
+        """helper method to serve graphite render requests"""
+        await self._wait()
+        params = request.query
+        match = SUMMARIZE_RE.match(params['target'])
+        if match is None:
+            return web.json_response(data=[])
+        end = int(time.time())
+        start = end - parse_duration(params['from'].lstrip('-'))
+        step = parse_duration(match.group('step'))
+        series = self._gen_query_series(
+            query=match.group('query'),
+            start=start,
+            end=end,
+            step=step,
+        )
+        render_format = params.get('format', 'json')
+        if render_format == 'json':
+            return web.json_response(data=gen_graphite_json(series))
+        infos = gen_graphite_info(series)
+        if render_format == 'msgpack':
+            body = msgpack.packb(infos, use_bin_type=True)
+        else:
+            body = pickle.dumps(infos, protocol=-1)
+        return web.Response(body=body)
+
+    def _get_cache(self, name: str) -> MemoryCache:
+        """helper method to get stand-in cache by name"""
+        if name not in self._caches:
+            self._caches[name] = MemoryCache(
+                name=name,
+                max_bytes=CACHE_MAX_BYTES,
+            )
+        return self._caches[name]
+
+    async def _handle_cache_get(self, request: web.Request) -> web.Response:
+        """helper method to serve lookups of http caches"""
+        cache = self._get_cache(name=request.match_info['name'])
+        value = cache.get(key=request.match_info['key'])
+        if value is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=value)
+
+    async def _handle_cache_put(self, request: web.Request) -> web.Response:
+        """helper method to serve writes of http caches"""
+        cache = self._get_cache(name=request.match_info['name'])
+        cache.set(
+            key=request.match_info['key'],
+            value=await request.read(),
+            ttl=float(request.headers.get(TTL_HEADER, 0)),
+        )
+        return web.Response(status=204)
@@ -0,0 +1,149 @@
+"""
+import time benchmark of capmon worker boot. imports app (what every
+gunicorn worker does before serving requests) in fresh interpreters
+under python -X importtime and reports the time to import app, the
+time of each of its direct imports and the time to warm up the
+modules capmon imports lazily.
+
+usage: python -m benchmarks.imports --help
+"""
+from typing import Dict, Iterable
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from benchmarks.common import (
+    median_results,
+    add_result_args,
+    report_results,
+)
+
+# script timing boot of a worker and the warm up of lazy modules
+BOOT_SCRIPT = '''
+import json
+import time
+start = time.perf_counter()
+import app
+booted = time.perf_counter()
+from utils.imports import import_lazy_modules
+report = import_lazy_modules()
+warmed = time.perf_counter()
+print(json.dumps({
+    'boot': booted - start,
+    'warm_up': warmed - booted,
+    'lazy': report,
+}))
+'''
+# line python -X importtime writes for each imported module
+IMPORT_TIME_RE = re.compile(
+    r'^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \|'
+    r'(?P<indent>\s*)(?P<module>\S+)$'
+)
+
+
+def parse_import_times(
+    output: Iterable[str],
+    parent: str,
+) -> Dict[str, float]:
+    """
+    function to parse seconds each direct import of a module took
+    from python -X importtime output
+
+    Parameters
+    ----------
+    output: Iterable[str]
+        lines python -X importtime wrote to stderr
+    parent: str
+        module to get direct imports of
+    """
+    lines = []
+    for line in output:
+        match = IMPORT_TIME_RE.match(line)
+        if match is not None:
+            lines.append((
+                len(match.group('indent')) // 2,
+                match.group('module'),
+                int(match.group('cumulative')) / 1e6,
+            ))
+    # children are reported before the module importing them, so walk
+    # back from the parent to collect imports one level below it
+    times = {}
+    for index, (depth, module, _) in enumerate(lines):
+        if module != parent:
+            continue
+        for child_depth, child, cumulative in reversed(lines[:index]):
+            if child_depth <= depth:
+                break
+            if child_depth == depth + 1:
+                times[child] = cumulative
+        break
+    return times
+
+
+def run_once(min_module_time: float) -> Dict[str, float]:
+    """
+    function to boot a worker in a fresh interpreter and time it
+
+    Parameters
+    ----------
+    min_module_time: float
+        min seconds a direct import of app must take to be reported
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        path for path in (os.getcwd(), env.get('PYTHONPATH')) if path
+    )
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    boot = json.loads(process.stdout.strip().splitlines()[-1])
+    result = {
+        'import_app_s': boot['boot'],
+        'warm_up_s': boot['warm_up'],
+    }
+    for module, seconds in boot['lazy'].items():
+        if seconds is not None:
+            result[f'lazy_{module}_s'] = seconds
+    modules = parse_import_times(
+        output=process.stderr.splitlines(),
+        parent='app',
+    )
+    for module, seconds in modules.items():
+        if seconds >= min_module_time:
+            result[f'app_{module}_s'] = seconds
+    return result
+
+
+def parse_args() -> argparse.Namespace:
+    """function to parse command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--min-module-time',
+        type=float,
+        default=0.005,
+        help='min seconds a direct import of app must take to be reported',
+    )
+    add_result_args(parser=parser, suite='imports')
+    return parser.parse_args()
+
+
+def main() -> int:
+    """function to run the import time benchmark suite"""
+    args = parse_args()
+    runs = []
+    for run in range(args.repeat):
+        print(f'booting worker {run + 1}/{args.repeat}', file=sys.stderr)
+        runs.append(run_once(min_module_time=args.min_module_time))
+    results = {'boot': median_results(runs)}
+    return report_results(suite='imports', results=results, args=args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
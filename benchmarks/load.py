@@ -0,0 +1,646 @@
+"""
+load test of a gunicorn launched capmon (app:server) against local
+stand-ins for prometheus and graphite. virtual users drive the dash
+callback endpoint of handle_query (or other endpoints) concurrently
+and throughput and latency percentiles are reported per concurrency
+level.
+
+usage: python -m benchmarks.load --help
+"""
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+import numpy as np
+from benchmarks.common import add_result_args, report_results
+from benchmarks.e2e import SOURCES, gen_query, write_config
+from benchmarks.fake_sources import FakeDatasourceServer
+from utils.cache import CacheBackend
+
+# dash endpoint callbacks are served from
+DASH_CALLBACK_PATH = '/_dash-update-component'
+# outputs of the handle_query callback
+ANALYSIS_OUTPUTS = (
+    ('forecast-graph', 'figure'),
+    ('weekly-graph', 'figure'),
+    ('daily-graph', 'figure'),
+    ('loading-output-1', 'children'),
+)
+# seconds to wait for gunicorn to start serving
+STARTUP_TIMEOUT = 120
+
+
+def gen_analysis_payload(
+    source: str,
+    query: str,
+    lookback_days: int,
+    forecast_days: int,
+) -> dict:
+    """
+    function to generate the request dash makes to run handle_query
+    when the analyze button is clicked
+
+    Parameters
+    ----------
+    source: str
+        datasource to query
+    query: str
+        query to run
+    lookback_days: int
+        number of days of data to analyze
+    forecast_days: int
+        number of days to forecast for
+    """
+    output = '...'.join(
+        f'{component}.{prop}' for component, prop in ANALYSIS_OUTPUTS
+    )
+    return {
+        'output': f'..{output}..',
+        'outputs': [
+            {'id': component, 'property': prop}
+            for component, prop in ANALYSIS_OUTPUTS
+        ],
+        'inputs': [
+            {'id': 'submit-query', 'property': 'n_clicks', 'value': 1},
+            [{
+                'id': {'index': 0, 'type': 'query-source'},
+                'property': 'value',
+                'value': source,
+            }],
+            [{
+                'id': {'index': 0, 'type': 'query-input'},
+                'property': 'value',
+                'value': query,
+            }],
+            {
+                'id': 'lookback-slider',
+                'property': 'value',
+                'value': lookback_days,
+            },
+            {
+                'id': 'forecast-slider',
+                'property': 'value',
+                'value': forecast_days,
+            },
+        ],
+        'state': [
+            {
+                'id': 'predict-mode-dropdown',
+                'property': 'value',
+                'value': 'default',
+            },
+            {
+                'id': 'max-series-input',
+                'property': 'value',
+                'value': None,
+            },
+            {
+                'id': 'forecast-level-dropdown',
+                'property': 'value',
+                'value': 'series',
+            },
+            {
+                'id': 'group-label-input',
+                'property': 'value',
+                'value': None,
+            },
+            {
+                'id': 'anomaly-checklist',
+                'property': 'value',
+                'value': [],
+            },
+        ],
+        'changedPropIds': ['submit-query.n_clicks'],
+    }
+
+
+def is_analysis_error(body: dict) -> bool:
+    """
+    function to check if a handle_query response shows the client
+    an error alert instead of results
+
+    Parameters
+    ----------
+    body: dict
+        json body of the callback response
+    """
+    try:
+        alert = body['response']['loading-output-1']['children']
+        return alert['props'].get('color') == 'danger'
+    except (KeyError, TypeError):
+        return True
+
+
+class Target(object):
+    """
+    Target is an endpoint virtual users send requests to
+
+    Parameters
+    ----------
+    method: str
+        http method of requests
+    path: str
+        path of the endpoint
+    payload: Optional[dict] (default: None)
+        json body of requests
+    is_error: Optional[Callable[[dict], bool]] (default: None)
+        function to check if a successful json response holds an
+        error (i.e dash callbacks report errors with status 200)
+    """
+
+    def __init__(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[dict] = None,
+        is_error: Optional[Callable[[dict], bool]] = None,
+    ) -> None:
+        self._method = method
+        self._path = path
+        self._payload = payload
+        self._is_error = is_error
+
+    def get_path(self) -> str:
+        """method to get path of the endpoint"""
+        return self._path
+
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+    ) -> bool:
+        """
+        method to send a request to the endpoint and check if it
+        succeeded
+
+        Parameters
+        ----------
+        session: aiohttp.ClientSession
+            session to send request with
+        url: str
+            base url of capmon
+        """
+        async with session.request(
+            method=self._method,
+            url=url + self._path,
+            json=self._payload,
+        ) as response:
+            if response.status != 200:
+                await response.read()
+                return False
+            if self._is_error is None:
+                await response.read()
+                return True
+            return not self._is_error(await response.json())
+
+
+def gen_targets(
+    source: str,
+    series: int,
+    lookback_days: int,
+    forecast_days: int,
+) -> Dict[str, Target]:
+    """
+    function to generate the endpoints load can be generated against
+
+    Parameters
+    ----------
+    source: str
+        datasource analyses query
+    series: int
+        number of series analyses query
+    lookback_days: int
+        number of days of data to analyze
+    forecast_days: int
+        number of days to forecast for
+    """
+    return {
+        'analysis': Target(
+            method='POST',
+            path=DASH_CALLBACK_PATH,
+            payload=gen_analysis_payload(
+                source=source,
+                query=gen_query(source=source, series=series),
+                lookback_days=lookback_days,
+                forecast_days=forecast_days,
+            ),
+            is_error=is_analysis_error,
+        ),
+        'metrics': Target(method='GET', path='/metrics'),
+    }
+
+
+async def run_user(
+    session: aiohttp.ClientSession,
+    url: str,
+    target: Target,
+    deadline: float,
+    latencies: list,
+) -> int:
+    """
+    function to run a virtual user sending requests back to back
+    until the deadline. appends latency of each successful request
+    and returns the number of failed requests
+
+    Parameters
+    ----------
+    session: aiohttp.ClientSession
+        session to send requests with
+    url: str
+        base url of capmon
+    target: Target
+        endpoint to send requests to
+    deadline: float
+        time.perf_counter value to stop sending requests at
+    latencies: list
+        list to append latency of successful requests to
+    """
+    errors = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            ok = await target.request(session=session, url=url)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors += 1
+    return errors
+
+
+async def run_level(
+    url: str,
+    target: Target,
+    users: int,
+    duration: float,
+    timeout: float,
+) -> Dict[str, float]:
+    """
+    function to run a concurrency level and summarize its latencies.
+    requests still in flight at the deadline are completed and
+    counted, so throughput is computed over the full elapsed time
+
+    Parameters
+    ----------
+    url: str
+        base url of capmon
+    target: Target
+        endpoint to send requests to
+    users: int
+        number of concurrent virtual users
+    duration: float
+        seconds to keep starting requests for
+    timeout: float
+        seconds after which a request is failed
+    """
+    latencies = []
+    connector = aiohttp.TCPConnector(limit=users)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as session:
+        start = time.perf_counter()
+        errors = await asyncio.gather(*[
+            run_user(
+                session=session,
+                url=url,
+                target=target,
+                deadline=start + duration,
+                latencies=latencies,
+            )
+            for _ in range(users)
+        ])
+        elapsed = time.perf_counter() - start
+    result = {
+        'requests': float(len(latencies) + sum(errors)),
+        'errors': float(sum(errors)),
+        'throughput_ops': len(latencies) / elapsed,
+    }
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        result.update({
+            'latency_p50_s': float(p50),
+            'latency_p95_s': float(p95),
+            'latency_p99_s': float(p99),
+            'latency_max_s': float(max(latencies)),
+        })
+    return result
+
+
+def find_free_port(host: str) -> int:
+    """function to find a free port to bind to"""
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def start_capmon(
+    config_path: str,
+    host: str,
+    port: int,
+    workers: int,
+    threads: int,
+    preload: bool,
+    log_path: str,
+    cache_backend: str,
+    cache_url: str,
+) -> Tuple[subprocess.Popen, str]:
+    """
+    function to launch capmon with gunicorn the way run_server.sh
+    does and return the process with its metrics directory
+
+    Parameters
+    ----------
+    config_path: str
+        capmon config with the fake datasources
+    host: str
+        host to bind capmon to
+    port: int
+        port to bind capmon to
+    workers: int
+        number of gunicorn workers
+    threads: int
+        number of threads per gunicorn worker
+    preload: bool
+        whether to load and warm up the app before forking workers
+    log_path: str
+        file to write gunicorn output to
+    cache_backend: str
+        backend of the query and report caches
+    cache_url: str
+        base url of the cache service of http caches
+    """
+    metrics_dir = tempfile.mkdtemp(prefix='capmon-load-metrics-')
+    env = dict(os.environ)
+    env.update({
+        'CAPMON_CONFIG_PATH': config_path,
+        'CAPMON_HOST': host,
+        'CAPMON_PORT': str(port),
+        'CAPMON_WORKERS': str(workers),
+        'CAPMON_PRELOAD': 'yes' if preload else 'no',
+        'CAPMON_CACHE_BACKEND': cache_backend,
+        'CAPMON_CACHE_URL': cache_url,
+        'prometheus_multiproc_dir': metrics_dir,
+    })
+    with open(log_path, 'w') as log_file:
+        process = subprocess.Popen(
+            [
+                sys.executable, '-m', 'gunicorn',
+                '--config=gunicorn_conf.py',
+                f'--threads={threads}',
+                '--timeout=300',
+                'app:server',
+            ],
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+    return process, metrics_dir
+
+
+async def wait_until_ready(
+    process: subprocess.Popen,
+    url: str,
+    path: str,
+) -> None:
+    """
+    function to wait until capmon serves requests
+
+    Parameters
+    ----------
+    process: subprocess.Popen
+        gunicorn process
+    url: str
+        base url of capmon
+    path: str
+        path to poll
+    """
+    deadline = time.perf_counter() + STARTUP_TIMEOUT
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('capmon exited before serving requests')
+            try:
+                async with session.get(url + path) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError('timed out waiting for capmon to serve requests')
+
+
+def stop_capmon(process: subprocess.Popen, metrics_dir: str) -> None:
+    """function to gracefully stop gunicorn and cleanup"""
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+async def run_levels(
+    url: str,
+    targets: Iterable[str],
+    source: str,
+    args: argparse.Namespace,
+) -> Dict[str, Dict[str, float]]:
+    """
+    function to run every concurrency level against each target
+
+    Parameters
+    ----------
+    url: str
+        base url of capmon
+    targets: Iterable[str]
+        names of targets to load
+    source: str
+        datasource analyses query
+    args: argparse.Namespace
+        parsed arguments
+    """
+    available = gen_targets(
+        source=source,
+        series=args.series,
+        lookback_days=args.lookback_days,
+        forecast_days=args.forecast_days,
+    )
+    results = {}
+    for name in targets:
+        target = available[name]
+        # warm up every worker so startup costs are not measured
+        await run_level(
+            url=url,
+            target=target,
+            users=args.workers,
+            duration=args.warmup,
+            timeout=args.timeout,
+        )
+        for users in args.concurrency:
+            scenario = f'{name}/{source}/series={args.series}/users={users}'
+            print(f'running {scenario}', file=sys.stderr)
+            results[scenario] = await run_level(
+                url=url,
+                target=target,
+                users=users,
+                duration=args.duration,
+                timeout=args.timeout,
+            )
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    """function to parse command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--targets',
+        nargs='+',
+        default=['analysis'],
+        choices=['analysis', 'metrics'],
+        help='endpoints to generate load against',
+    )
+    parser.add_argument(
+        '--source',
+        default='prometheus',
+        choices=sorted(SOURCES),
+        help='datasource type analyses query',
+    )
+    parser.add_argument(
+        '--series',
+        type=int,
+        default=1,
+        help='number of series per query',
+    )
+    parser.add_argument('--lookback-days', type=int, default=7)
+    parser.add_argument('--forecast-days', type=int, default=7)
+    parser.add_argument(
+        '--concurrency',
+        nargs='+',
+        type=int,
+        default=[1, 2, 4, 8],
+        help='numbers of concurrent virtual users to run',
+    )
+    parser.add_argument(
+        '--duration',
+        type=float,
+        default=15.0,
+        help='seconds to run each concurrency level for',
+    )
+    parser.add_argument(
+        '--warmup',
+        type=float,
+        default=5.0,
+        help='seconds to warm up workers for before measuring',
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=120.0,
+        help='seconds after which a request is failed',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=2,
+        help='number of gunicorn workers',
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=1,
+        help='number of threads per gunicorn worker',
+    )
+    parser.add_argument(
+        '--no-preload',
+        action='store_true',
+        help='warm up each worker instead of preloading the app',
+    )
+    parser.add_argument(
+        '--cache-backend',
+        default='none',
+        choices=[backend.value for backend in CacheBackend],
+        help='backend of the query and report caches. repeated '
+        'requests are served from the cache unless it is none, http '
+        'caches use the stand-in cache service of the fake datasources',
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.05,
+        help='seconds of simulated datasource latency',
+    )
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0.02,
+        help='max seconds of extra random datasource latency',
+    )
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='host to bind capmon to',
+    )
+    parser.add_argument(
+        '--log',
+        default='benchmarks/results/load-gunicorn.log',
+        help='file to write gunicorn output to',
+    )
+    add_result_args(parser=parser, suite='load')
+    return parser.parse_args()
+
+
+def main() -> int:
+    """function to run the load test suite"""
+    args = parse_args()
+    os.makedirs(os.path.dirname(args.log) or '.', exist_ok=True)
+    with FakeDatasourceServer(
+        latency=args.latency,
+        jitter=args.jitter,
+    ) as datasources:
+        config_path = write_config(
+            url=datasources.get_url(),
+            sources=[args.source],
+        )
+        port = find_free_port(host=args.host)
+        url = f'http://{args.host}:{port}'
+        process, metrics_dir = start_capmon(
+            config_path=config_path,
+            host=args.host,
+            port=port,
+            workers=args.workers,
+            threads=args.threads,
+            preload=not args.no_preload,
+            log_path=args.log,
+            cache_backend=args.cache_backend,
+            cache_url=datasources.get_cache_url(),
+        )
+        try:
+            asyncio.run(wait_until_ready(
+                process=process,
+                url=url,
+                path='/ready',
+            ))
+            results = asyncio.run(run_levels(
+                url=url,
+                targets=args.targets,
+                source=args.source,
+                args=args,
+            ))
+        finally:
+            stop_capmon(process=process, metrics_dir=metrics_dir)
+            os.remove(config_path)
+    return report_results(suite='load', results=results, args=args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""
+micro benchmarks of capmon hot paths (Timeseries conversions,
+datasource response decoders, trend processing, figure building
+and serialization of figures and reports) across a matrix of series
+counts and lengths. reports throughput and allocations of each.
+
+usage: python -m benchmarks.micro --help
+"""
+from typing import Callable, Dict, Iterable
+import argparse
+import asyncio
+import atexit
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import msgpack
+import snappy
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from plotly.utils import PlotlyJSONEncoder
+from benchmarks.common import (
+    quiet_logs,
+    add_result_args,
+    report_results,
+)
+from benchmarks.fake_sources import (
+    gen_series,
+    gen_prometheus_response,
+    gen_prometheus_read_response,
+    gen_graphite_json,
+    gen_graphite_info,
+)
+from analysis.common import Report
+from analysis.forecast import FBProphetForecaster
+from helpers import gen_forecast_graph_figure
+from metrics.common import Timeseries
+from metrics.file import FileQuery
+from metrics.graphite import GraphiteQuery
+from metrics.prometheus import PrometheusQuery
+from utils.clients import ResponseFormat
+
+# timestamp synthetic series end at
+END = 1595823193
+# seconds between synthetic points
+STEP = 3600
+
+
+def gen_timeseries(count: int, length: int) -> Iterable[Timeseries]:
+    """function to generate synthetic Timeseries"""
+    return [
+        Timeseries.from_arrays(name=name, timestamps=ts, values=vals)
+        for name, ts, vals in gen_series(
+            count=count,
+            start=END - (length - 1) * STEP,
+            end=END,
+            step=STEP,
+        )
+    ]
+
+
+def setup_get_dataframe(count: int, length: int) -> Callable[[], object]:
+    """benchmark Timeseries.get_dataframe"""
+    series = gen_timeseries(count=count, length=length)
+    return lambda: [s.get_dataframe() for s in series]
+
+
+def setup_from_df(count: int, length: int) -> Callable[[], object]:
+    """benchmark Timeseries.from_df on prophet style forecast frames"""
+    frames = []
+    for s in gen_timeseries(count=count, length=length):
+        df = s.get_dataframe().rename(columns={'y': 'yhat'})
+        frames.append((s.get_name(), df))
+    return lambda: [
+        Timeseries.from_df(name=name, df=df, time_col='ds', val_col='yhat')
+        for name, df in frames
+    ]
+
+
+def setup_prometheus_decode(count: int, length: int) -> Callable[[], object]:
+    """benchmark decoding prometheus json range responses"""
+    body = json.dumps(gen_prometheus_response(gen_series(
+        count=count,
+        start=END - (length - 1) * STEP,
+        end=END,
+        step=STEP,
+    ))).encode()
+    query = PrometheusQuery(query='capmon_bench')
+
+    def decode() -> Iterable[Timeseries]:
+        return query._decode_range_result(json.loads(body))
+    return decode
+
+
+def setup_prometheus_remote_read_decode(
+    count: int,
+    length: int,
+) -> Callable[[], object]:
+    """benchmark decoding prometheus remote read responses"""
+    start = END - (length - 1) * STEP
+    body = gen_prometheus_read_response(gen_series(
+        count=count,
+        start=start,
+        end=END,
+        step=STEP,
+    ))
+    query = PrometheusQuery(
+        query='capmon_bench',
+        response_format=ResponseFormat.PROTOBUF,
+    )
+
+    def decode() -> Iterable[Timeseries]:
+        return query._decode_read_response(
+            body=snappy.uncompress(body),
+            start=start,
+            end=END,
+            step=STEP,
+        )
+    return decode
+
+
+def setup_graphite_decode(
+    render_format: ResponseFormat
+) -> Callable[[int, int], Callable[[], object]]:
+    """benchmark decoding graphite render responses in a format"""
+    def setup(count: int, length: int) -> Callable[[], object]:
+        series = gen_series(
+            count=count,
+            start=END - (length - 1) * STEP,
+            end=END,
+            step=STEP,
+        )
+        if render_format == ResponseFormat.JSON:
+            body = json.dumps(gen_graphite_json(series)).encode()
+            loads = json.loads
+        else:
+            body = msgpack.packb(gen_graphite_info(series), use_bin_type=True)
+            loads = msgpack.unpackb
+        query = GraphiteQuery(
+            query='capmon.bench',
+            render_format=render_format,
+        )
+
+        def decode() -> Iterable[Timeseries]:
+            vals = query._decode_result(loads(body))
+            return [
+                Timeseries.from_arrays(
+                    name=name,
+                    timestamps=vals[name][1],
+                    values=vals[name][2],
+                    labels=vals[name][0],
+                )
+                for name in vals
+            ]
+        return decode
+    return setup
+
+
+def setup_file_parquet_read(
+    count: int,
+    length: int,
+) -> Callable[[], object]:
+    """
+    benchmark reading a series from a parquet file with a day per row
+    group, where the file holds a year of hourly points of all series
+    """
+    series = gen_series(
+        count=count,
+        start=END - (24 * 365 - 1) * STEP,
+        end=END,
+        step=STEP,
+    )
+    columns = {'timestamp': series[0][1]}
+    columns.update({name: vals for name, _, vals in series})
+    directory = tempfile.mkdtemp(prefix='capmon-bench-')
+    atexit.register(shutil.rmtree, directory, True)
+    pq.write_table(
+        pa.table(columns),
+        os.path.join(directory, 'bench.parquet'),
+        row_group_size=24,
+    )
+    days = int(np.ceil(length / 24))
+    query = FileQuery(
+        query='capmon_bench_*',
+        source=directory,
+        lookback_days=days,
+    )
+    return query._read
+
+
+def setup_process_trends(count: int, length: int) -> Callable[[], object]:
+    """benchmark FBProphetForecaster._process_trends_single"""
+    forecaster = FBProphetForecaster(series=[])
+    frames = []
+    for s in gen_timeseries(count=count, length=length):
+        frames.append(s.get_dataframe().rename(columns={'y': 'trend'}))
+    loop = asyncio.new_event_loop()
+
+    def process() -> object:
+        return [
+            loop.run_until_complete(
+                forecaster._process_trends_single(future=df)
+            )
+            for df in frames
+        ]
+    return process
+
+
+def setup_forecast_figure(count: int, length: int) -> Callable[[], object]:
+    """benchmark gen_forecast_graph_figure"""
+    series = gen_timeseries(count=count, length=length)
+    forecasts = []
+    for s in series:
+        raw = s.get_raw_vals()
+        forecasts.append(Timeseries(
+            name=s.get_name() + '_forecast',
+            values={ts + length * STEP: val for ts, val in raw.items()},
+        ))
+    report = Report(forecasts=forecasts)
+    return lambda: gen_forecast_graph_figure(series=series, report=report)
+
+
+def setup_forecast_figure_json(
+    count: int,
+    length: int,
+) -> Callable[[], object]:
+    """
+    benchmark gen_forecast_graph_figure and serializing the figure
+    like dash serializes callback responses
+    """
+    figure = setup_forecast_figure(count=count, length=length)
+    return lambda: json.dumps(figure(), cls=PlotlyJSONEncoder)
+
+
+def setup_report_to_bytes(count: int, length: int) -> Callable[[], object]:
+    """benchmark Report.to_bytes"""
+    report = Report(forecasts=gen_timeseries(count=count, length=length))
+    return report.to_bytes
+
+
+def setup_report_from_bytes(
+    count: int,
+    length: int,
+) -> Callable[[], object]:
+    """benchmark Report.from_bytes"""
+    data = setup_report_to_bytes(count=count, length=length)()
+    return lambda: Report.from_bytes(data)
+
+
+BENCHMARKS = {
+    'get_dataframe': setup_get_dataframe,
+    'from_df': setup_from_df,
+    'prometheus_decode': setup_prometheus_decode,
+    'prometheus_remote_read_decode': setup_prometheus_remote_read_decode,
+    'graphite_json_decode': setup_graphite_decode(ResponseFormat.JSON),
+    'graphite_msgpack_decode': setup_graphite_decode(ResponseFormat.MSGPACK),
+    'file_parquet_read': setup_file_parquet_read,
+    'process_trends': setup_process_trends,
+    'forecast_figure': setup_forecast_figure,
+    'forecast_figure_json': setup_forecast_figure_json,
+    'report_to_bytes': setup_report_to_bytes,
+    'report_from_bytes': setup_report_from_bytes,
+}
+
+
+def measure(op: Callable[[], object], min_time: float) -> Dict[str, float]:
+    """
+    function to measure throughput and allocations of an operation.
+    like timeit, the operation is repeated with gc disabled for at
+    least min_time seconds (and at least 3 times) and the fastest
+    call is used, as slower calls are mostly noise from the machine
+
+    Parameters
+    ----------
+    op: Callable[[], object]
+        operation to measure
+    min_time: float
+        min seconds to spend repeating the operation
+    """
+    op()
+    times = []
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        while len(times) < 3 or time.perf_counter() - started < min_time:
+            start = time.perf_counter()
+            op()
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    per_op = min(times)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = op()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return {
+        'time_per_op_s': per_op,
+        'throughput_ops': 1.0 / per_op,
+        'alloc_peak_bytes': float(peak - before),
+        'alloc_retained_bytes': float(current - before),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """function to parse command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--benchmarks',
+        nargs='+',
+        default=sorted(BENCHMARKS),
+        choices=sorted(BENCHMARKS),
+        help='benchmarks to run',
+    )
+    parser.add_argument(
+        '--series',
+        nargs='+',
+        type=int,
+        default=[1, 10, 100],
+        help='number of series per operation',
+    )
+    parser.add_argument(
+        '--lengths',
+        nargs='+',
+        type=int,
+        default=[168, 720],
+        help='number of hourly points per series',
+    )
+    parser.add_argument(
+        '--min-time',
+        type=float,
+        default=0.2,
+        help='min seconds to repeat each benchmark for',
+    )
+    # single calls are short, so shared machines make them noisier
+    add_result_args(parser=parser, suite='micro', tolerance=0.5)
+    return parser.parse_args()
+
+
+def main() -> int:
+    """function to run the micro benchmark suite"""
+    args = parse_args()
+    quiet_logs()
+    results = {}
+    for bench in args.benchmarks:
+        for count in args.series:
+            for length in args.lengths:
+                name = f'{bench}/series={count}/length={length}'
+                print(f'running {name}', file=sys.stderr)
+                op = BENCHMARKS[bench](count, length)
+                results[name] = measure(op=op, min_time=args.min_time)
+                results[name]['points_per_op'] = float(count * length)
+    return report_results(suite='micro', results=results, args=args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,37 @@
 from enum import Enum
 from distutils.util import strtobool
 import os
-from typing import Dict, Iterable
+import tempfile
+from typing import Dict, Iterable, Optional
 import yaml
-from metrics.common import Query
+from utils.cache import CACHE_PATH, Cache, CacheBackend, create_cache
+from utils.clients import AsyncRestClient, ResponseFormat
+from analysis.forecast import PredictMode
+from analysis.preprocess import Aggregation, GapFill, Resampler
+from metrics.common import Query, SeriesCap, SeriesRank
 from metrics.prometheus import PrometheusQuery
 from metrics.graphite import GraphiteQuery
+from metrics.file import FileQuery
+
+
+# columns file datasources can configure
+FILE_COLUMNS = ('time_column', 'name_column', 'value_column')
+# options of the client http datasources make requests with and their
+# defaults (see AsyncRestClient)
+CLIENT_OPTIONS = {
+    'connect_timeout': 5.0,
+    'read_timeout': 30.0,
+    'retries': 2,
+    'retry_backoff': 0.5,
+    'breaker_failures': 5,
+    'breaker_reset_timeout': 30.0,
+    'max_in_flight': 8,
+    'host_max_in_flight': 0,
+}
+# default max number of series a query of http datasources fetches.
+# 0 leaves queries as they are unless a cap is set for the datasource
+# or entered for a request
+DEFAULT_MAX_SERIES = 0
 
 
 class InvalidConfigError(Exception):
@@ -23,6 +49,8 @@ class DatasourceType(Enum):
     # PROMETHEUS is prometheus data source
     PROMETHEUS = 'prometheus'
     GRAPHITE = 'graphite'
+    # FILE is a directory of parquet, arrow ipc or csv files
+    FILE = 'file'
 
     @staticmethod
     def from_str(src_type: str):
@@ -40,10 +68,46 @@ class DatasourceType(Enum):
         raise InvalidConfigError('unsupported datasource type')
 
 
+# formats each type of datasource supports
+SOURCE_FORMATS = {
+    DatasourceType.PROMETHEUS: (ResponseFormat.JSON, ResponseFormat.PROTOBUF),
+    DatasourceType.GRAPHITE: (
+        ResponseFormat.JSON,
+        ResponseFormat.MSGPACK,
+        ResponseFormat.PICKLE,
+    ),
+    DatasourceType.FILE: (ResponseFormat.JSON,),
+}
+
+
 class Datasource(object):
     """
     Datasource defines a data source/database to fetch
     data from for analysis
+
+    Parameters
+    ----------
+    name: str
+        name of the datasource
+    source: str
+        url of the datasource (or path for file datasources)
+    source_type: DatasourceType
+        type of the datasource
+    response_format: Optional[ResponseFormat] (default: JSON)
+        format to request data from the datasource in (see
+        SOURCE_FORMATS for formats each type supports)
+    columns: Optional[Dict[str, str]] (default: None)
+        time_column, name_column and value_column to read (only
+        for file datasources)
+    client_options: Optional[Dict[str, float]] (default: None)
+        options overriding CLIENT_OPTIONS of the client shared by
+        all queries of the datasource (not for file datasources)
+    predict_mode: Optional[PredictMode] (default: NONE)
+        uncertainty simulation to run for forecasts of the datasource
+        unless a request selects one
+    series_cap: Optional[SeriesCap] (default: None)
+        cap on the number of series queries of the datasource fetch
+        unless a request sets a limit (not for file datasources)
     """
 
     def __init__(
@@ -51,33 +115,140 @@ class Datasource(object):
         name: str,
         source: str,
         source_type: DatasourceType,
+        response_format: Optional[ResponseFormat] = ResponseFormat.JSON,
+        columns: Optional[Dict[str, str]] = None,
+        client_options: Optional[Dict[str, float]] = None,
+        predict_mode: Optional[PredictMode] = PredictMode.NONE,
+        series_cap: Optional[SeriesCap] = None,
     ) -> None:
+        if response_format not in SOURCE_FORMATS.get(source_type, ()):
+            raise InvalidConfigError(
+                f'format {response_format.value} is not supported for '
+                f'{source_type.value} datasources'
+            )
+        columns = columns or {}
+        if columns and source_type != DatasourceType.FILE:
+            raise InvalidConfigError(
+                'columns are only supported for file datasources'
+            )
+        client_options = client_options or {}
+        if client_options and source_type == DatasourceType.FILE:
+            raise InvalidConfigError(
+                'client options are not supported for file datasources'
+            )
         self._name = name
         self._source = source
         self._type = source_type
+        self._format = response_format
+        self._columns = columns
+        if series_cap is not None and source_type == DatasourceType.FILE:
+            raise InvalidConfigError(
+                'series caps are not supported for file datasources'
+            )
+        self._predict_mode = predict_mode
+        self._series_cap = series_cap or SeriesCap(limit=0)
+        self._client = None
+        if source_type != DatasourceType.FILE:
+            self._client = self._create_client(options=client_options)
 
     def get_type(self) -> DatasourceType:
         """method to get datasource type"""
         return self._type
 
+    def get_predict_mode(self) -> PredictMode:
+        """method to get default predict mode of the datasource"""
+        return self._predict_mode
+
+    def get_client(self) -> Optional[AsyncRestClient]:
+        """method to get client shared by queries of the datasource"""
+        return self._client
+
+    def get_series_cap(self) -> SeriesCap:
+        """method to get default series cap of the datasource"""
+        return self._series_cap
+
+    def gen_query_key(
+        self,
+        query: str,
+        lookback_days: int,
+        max_series: Optional[int] = None,
+    ) -> Iterable[object]:
+        """
+        method to generate parts identifying the results of a query
+        of the datasource, to cache them by
+        """
+        return (
+            self._name,
+            self._type.value,
+            self._source,
+            self._format.value,
+            self._columns,
+            self._series_cap.get_limit(),
+            self._series_cap.get_rank().value,
+            self._series_cap.get_other(),
+            query,
+            lookback_days,
+            max_series,
+        )
+
     def get_query_for_src(
         self,
         query: str,
         lookback_days: int,
+        max_series: Optional[int] = None,
     ) -> Query:
-        """method to get Query object for source"""
+        """
+        method to get Query object for source. max_series overrides
+        the limit of the series cap of the datasource if set
+        """
+        series_cap = self._series_cap
+        if max_series is not None:
+            series_cap = SeriesCap(
+                limit=max_series,
+                rank=series_cap.get_rank(),
+                other=series_cap.get_other(),
+            )
         if self._type == DatasourceType.PROMETHEUS:
             return PrometheusQuery(
                 query=query,
                 source=self._source,
-                lookback_days=lookback_days
+                lookback_days=lookback_days,
+                response_format=self._format,
+                client=self._client,
+                series_cap=series_cap,
+            )
+        elif self._type == DatasourceType.FILE:
+            return FileQuery(
+                query=query,
+                source=self._source,
+                lookback_days=lookback_days,
+                **self._columns,
             )
         else:
             return GraphiteQuery(
                 query=query,
                 source=self._source,
-                lookback_days=lookback_days
+                lookback_days=lookback_days,
+                render_format=self._format,
+                client=self._client,
+                series_cap=series_cap,
+            )
+
+    def _create_client(self, options: Dict[str, float]) -> AsyncRestClient:
+        """helper method to create client of the datasource"""
+        unknown = set(options) - set(CLIENT_OPTIONS)
+        if unknown:
+            raise InvalidConfigError(
+                f'unknown client options {", ".join(sorted(unknown))}'
             )
+        kwargs = dict(CLIENT_OPTIONS)
+        for key, value in options.items():
+            # keep ints ints (i.e retries) and allow ints for floats
+            value = type(CLIENT_OPTIONS[key])(value)
+            if value < 0:
+                raise InvalidConfigError(f'{key} must not be negative')
+            kwargs[key] = value
+        return AsyncRestClient(base_url=self._source, **kwargs)
 
 
 class Config(object):
@@ -113,6 +284,118 @@ class Config(object):
         """method to get conf path to read conf from"""
         return self._conf_path
 
+    def get_profiling_token(self) -> str:
+        """
+        method to get token required to use the profiling endpoint.
+        profiling is disabled when empty
+        """
+        return self._profiling_token
+
+    def get_profiling_enabled(self) -> bool:
+        """method to check if profiling is enabled"""
+        return bool(self._profiling_token)
+
+    def get_profile_dir(self) -> str:
+        """method to get directory to save profiles to"""
+        return self._profile_dir
+
+    def get_trace_memory(self) -> bool:
+        """method to check if per stage memory tracing is enabled"""
+        return self._trace_memory
+
+    def get_max_worker_rss(self) -> int:
+        """
+        method to get RSS budget in bytes after which a worker is
+        recycled. 0 means workers are never recycled
+        """
+        return self._max_worker_rss_mb * 1024 * 1024
+
+    def get_preload(self) -> bool:
+        """
+        method to check if the app is loaded (and warmed up) in the
+        gunicorn master before workers are forked
+        """
+        return bool(self._preload)
+
+    def get_warm_up(self) -> bool:
+        """
+        method to check if a synthetic analysis is run to warm up
+        before serving traffic
+        """
+        return bool(self._warm_up)
+
+    def get_resampler(self) -> Resampler:
+        """
+        method to get resampler series are preprocessed with before
+        they are analyzed
+        """
+        return self._resampler
+
+    def get_forecast_hourly_days(self) -> int:
+        """
+        method to get number of days of the forecast horizon to
+        forecast hourly before switching to coarse points
+        """
+        return self._forecast_hourly_days
+
+    def get_forecast_coarse_hours(self) -> int:
+        """
+        method to get hours between forecast points after the
+        hourly part of the forecast horizon
+        """
+        return self._forecast_coarse_hours
+
+    def get_anomaly_threshold(self) -> float:
+        """
+        method to get min absolute anomaly score of points marked
+        as anomalies
+        """
+        return self._anomaly_threshold
+
+    def get_evaluation_workers(self) -> int:
+        """
+        method to get number of processes backtest folds run in. 0
+        runs folds in the worker serving the request
+        """
+        return self._evaluation_workers
+
+    def get_evaluation_token(self) -> str:
+        """
+        method to get token required to use the evaluation api. the
+        api is disabled when empty
+        """
+        return self._evaluation_token
+
+    def get_evaluation_folds(self) -> int:
+        """method to get default number of folds of backtests"""
+        return self._evaluation_folds
+
+    def get_evaluation_horizon_days(self) -> float:
+        """method to get default days forecast by each backtest fold"""
+        return self._evaluation_horizon_days
+
+    def get_query_cache(self) -> Optional[Cache]:
+        """
+        method to get cache of query results, or None if query
+        results are not cached
+        """
+        return self._query_cache
+
+    def get_query_cache_ttl(self) -> int:
+        """method to get seconds query results are cached for"""
+        return self._query_cache_ttl
+
+    def get_report_cache(self) -> Optional[Cache]:
+        """
+        method to get cache of analysis reports, or None if reports
+        are not cached
+        """
+        return self._report_cache
+
+    def get_report_cache_ttl(self) -> int:
+        """method to get seconds analysis reports are cached for"""
+        return self._report_cache_ttl
+
     def gen_source_options(self) -> Iterable[Dict[str, str]]:
         """
         method to generate options for all the datasources
@@ -155,6 +438,127 @@ class Config(object):
                 'CAPMON_CONFIG_PATH',
                 current_dir + '/config.yml'
             )
+            self._profiling_token = os.getenv(
+                'CAPMON_PROFILING_TOKEN',
+                '',
+            )
+            self._evaluation_token = os.getenv(
+                'CAPMON_EVALUATION_TOKEN',
+                '',
+            )
+            self._profile_dir = os.getenv(
+                'CAPMON_PROFILE_DIR',
+                os.path.join(tempfile.gettempdir(), 'capmon-profiles'),
+            )
+            self._trace_memory = strtobool(os.getenv(
+                'CAPMON_TRACE_MEMORY',
+                'no',
+            ))
+            self._max_worker_rss_mb = int(os.getenv(
+                'CAPMON_MAX_WORKER_RSS_MB',
+                0,
+            ))
+            self._preload = strtobool(os.getenv(
+                'CAPMON_PRELOAD',
+                'yes',
+            ))
+            self._warm_up = strtobool(os.getenv(
+                'CAPMON_WARM_UP',
+                'yes',
+            ))
+            self._forecast_hourly_days = int(os.getenv(
+                'CAPMON_FORECAST_HOURLY_DAYS',
+                7,
+            ))
+            self._forecast_coarse_hours = int(os.getenv(
+                'CAPMON_FORECAST_COARSE_HOURS',
+                6,
+            ))
+            self._resampler = Resampler(
+                resolution=int(os.getenv(
+                    'CAPMON_RESAMPLE_SECONDS',
+                    0,
+                )),
+                aggregation=Aggregation(os.getenv(
+                    'CAPMON_RESAMPLE_AGGREGATION',
+                    'mean',
+                )),
+                fill=GapFill(os.getenv(
+                    'CAPMON_RESAMPLE_FILL',
+                    'drop',
+                )),
+            )
+            self._anomaly_threshold = float(os.getenv(
+                'CAPMON_ANOMALY_THRESHOLD',
+                3.0,
+            ))
+            if self._anomaly_threshold <= 0:
+                raise ValueError('CAPMON_ANOMALY_THRESHOLD must be > 0')
+            self._evaluation_workers = int(os.getenv(
+                'CAPMON_EVALUATION_WORKERS',
+                2,
+            ))
+            self._evaluation_folds = int(os.getenv(
+                'CAPMON_EVALUATION_FOLDS',
+                4,
+            ))
+            self._evaluation_horizon_days = float(os.getenv(
+                'CAPMON_EVALUATION_HORIZON_DAYS',
+                1,
+            ))
+            if self._evaluation_workers < 0:
+                raise ValueError('CAPMON_EVALUATION_WORKERS must be >= 0')
+            if self._evaluation_folds < 1:
+                raise ValueError('CAPMON_EVALUATION_FOLDS must be >= 1')
+            if self._evaluation_horizon_days <= 0:
+                raise ValueError('CAPMON_EVALUATION_HORIZON_DAYS must be > 0')
+            cache_backend = CacheBackend(os.getenv(
+                'CAPMON_CACHE_BACKEND',
+                'none',
+            ))
+            cache_max_mb = int(os.getenv(
+                'CAPMON_CACHE_MAX_MB',
+                256,
+            ))
+            cache_path = os.getenv(
+                'CAPMON_CACHE_PATH',
+                CACHE_PATH,
+            )
+            cache_url = os.getenv(
+                'CAPMON_CACHE_URL',
+                '',
+            )
+            self._query_cache_ttl = int(os.getenv(
+                'CAPMON_QUERY_CACHE_TTL',
+                300,
+            ))
+            self._report_cache_ttl = int(os.getenv(
+                'CAPMON_REPORT_CACHE_TTL',
+                3600,
+            ))
+            if cache_max_mb < 1:
+                raise ValueError('CAPMON_CACHE_MAX_MB must be >= 1')
+            if self._query_cache_ttl < 0 or self._report_cache_ttl < 0:
+                raise ValueError('cache ttls must be >= 0')
+            if cache_backend == CacheBackend.HTTP and not cache_url:
+                raise ValueError('CAPMON_CACHE_URL must be set for http')
+            self._query_cache, self._report_cache = (
+                create_cache(
+                    backend=cache_backend if ttl else CacheBackend.NONE,
+                    name=name,
+                    max_bytes=cache_max_mb * 1024 * 1024,
+                    path=cache_path,
+                    url=cache_url,
+                )
+                for name, ttl in (
+                    ('queries', self._query_cache_ttl),
+                    ('reports', self._report_cache_ttl),
+                )
+            )
+            if self._forecast_hourly_days < 0:
+                raise ValueError('CAPMON_FORECAST_HOURLY_DAYS must be >= 0')
+            if self._forecast_coarse_hours < 1:
+                raise ValueError('CAPMON_FORECAST_COARSE_HOURS must be >= 1')
         except ValueError as e:
             raise InvalidConfigError('unable to parse env: ' + str(e))
 
@@ -167,13 +571,63 @@ class Config(object):
                 for datasource in config['datasources']:
                     if datasource['name'] in mapping:
                         raise InvalidConfigError('repreated datasource name')
+                    source_type = DatasourceType.from_str(
+                        src_type=datasource['type'],
+                    )
+                    source = datasource['source']
+                    if source_type == DatasourceType.FILE:
+                        # paths are relative to the config file
+                        source = os.path.join(
+                            os.path.dirname(self._conf_path),
+                            os.path.expanduser(source),
+                        )
                     mapping[datasource['name']] = Datasource(
                         name=datasource['name'],
-                        source=datasource['source'],
-                        source_type=DatasourceType.from_str(
-                            src_type=datasource['type'],
-                        )
+                        source=source,
+                        source_type=source_type,
+                        response_format=ResponseFormat(
+                            datasource.get('format', 'json'),
+                        ),
+                        columns={
+                            key: datasource[key]
+                            for key in FILE_COLUMNS
+                            if key in datasource
+                        },
+                        client_options=datasource.get('client', {}),
+                        predict_mode=PredictMode(
+                            datasource.get('predict_mode', 'none'),
+                        ),
+                        series_cap=self._load_series_cap(
+                            datasource=datasource,
+                            source_type=source_type,
+                        ),
                     )
             return mapping
         except Exception as e:
             raise InvalidConfigError('unable to load config: ' + str(e))
+
+    def _load_series_cap(
+        self,
+        datasource: dict,
+        source_type: DatasourceType,
+    ) -> Optional[SeriesCap]:
+        """
+        helper method to load series cap of a datasource. http
+        datasources are capped to DEFAULT_MAX_SERIES (not capped)
+        unless set
+        """
+        keys = ('max_series', 'series_rank', 'other_series')
+        if source_type == DatasourceType.FILE:
+            if any(key in datasource for key in keys):
+                raise InvalidConfigError(
+                    'series caps are not supported for file datasources'
+                )
+            return None
+        limit = int(datasource.get('max_series', DEFAULT_MAX_SERIES))
+        if limit < 0:
+            raise InvalidConfigError('max_series must not be negative')
+        return SeriesCap(
+            limit=limit,
+            rank=SeriesRank(datasource.get('series_rank', 'top')),
+            other=bool(datasource.get('other_series', False)),
+        )
@@ -0,0 +1,46 @@
+"""
+gunicorn configuration for capmon (see run_server.sh). settings
+come from the same CAPMON_* env vars as the app.
+
+with CAPMON_PRELOAD enabled (default) the app is loaded and warmed
+up in the master before workers are forked, so the imported
+analysis stack and loaded stan model are shared copy-on-write and
+the first request to a worker is as fast as later ones. otherwise
+each worker warms up before it accepts requests. metrics of workers
+that exit are cleaned up from prometheus_multiproc_dir
+"""
+import gc
+from config import Config
+from utils.instrumentation import mark_worker_dead
+
+conf = Config()
+
+bind = f'{conf.get_host()}:{conf.get_port()}'
+workers = conf.get_workers()
+preload_app = conf.get_preload()
+
+
+def when_ready(server) -> None:
+    """hook to warm up the preloaded app before forking workers"""
+    if not preload_app:
+        return
+    from app import warm_up_app
+    warm_up_app()
+    # move everything allocated so far out of reach of the garbage
+    # collector, so collections in workers do not write to (and
+    # copy) the pages shared with the master
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def post_worker_init(worker) -> None:
+    """hook to warm up a worker when the app is not preloaded"""
+    if preload_app:
+        return
+    from app import warm_up_app
+    warm_up_app()
+
+
+def child_exit(server, worker) -> None:
+    """hook to clean up metrics of a worker that exited"""
+    mark_worker_dead(pid=worker.pid)
@@ -1,9 +1,24 @@
-from typing import Iterable, Tuple
-import pandas as pd
-from metrics.common import Timeseries
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import time
+import numpy as np
+from metrics.common import CachedQuery, MultiQuery, Timeseries
 from analysis.common import Report
-from analysis.forecast import FBProphetForecaster
+from analysis.evaluation import Accuracy, Backtester
+from analysis.forecast import FBProphetForecaster, PredictMode
+from analysis.hierarchy import HierarchicalForecaster, group_series
 from config import Config
+from utils.cache import Cache, gen_cache_key
+from utils.imports import import_lazy_modules
+from utils.instrumentation import (
+    collect_stage_timings,
+    record_capped_query,
+    record_series,
+    time_stage,
+)
+
+# default min absolute anomaly score (standard deviations of the
+# fitted noise) of points marked as anomalies
+ANOMALY_THRESHOLD = 3.0
 
 
 def is_valid_data(
@@ -31,36 +46,78 @@ def is_valid_data(
 
 def get_current_data(
     conf: Config,
-    source_name: str,
-    query: str,
+    queries: Iterable[Tuple[str, str]],
     lookback_days: int,
-) -> Iterable[Timeseries]:
+    max_series: Optional[int] = None,
+    cache: Optional[Cache] = None,
+    cache_ttl: Optional[int] = 0,
+) -> Tuple[Iterable[Timeseries], Dict[str, Tuple[int, int]]]:
     """
-    function to fetch lookback data from given datasource
-    and query
+    function to fetch lookback data from given datasources
+    and queries. queries are fetched concurrently. returns the
+    series and the number of series kept and matched of each
+    query capped by its series cap by query label
 
     Parameters
     ----------
     config: Config
         config object for the application
-    source: str
-        selected datasource
-    query: str
-        query to send to datasource
+    queries: Iterable[Tuple[str, str]]
+        selected datasource and query to send to it of each query
     lookback_days: int
         number of days of data to analyze
+    max_series: Optional[int] (default: None)
+        max number of series to fetch per query. if not set the
+        series caps of the datasources apply
+    cache: Optional[Cache] (default: None)
+        cache to serve results of queries from. queries are always
+        fetched if not set
+    cache_ttl: Optional[int] (default: 0)
+        seconds results of queries are cached for
     """
-    source = conf.get_datasource(name=source_name)
-    query = source.get_query_for_src(
-        query=query,
-        lookback_days=lookback_days
+    # fetch each distinct query once
+    queries = list(dict.fromkeys(queries))
+    source_queries = []
+    for source_name, query in queries:
+        datasource = conf.get_datasource(name=source_name)
+        source_query = datasource.get_query_for_src(
+            query=query,
+            lookback_days=lookback_days,
+            max_series=max_series,
+        )
+        if cache is not None:
+            source_query = CachedQuery(
+                query=source_query,
+                cache=cache,
+                key=gen_cache_key(parts=datasource.gen_query_key(
+                    query=query,
+                    lookback_days=lookback_days,
+                    max_series=max_series,
+                )),
+                ttl=cache_ttl,
+            )
+        source_queries.append(source_query)
+    multi_query = MultiQuery(
+        queries=source_queries,
+        labels=[f'{source_name}: {query}' for source_name, query in queries],
     )
-    return query.execute_sync()
+    series = multi_query.execute_sync()
+    record_series(points=(s.get_length() for s in series))
+    capped = multi_query.get_capped_queries()
+    for kept, total in capped.values():
+        record_capped_query(kept=kept, total=total)
+    return (series, capped)
 
 
 def generate_analysis_report(
     series: Iterable[Timeseries],
     forecast_days: int,
+    predict_mode: Optional[PredictMode] = PredictMode.NONE,
+    hourly_days: Optional[int] = 7,
+    coarse_hours: Optional[int] = 6,
+    hierarchical: Optional[bool] = False,
+    group_by: Optional[str] = None,
+    score_anomalies: Optional[bool] = False,
 ) -> Report:
     """
     function to generate forecasting and trend analysis
@@ -72,21 +129,338 @@ def generate_analysis_report(
         list of timeseries data to analyze
     forecast_days: int
         number of days to forecast for
+    predict_mode: Optional[PredictMode] (default: NONE)
+        uncertainty simulation to run when forecasting
+    hourly_days: Optional[int] (default: 7)
+        number of days of the horizon to forecast hourly
+    coarse_hours: Optional[int] (default: 6)
+        hours between forecast points after hourly_days
+    hierarchical: Optional[bool] (default: False)
+        whether to forecast the total of series (or of groups of
+        series) and distribute it to each series by its historical
+        share, instead of forecasting each series
+    group_by: Optional[str] (default: None)
+        label to group series by when forecasting hierarchically
+    score_anomalies: Optional[bool] (default: False)
+        whether to score historical points of the series fit (the
+        totals when forecasting hierarchically) against the
+        in-sample prediction of their model
     """
-    reporter = FBProphetForecaster(
+    if hierarchical:
+        reporter = HierarchicalForecaster(
+            series=series,
+            group_by=group_by,
+            forecast_days=forecast_days,
+            predict_mode=predict_mode,
+            hourly_days=hourly_days,
+            coarse_hours=coarse_hours,
+            score_anomalies=score_anomalies,
+        )
+    else:
+        reporter = FBProphetForecaster(
+            series=series,
+            forecast_days=forecast_days,
+            predict_mode=predict_mode,
+            hourly_days=hourly_days,
+            coarse_hours=coarse_hours,
+            score_anomalies=score_anomalies,
+        )
+    return reporter.execute_sync()
+
+
+def gen_report_key(
+    series: Iterable[Timeseries],
+    **params: Any,
+) -> str:
+    """
+    function to generate cache key of the report of an analysis
+    from the series analyzed and the parameters of the analysis,
+    so the same data analyzed the same way is only analyzed once
+
+    Parameters
+    ----------
+    series: Iterable[Timeseries]
+        series analyzed
+    params: Any
+        json serializable parameters of the analysis
+    """
+    parts = [params]
+    for data in series:
+        parts.extend((
+            data.get_name(),
+            data.get_labels(),
+            data.get_timestamps(),
+            data.get_values(),
+        ))
+    return gen_cache_key(parts=parts)
+
+
+def run_analysis(
+    conf: Config,
+    logger: Any,
+    queries: Iterable[Tuple[str, str]],
+    lookback_days: int,
+    forecast_days: int,
+    predict_mode: Optional[PredictMode] = None,
+    max_series: Optional[int] = None,
+    hierarchical: Optional[bool] = False,
+    group_by: Optional[str] = None,
+    anomalies: Optional[bool] = False,
+) -> Tuple[
+    Optional[dict],
+    Optional[dict],
+    Optional[dict],
+    Dict[str, Tuple[int, int]],
+]:
+    """
+    function to fetch data for queries, analyze it together and
+    setup the forecast, weekly trend and daily trend graph figures.
+    also returns the number of series kept and matched of each
+    query capped by its series cap by query label
+
+    Parameters
+    ----------
+    conf: Config
+        config object for the application
+    logger: Any
+        logger bound to the request
+    queries: Iterable[Tuple[str, str]]
+        selected datasource and query to send to it of each query
+    lookback_days: int
+        number of days of data to analyze
+    forecast_days: int
+        number of days to forecast for
+    predict_mode: Optional[PredictMode] (default: None)
+        uncertainty simulation to run when forecasting. if not set
+        the most precise default of the queried datasources is used
+    max_series: Optional[int] (default: None)
+        max number of series to fetch per query. if not set the
+        series caps of the datasources apply
+    hierarchical: Optional[bool] (default: False)
+        whether to forecast the total of series (or of groups of
+        series) and distribute it to each series by its historical
+        share. totals are graphed along with the series
+    group_by: Optional[str] (default: None)
+        label to group series by when forecasting hierarchically
+    anomalies: Optional[bool] (default: False)
+        whether to mark points of the series (or totals) whose
+        anomaly score is beyond the configured threshold
+    """
+    if predict_mode is None:
+        predict_mode = max(
+            (
+                conf.get_datasource(name=source_name).get_predict_mode()
+                for source_name, _ in queries
+            ),
+            key=lambda mode: mode.get_uncertainty_samples(),
+        )
+    logger.info('fetching query data')
+    # get current data
+    series, capped = get_current_data(
+        conf=conf,
+        queries=queries,
+        lookback_days=lookback_days,
+        max_series=max_series,
+        cache=conf.get_query_cache(),
+        cache_ttl=conf.get_query_cache_ttl(),
+    )
+    if capped:
+        logger.warning('capped series of queries', capped=capped)
+    # fit on the same grid whatever the datasource resolution
+    series = conf.get_resampler().resample(series=series)
+    params = {
+        'forecast_days': forecast_days,
+        'predict_mode': predict_mode.value,
+        'hourly_days': conf.get_forecast_hourly_days(),
+        'coarse_hours': conf.get_forecast_coarse_hours(),
+        'hierarchical': bool(hierarchical),
+        'group_by': group_by,
+        'anomalies': bool(anomalies),
+    }
+    report_cache = conf.get_report_cache()
+    report = None
+    if report_cache is not None:
+        report_key = gen_report_key(series=series, **params)
+        data = report_cache.get(key=report_key)
+        if data is not None:
+            try:
+                report = Report.from_bytes(data=data)
+                logger.info('serving cached analysis')
+            except ValueError:
+                report = None
+    if report is None:
+        logger.info('running analysis for data')
+        # generate forecast and trends
+        report = generate_analysis_report(
+            series=series,
+            forecast_days=forecast_days,
+            predict_mode=predict_mode,
+            hourly_days=params['hourly_days'],
+            coarse_hours=params['coarse_hours'],
+            hierarchical=hierarchical,
+            group_by=group_by,
+            score_anomalies=anomalies,
+        )
+        if report_cache is not None:
+            report_cache.set(
+                key=report_key,
+                value=report.to_bytes(),
+                ttl=conf.get_report_cache_ttl(),
+            )
+    if hierarchical:
+        series = series + [
+            aggregate
+            for aggregate, _ in group_series(series=series, group_by=group_by)
+        ]
+    logger.info('setting up graphs')
+    # setup graphs
+    with time_stage(stage='figure'):
+        return (
+            gen_forecast_graph_figure(
+                series=series,
+                report=report,
+                anomaly_threshold=conf.get_anomaly_threshold(),
+            ),
+            gen_weekly_trend_graph_figure(report=report),
+            gen_daily_trend_graph_figure(report=report),
+            capped,
+        )
+
+
+def run_evaluation(
+    conf: Config,
+    logger: Any,
+    queries: Iterable[Tuple[str, str]],
+    lookback_days: int,
+    predict_mode: Optional[PredictMode] = None,
+    max_series: Optional[int] = None,
+    horizon_days: Optional[float] = None,
+    folds: Optional[int] = None,
+) -> Tuple[List[Accuracy], Dict[str, Tuple[int, int]]]:
+    """
+    function to fetch data for queries and backtest forecasts of
+    each series to evaluate their accuracy. also returns the number
+    of series kept and matched of each query capped by its series
+    cap by query label
+
+    Parameters
+    ----------
+    conf: Config
+        config object for the application
+    logger: Any
+        logger bound to the request
+    queries: Iterable[Tuple[str, str]]
+        selected datasource and query to send to it of each query
+    lookback_days: int
+        number of days of data to backtest on
+    predict_mode: Optional[PredictMode] (default: None)
+        uncertainty simulation to run when forecasting. FAST if not
+        set, so the coverage of uncertainty intervals is evaluated
+    max_series: Optional[int] (default: None)
+        max number of series to fetch per query. if not set the
+        series caps of the datasources apply
+    horizon_days: Optional[float] (default: None)
+        number of days forecast by each fold. the configured default
+        is used if not set
+    folds: Optional[int] (default: None)
+        max number of folds per series. the configured default is
+        used if not set
+    """
+    logger.info('fetching query data')
+    series, capped = get_current_data(
+        conf=conf,
+        queries=queries,
+        lookback_days=lookback_days,
+        max_series=max_series,
+        cache=conf.get_query_cache(),
+        cache_ttl=conf.get_query_cache_ttl(),
+    )
+    if capped:
+        logger.warning('capped series of queries', capped=capped)
+    series = conf.get_resampler().resample(series=series)
+    logger.info('backtesting forecasts of data')
+    backtester = Backtester(
         series=series,
-        forecast_days=forecast_days
+        horizon_days=horizon_days or conf.get_evaluation_horizon_days(),
+        folds=folds or conf.get_evaluation_folds(),
+        predict_mode=predict_mode or PredictMode.FAST,
+        workers=conf.get_evaluation_workers(),
+    )
+    return (backtester.execute_sync(), capped)
+
+
+def gen_capped_message(capped: Dict[str, Tuple[int, int]]) -> str:
+    """
+    function to generate message telling clients which queries were
+    capped to fewer series than they matched
+
+    Parameters
+    ----------
+    capped: Dict[str, Tuple[int, int]]
+        number of series kept and matched of each capped query by
+        query label
+    """
+    return '; '.join(
+        f'{label}: analyzed {kept} of {total} series'
+        for label, (kept, total) in capped.items()
     )
-    return reporter.execute_sync()
+
+
+def warm_up(
+    lookback_days: Optional[int] = 7,
+    forecast_days: Optional[int] = 7,
+) -> Dict[str, float]:
+    """
+    function to warm up the analysis stack before serving traffic.
+    imports the lazily declared modules and analyzes a synthetic
+    hourly series, so the stan model is loaded and the first fit,
+    predict and figure generation are paid for up front. returns
+    seconds spent in each stage
+
+    Parameters
+    ----------
+    lookback_days: Optional[int] (default: 7)
+        number of days of synthetic data to analyze
+    forecast_days: Optional[int] (default: 7)
+        number of days to forecast for
+    """
+    with collect_stage_timings() as timings:
+        start = time.perf_counter()
+        import_lazy_modules()
+        timings['import'] = time.perf_counter() - start
+        end = int(time.time()) // 3600 * 3600
+        timestamps = np.arange(end - lookback_days * 86400, end, 3600)
+        hours = (timestamps - timestamps[0]) / 3600.0
+        values = (
+            100.0
+            + 10.0 * np.sin(2 * np.pi * hours / 24.0)
+            + 5.0 * np.sin(2 * np.pi * hours / 168.0)
+        )
+        series = [Timeseries.from_arrays(
+            name='capmon_warm_up',
+            timestamps=timestamps,
+            values=values,
+        )]
+        report = generate_analysis_report(
+            series=series,
+            forecast_days=forecast_days,
+        )
+        with time_stage(stage='figure'):
+            gen_forecast_graph_figure(series=series, report=report)
+            gen_weekly_trend_graph_figure(report=report)
+            gen_daily_trend_graph_figure(report=report)
+    return timings
 
 
 def gen_forecast_graph_figure(
     series: Iterable[Timeseries],
-    report: Report
+    report: Report,
+    anomaly_threshold: Optional[float] = ANOMALY_THRESHOLD,
 ) -> dict:
     """
     function to setup figure of graph to render
-    forecasting data
+    forecasting data. points of series scored as anomalies by the
+    report are marked
 
     Parameters
     ----------
@@ -94,42 +468,67 @@ def gen_forecast_graph_figure(
         list of timeseries data to analyze
     report: Report
         analysis report object for the data
+    anomaly_threshold: Optional[float] (default: ANOMALY_THRESHOLD)
+        min absolute anomaly score of points to mark
     """
     data = []
     if not report.contains_forecasts():
         return None
 
-    all_series = []
-    f_series = report.get_forecasts()
-    f_map = {}
-    for f in f_series:
-        f_map[f.get_name()] = f.get_dataframe()
-    all_series.extend(series)
-    for single in all_series:
-        df = single.get_dataframe()
-        f_df = f_map.get(single.get_name() + '_forecast', None)
-        if f_df is not None and df is not None:
-            all_data = pd.concat([df, f_df])
+    forecasts = {f.get_name(): f for f in report.get_forecasts()}
+    bounds = report.get_forecast_bounds() or {}
+    scores = report.get_anomaly_scores() or {}
+    for single in series:
+        f_name = single.get_name() + '_forecast'
+        forecast = forecasts.get(f_name, None)
+        has_data = single.get_length() > 0
+        if f_name in bounds:
+            data.extend(gen_forecast_band_lines(
+                name=f_name,
+                lower=bounds[f_name][0],
+                upper=bounds[f_name][1],
+            ))
+        if forecast is not None and has_data:
+            x, y = gen_line_points(series=[single, forecast])
             f_line = {
-                'x': all_data['ds'],
-                'y': all_data['y'],
+                'x': x,
+                'y': y,
                 'type': 'line',
-                'name': single.get_name() + '_forecast'
+                'name': f_name
             }
             data.append(f_line)
-        if df is not None:
+        if has_data:
+            x, y = gen_line_points(series=[single])
             line = {
-                'x': df['ds'],
-                'y': df['y'],
+                'x': x,
+                'y': y,
                 'type': 'line',
                 'name': single.get_name()
             }
             data.append(line)
+        if has_data and single.get_name() in scores:
+            anomalies = flag_anomalies(
+                series=single,
+                scores=scores[single.get_name()],
+                threshold=anomaly_threshold,
+            )
+            if anomalies.get_length() > 0:
+                x, y = gen_line_points(series=[anomalies])
+                data.append({
+                    'x': x,
+                    'y': y,
+                    'type': 'scatter',
+                    'mode': 'markers',
+                    'marker': {'symbol': 'x', 'size': 9, 'color': 'red'},
+                    'name': anomalies.get_name(),
+                })
     return {
         'data': data,
         'layout': {
             'title': 'Forecast',
             'xaxis': {
+                # x values are epoch milliseconds
+                'type': 'date',
                 'title': {
                     'text': 'Dates'
                 }
@@ -138,6 +537,105 @@ def gen_forecast_graph_figure(
     }
 
 
+def flag_anomalies(
+    series: Timeseries,
+    scores: Timeseries,
+    threshold: float,
+) -> Timeseries:
+    """
+    function to get the points of a series whose absolute anomaly
+    score is at least threshold
+
+    Parameters
+    ----------
+    series: Timeseries
+        series scored
+    scores: Timeseries
+        anomaly score of points of the series
+    threshold: float
+        min absolute score of anomalies
+    """
+    flagged = scores.get_timestamps()[np.abs(scores.get_values()) >= threshold]
+    keep = np.isin(series.get_timestamps(), flagged)
+    return Timeseries(
+        name=series.get_name() + ' anomalies',
+        columns=(series.get_timestamps()[keep], series.get_values()[keep]),
+    )
+
+
+def gen_line_points(
+    series: Iterable[Timeseries],
+) -> Tuple[List[int], List[Optional[float]]]:
+    """
+    function to generate x (epoch milliseconds) and y values of a
+    line through the points of series, as plain lists of numbers.
+    those are serialized by the C json encoder, where datetimes are
+    serialized one element at a time. missing values are None, as
+    NaN is not valid json
+
+    Parameters
+    ----------
+    series: Iterable[Timeseries]
+        series to draw a line through one after another
+    """
+    series = list(series)
+    x = np.concatenate([data.get_timestamps() for data in series])
+    x = (x * 1000).tolist()
+    vals = np.concatenate([data.get_values() for data in series])
+    present = np.isfinite(vals)
+    y = vals.tolist()
+    if not present.all():
+        y = [val if keep else None for val, keep in zip(y, present)]
+    return (x, y)
+
+
+def gen_forecast_band_lines(
+    name: str,
+    lower: Timeseries,
+    upper: Timeseries,
+) -> Iterable[dict]:
+    """
+    function to setup lines drawing the uncertainty interval of a
+    forecast as a shaded band
+
+    Parameters
+    ----------
+    name: str
+        name of the forecast
+    lower: Timeseries
+        lower bound of the uncertainty interval
+    upper: Timeseries
+        upper bound of the uncertainty interval
+    """
+    if lower.get_length() == 0 or upper.get_length() == 0:
+        return []
+    upper_x, upper_y = gen_line_points(series=[upper])
+    lower_x, lower_y = gen_line_points(series=[lower])
+    return [
+        {
+            'x': upper_x,
+            'y': upper_y,
+            'type': 'scatter',
+            'mode': 'lines',
+            'line': {'width': 0},
+            'name': name + '_upper',
+            'legendgroup': name + '_interval',
+            'showlegend': False,
+        },
+        {
+            'x': lower_x,
+            'y': lower_y,
+            'type': 'scatter',
+            'mode': 'lines',
+            'line': {'width': 0},
+            'fill': 'tonexty',
+            'fillcolor': 'rgba(68, 68, 68, 0.2)',
+            'name': name + '_interval',
+            'legendgroup': name + '_interval',
+        },
+    ]
+
+
 def gen_weekly_trend_graph_figure(
     report: Report
 ) -> dict:
@@ -167,7 +665,7 @@ def gen_weekly_trend_graph_figure(
     ]
     vals = []
     for key in keys:
-        vals.append(trend_vals[key])
+        vals.append(float(trend_vals[key]))
     data = [
         {
             'x': keys,
@@ -215,7 +713,7 @@ def gen_daily_trend_graph_figure(
             keys.append(f'{i}:00')
     vals = []
     for i in range(24):
-        vals.append(trend_vals[i])
+        vals.append(float(trend_vals[i]))
     data = [
         {
             'x': keys,
@@ -1,52 +1,123 @@
-from typing import Dict, Optional, Iterable
+from enum import Enum
+from typing import Dict, List, Optional, Iterable, Tuple
 import abc
-import pandas as pd
+import asyncio
+import numpy as np
+from utils.cache import Cache
+from utils.imports import LazyModule
+from utils.serialization import decode_columns, encode_columns
 from utils.tasks import AsyncTask, AsyncExecutionError
 
+pd = LazyModule('pandas')
+
+# name of the series aggregating series left out by a SeriesCap
+OTHER_SERIES_NAME = 'other'
+
 
 class Timeseries(object):
     """
-    Timeseries represents historical metric data collected
+    Timeseries represents historical metric data collected. data is
+    kept as given, either as a dictionary or as columns (arrays of
+    timestamps and values), and each form is built from the other
+    only when asked for. pipelines working on arrays never create an
+    object per point
 
     Parameters
     ----------
     name: str
         name of the time series metric
-    values: Dic[int, float]
+    values: Optional[Dict[int, float]] (default: None)
         dictionary of historical values with key as the unix timestamp
         of when the metric was collected as an integer and the value as
         the recorded value during the time as a float
+    labels: Optional[Dict[str, str]] (default: None)
+        labels (or tags) the datasource identified the series by
+    columns: Optional[Tuple[np.ndarray, np.ndarray]] (default: None)
+        arrays of unix timestamps (int64) and values (float) to use
+        instead of values
    """
 
-    def __init__(self, name: str, values: Dict[int, float]) -> None:
+    def __init__(
+        self,
+        name: str,
+        values: Optional[Dict[int, float]] = None,
+        labels: Optional[Dict[str, str]] = None,
+        columns: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> None:
         self._raw_values = values
+        self._columns = columns
+        if values is None and columns is None:
+            self._raw_values = {}
         self._name = name
+        self._labels = labels or {}
 
     def get_name(self) -> str:
         """method to get name of metric"""
         return self._name
 
-    def get_dataframe(self) -> Optional[pd.DataFrame]:
+    def get_labels(self) -> Dict[str, str]:
+        """method to get labels of metric"""
+        return self._labels
+
+    def get_dataframe(self) -> Optional['pd.DataFrame']:
         """method to get dataframe of the timeseries"""
-        if len(self._raw_values) > 0:
-            df = pd.DataFrame(self._raw_values.items(), columns=['ds', 'y'])
-            df['ds'] = pd.to_datetime(df['ds'], unit='s')
-            return df
+        timestamps, values = self._get_columns()
+        if len(timestamps) > 0:
+            return pd.DataFrame({
+                'ds': pd.to_datetime(timestamps, unit='s'),
+                'y': values,
+            })
         return None
 
     def get_raw_vals(self) -> Dict[int, float]:
         """method to get raw values of the timeseries"""
+        if self._raw_values is None:
+            timestamps, values = self._columns
+            self._raw_values = dict(zip(timestamps.tolist(), values.tolist()))
         return self._raw_values
 
+    def get_timestamps(self) -> np.ndarray:
+        """method to get array of unix timestamps of the timeseries"""
+        return self._get_columns()[0]
+
+    def get_values(self) -> np.ndarray:
+        """method to get array of values of the timeseries"""
+        return self._get_columns()[1]
+
+    def get_length(self) -> int:
+        """method to get number of points of the timeseries"""
+        if self._columns is not None:
+            return len(self._columns[0])
+        return len(self._raw_values)
+
+    def to_bytes(self) -> bytes:
+        """
+        method to encode the timeseries into a compact binary format
+        (see utils.serialization), decoded with from_bytes
+        """
+        return encode_series(series=[self])
+
+    def _get_columns(self) -> Tuple[np.ndarray, np.ndarray]:
+        """helper method to get arrays of timestamps and values"""
+        if self._columns is None:
+            raw_vals = self._raw_values
+            self._columns = (
+                np.fromiter(raw_vals.keys(), np.int64, len(raw_vals)),
+                np.fromiter(raw_vals.values(), float, len(raw_vals)),
+            )
+        return self._columns
+
     @staticmethod
     def from_df(
         name: str,
-        df: pd.DataFrame,
+        df: 'pd.DataFrame',
         time_col: Optional[str] = 'ds',
         val_col: Optional[str] = 'y',
+        labels: Optional[Dict[str, str]] = None,
     ):
         """
-        method to generate Timeseries object from dataframe
+        method to generate Timeseries object from dataframe, without
+        modifying the dataframe
 
         Parameters
         ----------
@@ -58,16 +129,147 @@ class Timeseries(object):
             the column to fetch the time values from
         val_col: str (default: y)
             the column to fetch metric values from
+        labels: Optional[Dict[str, str]] (default: None)
+            labels of the Timeseries
+        """
+        times = df[time_col].to_numpy(dtype='datetime64[ns]')
+        timestamps = times.astype(np.int64) // 1000000000
+        return Timeseries(
+            name=name,
+            labels=labels,
+            columns=(timestamps, df[val_col].to_numpy(dtype=float)),
+        )
+
+    @staticmethod
+    def from_arrays(
+        name: str,
+        timestamps: np.ndarray,
+        values: np.ndarray,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        """
+        method to generate Timeseries object from arrays of unix
+        timestamps and values. points with missing (NaN) values are
+        dropped
+
+        Parameters
+        ----------
+        name: str
+            name of the Timeseries
+        timestamps: np.ndarray
+            array of unix timestamps of when the metric was collected
+        values: np.ndarray
+            array of recorded values aligned with timestamps
+        labels: Optional[Dict[str, str]] (default: None)
+            labels of the Timeseries
         """
-        dt = pd.Timestamp('1970-01-01')
-        delta = pd.Timedelta('1s')
-        df['unix'] = (df[time_col] - dt) // delta
-        other_df = df.astype({'unix': int, val_col: float})
-        raw_vals = dict(zip(other_df['unix'], other_df[val_col]))
+        values = np.asarray(values, dtype=float)
+        timestamps = np.asarray(timestamps)
+        if timestamps.dtype != np.int64:
+            timestamps = timestamps.astype(np.int64)
+        present = ~np.isnan(values)
+        if not present.all():
+            timestamps = timestamps[present]
+            values = values[present]
         return Timeseries(
             name=name,
-            values=raw_vals,
+            labels=labels,
+            columns=(timestamps, values),
+        )
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        """
+        method to decode Timeseries object encoded with to_bytes.
+        its arrays are read-only views of data
+
+        Parameters
+        ----------
+        data: bytes
+            encoded timeseries
+        """
+        series = decode_series(data=data)
+        if len(series) != 1:
+            raise ValueError('data does not hold a single timeseries')
+        return series[0]
+
+
+class SeriesRank(Enum):
+    """
+    SeriesRank is which series a SeriesCap keeps, ranked by their
+    average value
+    """
+    TOP = 'top'
+    BOTTOM = 'bottom'
+
+
+class SeriesCap(object):
+    """
+    SeriesCap caps the number of series a query fetches, so a query
+    matching thousands of series does not fit a model for each one.
+    queries push the cap down to their datasource where possible
+
+    Parameters
+    ----------
+    limit: int
+        max number of series to keep. 0 means no cap
+    rank: Optional[SeriesRank] (default: TOP)
+        which series to keep
+    other: Optional[bool] (default: False)
+        whether to add a series aggregating (summing) the series left
+        out by the cap
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        rank: Optional[SeriesRank] = SeriesRank.TOP,
+        other: Optional[bool] = False,
+    ) -> None:
+        self._limit = limit
+        self._rank = rank
+        self._other = other
+
+    def get_limit(self) -> int:
+        """method to get max number of series to keep"""
+        return self._limit
+
+    def get_rank(self) -> SeriesRank:
+        """method to get which series to keep"""
+        return self._rank
+
+    def get_other(self) -> bool:
+        """method to check if series left out are aggregated"""
+        return bool(self._other)
+
+    def is_enabled(self) -> bool:
+        """method to check if the number of series is capped"""
+        return self._limit > 0
+
+    def apply(self, series: Iterable[Timeseries]) -> List[Timeseries]:
+        """
+        method to keep the series ranked first by average value,
+        in their original order
+
+        Parameters
+        ----------
+        series: Iterable[Timeseries]
+            series to cap
+        """
+        series = list(series)
+        if not self.is_enabled() or len(series) <= self._limit:
+            return series
+        means = np.array([
+            s.get_values().mean() if s.get_length() else np.nan
+            for s in series
+        ])
+        # series without values rank last
+        means = np.nan_to_num(
+            means if self._rank == SeriesRank.TOP else -means,
+            nan=-np.inf,
         )
+        keep = np.sort(np.argsort(-means, kind='stable')[:self._limit])
+        return [series[i] for i in keep]
 
 
 class Query(AsyncTask, metaclass=abc.ABCMeta):
@@ -76,6 +278,14 @@ class Query(AsyncTask, metaclass=abc.ABCMeta):
     a given query from given datasource
     """
 
+    def get_capped(self) -> Optional[Tuple[int, int]]:
+        """
+        method to get number of series kept and number of series
+        matched by the query if its last fetch was capped by a
+        SeriesCap, otherwise None
+        """
+        return None
+
     @abc.abstractclassmethod
     async def fetch_result(self) -> Optional[Iterable[Timeseries]]:
         """
@@ -88,6 +298,307 @@ class Query(AsyncTask, metaclass=abc.ABCMeta):
         return await self.fetch_result()
 
 
+class MultiQuery(Query):
+    """
+    MultiQuery is a Query fetching the Timeseries of several queries
+    (possibly to different datasources) concurrently, so comparing
+    metrics takes as long as the slowest query rather than the sum
+    of all of them
+
+    Parameters
+    ----------
+    queries: Iterable[Query]
+        queries to fetch
+    labels: Iterable[str]
+        label of each query (i.e datasource and query). series of
+        different queries with the same name are told apart by
+        adding the label of their query to their name
+    """
+
+    def __init__(
+        self,
+        queries: Iterable[Query],
+        labels: Iterable[str],
+    ) -> None:
+        self._queries = list(queries)
+        self._labels = list(labels)
+
+    def get_capped(self) -> Optional[Tuple[int, int]]:
+        """
+        method to get number of series kept and number of series
+        matched by all the queries if any of them was capped,
+        otherwise None
+        """
+        capped = self.get_capped_queries().values()
+        if not capped:
+            return None
+        return (
+            sum(kept for kept, _ in capped),
+            sum(total for _, total in capped),
+        )
+
+    def get_capped_queries(self) -> Dict[str, Tuple[int, int]]:
+        """
+        method to get number of series kept and number of series
+        matched by each capped query by its label
+        """
+        capped = {}
+        for label, query in zip(self._labels, self._queries):
+            counts = query.get_capped()
+            if counts is not None:
+                capped[label] = counts
+        return capped
+
+    async def fetch_result(self) -> Optional[Iterable[Timeseries]]:
+        """
+        method to fetch result for the query
+        """
+        results = await asyncio.gather(*(
+            query.execute() for query in self._queries
+        ))
+        counts = {}
+        for result in results:
+            for series in result or ():
+                name = series.get_name()
+                counts[name] = counts.get(name, 0) + 1
+        all_series = []
+        for label, result in zip(self._labels, results):
+            for series in result or ():
+                name = series.get_name()
+                if counts[name] > 1:
+                    series = Timeseries(
+                        name=f'{name} [{label}]',
+                        labels=series.get_labels(),
+                        columns=(series.get_timestamps(), series.get_values()),
+                    )
+                all_series.append(series)
+        return all_series
+
+
+class CachedQuery(Query):
+    """
+    CachedQuery is a Query serving the Timeseries of another query
+    from a cache, fetching and caching them on a miss. results are
+    cached encoded with encode_series, so they can be shared with
+    other workers and hosts
+
+    Parameters
+    ----------
+    query: Query
+        query to fetch on a miss
+    cache: Cache
+        cache to look results up in
+    key: str
+        key identifying the query (i.e datasource, query, lookback
+        and series cap)
+    ttl: float
+        seconds results are cached for
+    """
+
+    def __init__(
+        self,
+        query: Query,
+        cache: Cache,
+        key: str,
+        ttl: float,
+    ) -> None:
+        self._query = query
+        self._cache = cache
+        self._key = key
+        self._ttl = ttl
+        self._capped = None
+
+    def get_capped(self) -> Optional[Tuple[int, int]]:
+        """
+        method to get number of series kept and number of series
+        matched by the query if its last fetch (cached or not) was
+        capped by a SeriesCap, otherwise None
+        """
+        return self._capped
+
+    async def fetch_result(self) -> Optional[Iterable[Timeseries]]:
+        """
+        method to fetch result for the query
+        """
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self._cache.get, self._key)
+        if data is not None:
+            try:
+                series, metadata = decode_series_with_metadata(data=data)
+                capped = metadata.get('capped')
+                self._capped = tuple(capped) if capped else None
+                return series
+            except ValueError:
+                pass
+        result = await self._query.execute()
+        self._capped = self._query.get_capped()
+        if result is not None:
+            result = list(result)
+            data = encode_series(
+                series=result,
+                metadata={'capped': self._capped},
+            )
+            await loop.run_in_executor(
+                None,
+                self._cache.set,
+                self._key,
+                data,
+                self._ttl,
+            )
+        return result
+
+
+def gen_other_series(
+    total: Timeseries,
+    kept: Iterable[Timeseries],
+) -> Timeseries:
+    """
+    function to generate the series aggregating series left out by
+    a SeriesCap, from the sum of all series matched and the series
+    kept. timestamps without a total are left out
+
+    Parameters
+    ----------
+    total: Timeseries
+        sum of all series matched by the query
+    kept: Iterable[Timeseries]
+        series kept by the cap
+    """
+    timestamps = total.get_timestamps()
+    if len(timestamps) == 0:
+        return Timeseries(name=OTHER_SERIES_NAME, values={})
+    others = total.get_values().copy()
+    order = np.argsort(timestamps, kind='stable')
+    ordered = timestamps[order]
+    for series in kept:
+        position = np.searchsorted(ordered, series.get_timestamps())
+        position = np.minimum(position, len(ordered) - 1)
+        found = ordered[position] == series.get_timestamps()
+        np.subtract.at(
+            others,
+            order[position[found]],
+            series.get_values()[found],
+        )
+    return Timeseries(
+        name=OTHER_SERIES_NAME,
+        columns=(timestamps, others),
+    )
+
+
+def sum_series(name: str, series: Iterable[Timeseries]) -> Timeseries:
+    """
+    function to sum series by timestamp, like sum() of promql.
+    timestamps of the sum are sorted
+
+    Parameters
+    ----------
+    name: str
+        name of the summed series
+    series: Iterable[Timeseries]
+        series to sum
+    """
+    series = list(series)
+    if not series:
+        return Timeseries(name=name, values={})
+    timestamps, index = np.unique(
+        np.concatenate([data.get_timestamps() for data in series]),
+        return_inverse=True,
+    )
+    total = np.bincount(
+        index,
+        weights=np.concatenate([data.get_values() for data in series]),
+        minlength=len(timestamps),
+    )
+    return Timeseries(name=name, columns=(timestamps, total))
+
+
+def encode_series(
+    series: Iterable[Timeseries],
+    metadata: Optional[dict] = None,
+) -> bytes:
+    """
+    function to encode series into a compact binary container. the
+    points of all series are written as two columns (timestamps and
+    values) and each series is a slice of them
+
+    Parameters
+    ----------
+    series: Iterable[Timeseries]
+        series to encode
+    metadata: Optional[dict] (default: None)
+        json serializable metadata to store along with the series
+    """
+    series = list(series)
+    slices = []
+    offset = 0
+    for data in series:
+        slices.append({
+            'name': data.get_name(),
+            'labels': data.get_labels(),
+            'offset': offset,
+            'length': data.get_length(),
+        })
+        offset += data.get_length()
+    columns = {
+        'timestamp': np.concatenate(
+            [data.get_timestamps() for data in series]
+            or [np.empty(0, np.int64)]
+        ).astype(np.int64, copy=False),
+        'value': np.concatenate(
+            [data.get_values() for data in series] or [np.empty(0)]
+        ).astype(float, copy=False),
+    }
+    return encode_columns(
+        columns=columns,
+        metadata={**(metadata or {}), 'series': slices},
+    )
+
+
+def decode_series(data: bytes) -> List[Timeseries]:
+    """
+    function to decode series encoded with encode_series. arrays of
+    each series are read-only views of data
+
+    Parameters
+    ----------
+    data: bytes
+        encoded series
+    """
+    return decode_series_with_metadata(data=data)[0]
+
+
+def decode_series_with_metadata(
+    data: bytes,
+) -> Tuple[List[Timeseries], dict]:
+    """
+    function to decode series encoded with encode_series along with
+    the metadata stored with them
+
+    Parameters
+    ----------
+    data: bytes
+        encoded series
+    """
+    columns, metadata = decode_columns(data=data)
+    try:
+        timestamps = columns['timestamp']
+        values = columns['value']
+        series = []
+        for info in metadata.pop('series'):
+            end = info['offset'] + info['length']
+            series.append(Timeseries(
+                name=info['name'],
+                labels=info['labels'],
+                columns=(
+                    timestamps[info['offset']:end],
+                    values[info['offset']:end],
+                ),
+            ))
+    except (KeyError, TypeError) as e:
+        raise ValueError(f'invalid series container: {e}')
+    return (series, metadata)
+
+
 class QueryExecError(AsyncExecutionError):
     """
     QueryExecError is an AsyncExecutionError that is thrown
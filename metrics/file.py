@@ -0,0 +1,471 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import date, datetime, timezone
+import asyncio
+import contextvars
+import csv
+import fnmatch
+import functools
+import glob
+import os
+import numpy as np
+from metrics.common import Query, QueryExecError, Timeseries
+from utils.imports import LazyModule
+from utils.instrumentation import time_stage
+
+pa = LazyModule('pyarrow')
+pq = LazyModule('pyarrow.parquet')
+pa_csv = LazyModule('pyarrow.csv')
+
+# file formats read by extension
+FILE_FORMATS = {
+    '.parquet': 'parquet',
+    '.arrow': 'ipc',
+    '.feather': 'ipc',
+    '.ipc': 'ipc',
+    '.csv': 'csv',
+}
+
+
+class FileQuery(Query):
+    """
+    FileQuery is a Query to read Timeseries data from a directory of
+    parquet, arrow ipc (feather) or csv files, so exported or archived
+    metrics can be analyzed without a server. files are memory mapped
+    and only the columns, parquet row groups and arrow record batches
+    needed for the query are read.
+
+    files are either wide, with a time column and a column for each
+    series, or long, with time, name and value columns. time is unix
+    seconds or an arrow timestamp/date.
+
+    queries select series (columns of wide files, names in long
+    files) by comma separated names or glob patterns, optionally
+    followed by a time range of unix timestamps or iso dates (i.e
+    cpu_*,mem_used @ 2020-07-01..2020-07-14). either end of the range
+    can be left out. without a start, lookback_days of data before
+    the end (or the latest point in the files) is read
+
+    Parameters
+    ----------
+    query: str
+        query selecting series and time range
+    source: str
+        directory (or single file) to read
+    lookback_days: Optional[int] (default: 7)
+        number of days of data to analyze
+    time_column: Optional[str] (default: timestamp)
+        column holding time of each row
+    name_column: Optional[str] (default: name)
+        column holding series name of each row in long files
+    value_column: Optional[str] (default: value)
+        column holding value of each row in long files
+    """
+
+    def __init__(
+        self,
+        query: str,
+        source: str,
+        lookback_days: Optional[int] = 7,
+        time_column: Optional[str] = 'timestamp',
+        name_column: Optional[str] = 'name',
+        value_column: Optional[str] = 'value',
+    ) -> None:
+        self._query = query
+        self._src = source
+        self._days = lookback_days
+        self._time_col = time_column
+        self._name_col = name_column
+        self._value_col = value_column
+
+    async def fetch_result(self) -> Optional[Iterable[Timeseries]]:
+        """
+        method to fetch result for the query
+        """
+        # reads block, so run them off the event loop (in the same
+        # context so stage timings of the request are collected)
+        context = contextvars.copy_context()
+        return await asyncio.get_event_loop().run_in_executor(
+            None,
+            functools.partial(context.run, self._read),
+        )
+
+    def _read(self) -> Iterable[Timeseries]:
+        """helper method to read series selected by query"""
+        selectors, start, end = self._parse_query()
+        files = self._list_files()
+        with time_stage(stage='fetch'):
+            try:
+                chunks = self._read_files(
+                    files=files,
+                    selectors=selectors,
+                    start=start,
+                    end=end,
+                )
+            except (OSError, ValueError, pa.ArrowException) as e:
+                self._throw_query_error(msg=f'Unable to read files: {e}')
+        with time_stage(stage='decode'):
+            series = []
+            for name in sorted(chunks):
+                timestamps = np.concatenate([ts for ts, _ in chunks[name]])
+                values = np.concatenate([vals for _, vals in chunks[name]])
+                order = np.argsort(timestamps, kind='stable')
+                try:
+                    series.append(Timeseries.from_arrays(
+                        name=name,
+                        timestamps=timestamps[order],
+                        values=values[order],
+                    ))
+                except (TypeError, ValueError) as e:
+                    self._throw_query_error(
+                        msg=f'Unable to decode series {name}: {e}'
+                    )
+        series = [s for s in series if s.get_length() > 0]
+        if len(series) == 0:
+            self._throw_query_error(msg='No results returned')
+        return series
+
+    def _read_files(
+        self,
+        files: List[Tuple[str, str]],
+        selectors: List[str],
+        start: Optional[float],
+        end: Optional[float],
+    ) -> Dict[str, List[Tuple[np.ndarray, np.ndarray]]]:
+        """
+        helper method to read chunks of (timestamps, values) of the
+        selected series from files by name
+        """
+        if start is None:
+            if end is None:
+                end = max(
+                    self._get_latest(path=path, file_format=file_format)
+                    for path, file_format in files
+                )
+            start = end - 86400 * self._days
+        chunks = {}
+        for path, file_format in files:
+            self._read_file(
+                path=path,
+                file_format=file_format,
+                selectors=selectors,
+                start=start,
+                end=end,
+                chunks=chunks,
+            )
+        return chunks
+
+    def _parse_query(
+        self
+    ) -> Tuple[List[str], Optional[float], Optional[float]]:
+        """helper method to parse selectors and time range of query"""
+        selection, _, time_range = self._query.partition('@')
+        selectors = [s.strip() for s in selection.split(',') if s.strip()]
+        if len(selectors) == 0:
+            self._throw_query_error(msg='No series selected')
+        start, end = None, None
+        if time_range.strip():
+            start, sep, end = time_range.partition('..')
+            if not sep:
+                self._throw_query_error(
+                    msg='Time range must be formatted as <start>..<end>'
+                )
+            start = self._parse_time(start)
+            end = self._parse_time(end)
+        return selectors, start, end
+
+    def _parse_time(self, value: str) -> Optional[float]:
+        """helper method to parse unix timestamp or iso date of range"""
+        value = value.strip()
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            self._throw_query_error(msg=f'Unable to parse time {value}')
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+    def _list_files(self) -> List[Tuple[str, str]]:
+        """helper method to list supported files of source"""
+        if os.path.isdir(self._src):
+            paths = sorted(glob.glob(os.path.join(self._src, '*')))
+        else:
+            paths = [self._src]
+        files = []
+        for path in paths:
+            file_format = FILE_FORMATS.get(os.path.splitext(path)[1].lower())
+            if file_format is not None and os.path.isfile(path):
+                files.append((path, file_format))
+        if len(files) == 0:
+            self._throw_query_error(msg='No data files found in source')
+        return files
+
+    def _get_latest(self, path: str, file_format: str) -> float:
+        """helper method to get latest time in a file"""
+        names = self._get_column_names(path=path, file_format=file_format)
+        if self._time_col not in names:
+            return -np.inf
+        if file_format == 'parquet':
+            parquet_file = pq.ParquetFile(path, memory_map=True)
+            index = parquet_file.schema_arrow.get_field_index(self._time_col)
+            metadata = parquet_file.metadata
+            stats = [
+                metadata.row_group(group).column(index).statistics
+                for group in range(parquet_file.num_row_groups)
+            ]
+            if all(stat is not None and stat.has_min_max for stat in stats):
+                return max(
+                    (to_unix(stat.max) for stat in stats),
+                    default=-np.inf,
+                )
+        latest = -np.inf
+        for batch in self._iter_batches(
+            path=path,
+            file_format=file_format,
+            columns=[self._time_col],
+        ):
+            times = self._get_times(batch)
+            if len(times):
+                latest = max(latest, float(times.max()))
+        return latest
+
+    def _read_file(
+        self,
+        path: str,
+        file_format: str,
+        selectors: List[str],
+        start: float,
+        end: Optional[float],
+        chunks: Dict[str, List[Tuple[np.ndarray, np.ndarray]]],
+    ) -> None:
+        """
+        helper method to read the selected series of a file between
+        start and end into chunks of (timestamps, values) by name
+        """
+        names = self._get_column_names(path=path, file_format=file_format)
+        if self._time_col not in names:
+            return
+        is_long = self._name_col in names and self._value_col in names
+        if is_long:
+            columns = [self._time_col, self._name_col, self._value_col]
+        else:
+            columns = [self._time_col] + [
+                name for name in names
+                if name != self._time_col and matches(name, selectors)
+            ]
+            if len(columns) == 1:
+                return
+        for batch in self._iter_batches(
+            path=path,
+            file_format=file_format,
+            columns=columns,
+            start=start,
+            end=end,
+        ):
+            times = self._get_times(batch)
+            mask = times >= start
+            if end is not None:
+                mask &= times <= end
+            if not mask.any():
+                continue
+            times = times[mask]
+            if not is_long:
+                for name in columns[1:]:
+                    # columns that are not metrics (i.e host names
+                    # matched by a glob) are skipped
+                    if not is_numeric(batch.column(name)):
+                        continue
+                    values = to_numpy(batch.column(name))[mask]
+                    chunks.setdefault(name, []).append((times, values))
+                continue
+            if not is_numeric(batch.column(self._value_col)):
+                self._throw_query_error(
+                    msg=f'Column {self._value_col} of {path} is not numeric'
+                )
+            # names are compared as strings, so name columns of
+            # integers (i.e ids) are selected like names
+            series_names = to_numpy(batch.column(self._name_col))[mask]
+            series_names = series_names.astype(str)
+            values = to_numpy(batch.column(self._value_col))[mask]
+            for name in np.unique(series_names):
+                if not matches(name, selectors):
+                    continue
+                selected = series_names == name
+                chunks.setdefault(name, []).append(
+                    (times[selected], values[selected])
+                )
+
+    def _get_column_names(self, path: str, file_format: str) -> List[str]:
+        """helper method to get column names of a file"""
+        if file_format == 'parquet':
+            return pq.ParquetFile(path, memory_map=True).schema_arrow.names
+        if file_format == 'ipc':
+            return self._open_ipc(path).schema.names
+        with open(path, newline='') as csv_file:
+            return next(csv.reader(csv_file), [])
+
+    def _iter_batches(
+        self,
+        path: str,
+        file_format: str,
+        columns: List[str],
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> Iterable[object]:
+        """
+        helper method to iterate over a file in batches holding at
+        least the given columns. parquet row groups and arrow record
+        batches entirely outside of start and end are skipped without
+        being read
+        """
+        if file_format == 'parquet':
+            parquet_file = pq.ParquetFile(path, memory_map=True)
+            groups = self._prune_row_groups(
+                parquet_file=parquet_file,
+                start=start,
+                end=end,
+            )
+            if groups:
+                yield parquet_file.read_row_groups(groups, columns=columns)
+        elif file_format == 'ipc':
+            reader = self._open_ipc(path)
+            for index in range(reader.num_record_batches):
+                batch = reader.get_batch(index)
+                times = self._get_times(batch)
+                if len(times) == 0:
+                    continue
+                if start is not None and times.max() < start:
+                    continue
+                if end is not None and times.min() > end:
+                    continue
+                yield batch
+        else:
+            yield pa_csv.read_csv(
+                pa.memory_map(path),
+                convert_options=pa_csv.ConvertOptions(
+                    include_columns=columns,
+                ),
+            )
+
+    def _prune_row_groups(
+        self,
+        parquet_file: object,
+        start: Optional[float],
+        end: Optional[float],
+    ) -> List[int]:
+        """
+        helper method to get row groups of a parquet file that may
+        hold rows between start and end based on their statistics
+        """
+        index = parquet_file.schema_arrow.get_field_index(self._time_col)
+        groups = []
+        for group in range(parquet_file.num_row_groups):
+            stats = parquet_file.metadata.row_group(group).column(
+                index
+            ).statistics
+            if stats is not None and stats.has_min_max:
+                if start is not None and to_unix(stats.max) < start:
+                    continue
+                if end is not None and to_unix(stats.min) > end:
+                    continue
+            groups.append(group)
+        return groups
+
+    def _open_ipc(self, path: str) -> object:
+        """helper method to open a memory mapped arrow ipc file"""
+        return pa.ipc.open_file(pa.memory_map(path))
+
+    def _get_times(self, batch: object) -> np.ndarray:
+        """helper method to get time column of a batch as unix seconds"""
+        column = batch.column(self._time_col)
+        if pa.types.is_timestamp(column.type):
+            column = column.cast(pa.timestamp('s'), safe=False)
+            column = column.cast(pa.int64())
+        elif pa.types.is_date(column.type):
+            column = column.cast(pa.timestamp('s')).cast(pa.int64())
+        return to_numpy(column).astype(float)
+
+    def _throw_query_error(self, msg: str) -> None:
+        """helper method to raise QueryExecError"""
+        raise QueryExecError(
+            datasource=self._src,
+            query=self._query,
+            error=msg
+        )
+
+
+def matches(name: str, selectors: Iterable[str]) -> bool:
+    """
+    function to check if a series name matches any selector
+
+    Parameters
+    ----------
+    name: str
+        name of the series
+    selectors: Iterable[str]
+        names or glob patterns to match
+    """
+    return any(fnmatch.fnmatchcase(name, selector) for selector in selectors)
+
+
+def to_unix(value: object) -> float:
+    """
+    function to convert a parquet statistic of a time column to unix
+    seconds
+
+    Parameters
+    ----------
+    value: object
+        datetime, date or number to convert
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(
+            value.year,
+            value.month,
+            value.day,
+            tzinfo=timezone.utc,
+        ).timestamp()
+    return float(value)
+
+
+def is_numeric(column: object) -> bool:
+    """
+    function to check if an arrow column holds numbers (or booleans)
+    that can be analyzed as values of a series
+
+    Parameters
+    ----------
+    column: object
+        arrow array or chunked array
+    """
+    return (
+        pa.types.is_integer(column.type)
+        or pa.types.is_floating(column.type)
+        or pa.types.is_boolean(column.type)
+        or pa.types.is_decimal(column.type)
+        or pa.types.is_null(column.type)
+    )
+
+
+def to_numpy(column: object) -> np.ndarray:
+    """
+    function to convert an arrow column to a numpy array. numeric
+    columns without nulls are not copied, nulls become NaN
+
+    Parameters
+    ----------
+    column: object
+        arrow array or chunked array
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    return column.to_numpy(zero_copy_only=False)
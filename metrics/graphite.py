@@ -1,6 +1,33 @@
-from typing import Optional, Dict, Iterable
-from utils.clients import AsyncRestClient, AsyncRestClientException
-from metrics.common import Query, QueryExecError, Timeseries
+from typing import Optional, Dict, Iterable, List, Tuple
+import asyncio
+import re
+import numpy as np
+from utils.clients import (
+    AsyncRestClient,
+    AsyncRestClientException,
+    ResponseFormat,
+)
+from metrics.common import (
+    OTHER_SERIES_NAME,
+    Query,
+    QueryExecError,
+    SeriesCap,
+    SeriesRank,
+    Timeseries,
+    gen_other_series,
+)
+from utils.instrumentation import time_stage
+
+# graphite functions series caps are pushed down with
+RANK_FUNCTIONS = {
+    SeriesRank.TOP: 'highestAverage',
+    SeriesRank.BOTTOM: 'lowestAverage',
+}
+# name graphite gives series summarized by step (i.e
+# summarize(foo.bar, "1h", "sum")), the name of the series is inside
+SUMMARIZE_NAME_RE = re.compile(
+    r'^summarize\((?P<name>.+), "[^"]*", "[^"]*"(, true)?\)$'
+)
 
 
 class GraphiteQuery(Query):
@@ -18,6 +45,16 @@ class GraphiteQuery(Query):
         number of days of data to analyze
     step: Optional[str] (default: 1h)
         resolution to use for data
+    render_format: Optional[ResponseFormat] (default: JSON)
+        render format to request from graphite. msgpack and pickle
+        are cheaper for graphite to produce and for capmon to decode
+    client: Optional[AsyncRestClient] (default: None)
+        client to make requests to source with. datasources share
+        a client so its timeouts, retries and circuit breaker apply
+        to all of their queries. a new client is used if not set
+    series_cap: Optional[SeriesCap] (default: None)
+        cap on the number of series to fetch, pushed down to graphite
+        with highestAverage/lowestAverage
     """
 
     def __init__(
@@ -25,58 +62,183 @@ class GraphiteQuery(Query):
         query: str,
         source: Optional[str] = 'http://localhost:8080',
         lookback_days: Optional[int] = 7,
-        step: Optional[str] = '1h'
+        step: Optional[str] = '1h',
+        render_format: Optional[ResponseFormat] = ResponseFormat.JSON,
+        client: Optional[AsyncRestClient] = None,
+        series_cap: Optional[SeriesCap] = None,
     ) -> None:
         self._query = query
         self._src = source
         self._step = step
-        self._client = AsyncRestClient(base_url=self._src)
+        self._format = render_format
+        self._client = client or AsyncRestClient(base_url=self._src)
+        self._cap = series_cap or SeriesCap(limit=0)
+        self._capped = None
         self._range_uri = '/render'
         self._from = f'-{lookback_days}d'
 
+    def get_capped(self) -> Optional[Tuple[int, int]]:
+        """
+        method to get number of series kept and number of series
+        matched by the query if its last fetch was capped, otherwise
+        None
+        """
+        return self._capped
+
     async def fetch_result(self) -> Optional[Iterable[Timeseries]]:
         """
         method to fetch result for the query
         """
-        vals = await self._get_data()
+        self._capped = None
+        if self._cap.is_enabled():
+            return await self._get_capped_series()
+        return await self._get_series(query=self._query)
+
+    async def _get_series(
+        self,
+        query: str,
+        func: Optional[str] = None,
+    ) -> List[Timeseries]:
+        """helper method to get series of a query summarized by step"""
+        vals = await self._get_data(query=query, func=func)
         series = []
         for name in vals:
-            series.append(
-                Timeseries(name=name, values=vals[name])
-            )
+            tags, timestamps, values = vals[name]
+            series.append(Timeseries.from_arrays(
+                name=name,
+                timestamps=timestamps,
+                values=values,
+                labels=tags,
+            ))
         return series
 
-    async def _get_data(self) -> Dict[str, Dict[int, float]]:
-        """helper method to get range data from graphite"""
-        target = f'summarize({self._query},"{self._step}")'
+    async def _get_capped_series(self) -> List[Timeseries]:
+        """
+        helper method to get series ranked first by graphite. one
+        series more than the limit is asked for to know if the cap
+        left any out, and only then are series counted (and summed
+        for the other series)
+        """
+        limit = self._cap.get_limit()
+        function = RANK_FUNCTIONS[self._cap.get_rank()]
+        series = await self._get_series(
+            query=f'{function}({self._query},{limit + 1})',
+        )
+        if len(series) <= limit:
+            return series
+        kept = self._cap.apply(series)
+        fetches = [
+            self._get_series(query=f'countSeries({self._query})', func='max'),
+        ]
+        if self._cap.get_other():
+            fetches.append(self._get_series(query=f'sumSeries({self._query})'))
+        results = await asyncio.gather(*fetches)
+        counts = results[0][0].get_values().tolist() or [0]
+        self._capped = (len(kept), max(int(max(counts)), len(series)))
+        if self._cap.get_other():
+            total = Timeseries(
+                name=OTHER_SERIES_NAME,
+                columns=(
+                    results[1][0].get_timestamps(),
+                    results[1][0].get_values(),
+                ),
+            )
+            kept.append(gen_other_series(total=total, kept=kept))
+        return kept
+
+    async def _get_data(
+        self,
+        query: str,
+        func: Optional[str] = None,
+    ) -> Dict[str, Tuple[Dict[str, str], np.ndarray, np.ndarray]]:
+        """
+        helper method to get range data from graphite, summarized by
+        step with func (graphite defaults to sum if not set)
+        """
+        target = f'summarize({query},"{self._step}")'
+        if func is not None:
+            target = f'summarize({query},"{self._step}","{func}")'
         params = {
             'target': target,
-            'format': 'json',
+            'format': self._format.value,
             'from': self._from,
         }
         try:
             res = await self._client.get(
                 uri=self._range_uri,
-                params=params
+                params=params,
+                response_format=self._format,
             )
             self._validate_range_result(res)
-            data = {}
-            for metric in res:
-                name = metric['tags']['name']
-                if name not in data:
-                    data[name] = {}
-                for val in metric['datapoints']:
-                    if val[0] is not None:
-                        data[name][int(val[1])] = float(val[0])
-            return data
+            with time_stage(stage='decode'):
+                return self._decode_result(res)
         except KeyError:
             self._throw_query_error(msg='Got bad data response')
-        except ValueError:
+        except (TypeError, ValueError):
             self._throw_query_error(msg='Got bad data response')
         except AsyncRestClientException as e:
             msg = e.get_msg() + ' Unable to fetch data from source'
             self._throw_query_error(msg=msg)
 
+    def _decode_result(
+        self,
+        result: Iterable[dict]
+    ) -> Dict[str, Tuple[Dict[str, str], np.ndarray, np.ndarray]]:
+        """
+        helper method to decode render response into tags and arrays
+        by name
+        """
+        data = {}
+        for metric in result:
+            if self._format == ResponseFormat.JSON:
+                name, tags, timestamps, values = self._decode_json(metric)
+            else:
+                name, tags, timestamps, values = self._decode_info(metric)
+            if name in data:
+                _, prev_timestamps, prev_values = data[name]
+                timestamps = np.concatenate([prev_timestamps, timestamps])
+                values = np.concatenate([prev_values, values])
+            data[name] = (tags, timestamps, values)
+        return data
+
+    def _decode_json(
+        self,
+        metric: dict
+    ) -> Tuple[str, Dict[str, str], np.ndarray, np.ndarray]:
+        """
+        helper method to decode a series from json render format,
+        where datapoints are [value, timestamp] pairs
+        """
+        points = np.array(metric['datapoints'], dtype=float).reshape(-1, 2)
+        tags = metric['tags']
+        return (tags['name'], tags, points[:, 1], points[:, 0])
+
+    def _decode_info(
+        self,
+        metric: dict
+    ) -> Tuple[str, Dict[str, str], np.ndarray, np.ndarray]:
+        """
+        helper method to decode a series from msgpack/pickle render
+        formats, where values are evenly spaced by step from start.
+        series are named by their tags like in the json format. name
+        holds the whole target (i.e summarize(foo.bar, "1h", "sum")),
+        so without tags the name of the summarized series is used
+        """
+        values = np.array(metric['values'], dtype=float)
+        timestamps = metric['start'] + metric['step'] * np.arange(
+            len(values),
+            dtype=np.int64,
+        )
+        tags = metric.get('tags') or {}
+        name = tags.get('name')
+        if name is None:
+            name = metric['name']
+            match = SUMMARIZE_NAME_RE.match(name)
+            if match is not None:
+                name = match.group('name')
+            tags = {**tags, 'name': name}
+        return (name, tags, timestamps, values)
+
     def _validate_range_result(self, result: Iterable[dict]) -> None:
         """helper method to validate response from prom range data query"""
         if len(result) == 0:
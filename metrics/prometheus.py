@@ -1,7 +1,62 @@
+from collections import Counter
+import asyncio
+import re
 import time
-from typing import Optional, Dict, Iterable
-from utils.clients import AsyncRestClient, AsyncRestClientException
-from metrics.common import Query, QueryExecError, Timeseries
+from typing import Optional, Dict, Iterable, List, Tuple
+import numpy as np
+from utils.clients import (
+    AsyncRestClient,
+    AsyncRestClientException,
+    ResponseFormat,
+)
+from metrics.common import (
+    OTHER_SERIES_NAME,
+    Query,
+    QueryExecError,
+    SeriesCap,
+    SeriesRank,
+    Timeseries,
+    gen_other_series,
+    sum_series,
+)
+from metrics.prompb import (
+    MATCHER_TYPES,
+    RESPONSE_TYPE_SAMPLES,
+    decode_read_response,
+    get_message_class,
+)
+from utils.imports import LazyModule
+from utils.instrumentation import time_stage
+
+snappy = LazyModule('snappy')
+
+# seconds per unit of prometheus durations
+DURATION_UNITS = {
+    'ms': 0.001,
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+    'y': 31536000,
+}
+DURATION_RE = re.compile(r'(\d+)(ms|s|m|h|d|w|y)')
+# promql functions series caps are pushed down with
+RANK_FUNCTIONS = {SeriesRank.TOP: 'topk', SeriesRank.BOTTOM: 'bottomk'}
+# seconds prometheus looks back for the latest sample at each step
+LOOKBACK_DELTA = 300
+# plain series selector (i.e up{job="api",instance=~"web.*"})
+SELECTOR_RE = re.compile(
+    r'^\s*(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)?\s*'
+    r'(\{(?P<matchers>.*)\})?\s*$',
+    re.DOTALL,
+)
+# single label matcher of a selector
+MATCHER_RE = re.compile(
+    r'\s*(?P<label>[a-zA-Z_][a-zA-Z0-9_]*)\s*(?P<op>=~|!~|!=|=)\s*'
+    r'(?P<value>"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|`[^`]*`)'
+    r'\s*(,|$)'
+)
 
 
 class PrometheusQuery(Query):
@@ -19,6 +74,20 @@ class PrometheusQuery(Query):
         number of days of data to analyze
     step: Optional[str] (default: 1h)
         resolution to use for data
+    response_format: Optional[ResponseFormat] (default: JSON)
+        PROTOBUF reads raw samples of plain selector queries with the
+        remote read api (snappy compressed protobuf), which is much
+        cheaper for prometheus to encode and capmon to decode. other
+        queries fall back to the json range query api
+    client: Optional[AsyncRestClient] (default: None)
+        client to make requests to source with. datasources share
+        a client so its timeouts, retries and circuit breaker apply
+        to all of their queries. a new client is used if not set
+    series_cap: Optional[SeriesCap] (default: None)
+        cap on the number of series to fetch. range queries are
+        filtered to the series topk/bottomk ranks first by their
+        average over the whole range, remote reads are capped after
+        decoding as selectors cannot be ranked by prometheus
     """
 
     def __init__(
@@ -26,14 +95,29 @@ class PrometheusQuery(Query):
         query: str,
         source: Optional[str] = 'http://localhost:9090',
         lookback_days: Optional[int] = 7,
-        step: Optional[str] = '1h'
+        step: Optional[str] = '1h',
+        response_format: Optional[ResponseFormat] = ResponseFormat.JSON,
+        client: Optional[AsyncRestClient] = None,
+        series_cap: Optional[SeriesCap] = None,
     ) -> None:
         self._query = query
         self._days = lookback_days
         self._src = source
         self._step = step
-        self._client = AsyncRestClient(base_url=self._src)
+        self._format = response_format
+        self._client = client or AsyncRestClient(base_url=self._src)
+        self._cap = series_cap or SeriesCap(limit=0)
+        self._capped = None
         self._range_uri = '/api/v1/query_range'
+        self._read_uri = '/api/v1/read'
+
+    def get_capped(self) -> Optional[Tuple[int, int]]:
+        """
+        method to get number of series kept and number of series
+        matched by the query if its last fetch was capped, otherwise
+        None
+        """
+        return self._capped
 
     async def fetch_result(self) -> Optional[Iterable[Timeseries]]:
         """
@@ -41,28 +125,95 @@ class PrometheusQuery(Query):
         """
         end = int(time.time())
         start = end - (86400 * self._days)
-        vals = await self._get_range_data(
+        self._capped = None
+        matchers = None
+        if self._format == ResponseFormat.PROTOBUF:
+            matchers = parse_selector(self._query)
+        if matchers is not None:
+            series = await self._get_remote_read_data(
+                start=start,
+                end=end,
+                matchers=matchers,
+            )
+            return self._cap_series(series=series)
+        if self._cap.is_enabled():
+            return await self._get_capped_range_series(start=start, end=end)
+        return await self._get_range_data(
             start=start,
             end=end,
+            query=self._query,
         )
-        series = []
-        for name in vals:
-            series.append(
-                Timeseries(name=name, values=vals[name])
+
+    def _cap_series(self, series: List[Timeseries]) -> List[Timeseries]:
+        """helper method to cap series fetched in full"""
+        kept = self._cap.apply(series)
+        if len(kept) == len(series):
+            return series
+        self._capped = (len(kept), len(series))
+        if self._cap.get_other():
+            total = sum_series(name=OTHER_SERIES_NAME, series=series)
+            kept.append(gen_other_series(total=total, kept=kept))
+        return kept
+
+    async def _get_capped_range_series(
+        self,
+        start: int,
+        end: int,
+    ) -> List[Timeseries]:
+        """
+        helper method to get range data of the series ranked first
+        by prometheus (see gen_rank_query). one series more than the
+        limit is asked for to know if the cap left any out, and only
+        then are series counted (and summed for the other series)
+        """
+        limit = self._cap.get_limit()
+        series = await self._get_range_data(
+            start=start,
+            end=end,
+            query=gen_rank_query(
+                query=self._query,
+                rank=self._cap.get_rank(),
+                limit=limit + 1,
+                start=start,
+                end=end,
+                step=self._step,
+            ),
+        )
+        if len(series) <= limit:
+            return series
+        kept = self._cap.apply(series)
+        queries = [f'count({self._query})']
+        if self._cap.get_other():
+            queries.append(f'sum({self._query})')
+        results = await asyncio.gather(*(
+            self._get_range_data(start=start, end=end, query=query)
+            for query in queries
+        ))
+        counts = results[0][0].get_values().tolist() or [0]
+        self._capped = (len(kept), max(int(max(counts)), len(series)))
+        if self._cap.get_other():
+            total = Timeseries(
+                name=OTHER_SERIES_NAME,
+                columns=(
+                    results[1][0].get_timestamps(),
+                    results[1][0].get_values(),
+                ),
             )
-        return series
+            kept.append(gen_other_series(total=total, kept=kept))
+        return kept
 
     async def _get_range_data(
         self,
         start: int,
         end: int,
-    ) -> Dict[str, Dict[int, float]]:
+        query: str,
+    ) -> List[Timeseries]:
         """helper method to get range data from prometheus"""
         params = {
             'start': start,
             'end': end,
             'step': self._step,
-            'query': self._query
+            'query': query,
         }
         try:
             res = await self._client.get(
@@ -70,18 +221,143 @@ class PrometheusQuery(Query):
                 params=params
             )
             self._validate_range_result(res)
-            data = {}
-            for metric in res['data']['result']:
-                name = metric['metric']['__name__']
-                if name not in data:
-                    data[name] = {}
-                for val in metric['values']:
-                    data[name][int(val[0])] = float(val[1])
-            return data
+            with time_stage(stage='decode'):
+                return self._decode_range_result(res)
         except AsyncRestClientException as e:
             msg = e.get_msg() + ' Unable to fetch data from source'
             self._throw_query_error(msg=msg)
 
+    async def _get_remote_read_data(
+        self,
+        start: int,
+        end: int,
+        matchers: List[Tuple[str, str, str]],
+    ) -> List[Timeseries]:
+        """helper method to get range data with prometheus remote read"""
+        step = parse_duration(self._step)
+        request = get_message_class('ReadRequest')()
+        query = request.queries.add(
+            start_timestamp_ms=int((start - LOOKBACK_DELTA) * 1000),
+            end_timestamp_ms=int(end * 1000),
+        )
+        for label, op, value in matchers:
+            query.matchers.add(
+                type=MATCHER_TYPES[op],
+                name=label,
+                value=value,
+            )
+        query.hints.step_ms = int(step * 1000)
+        query.hints.start_ms = int(start * 1000)
+        query.hints.end_ms = int(end * 1000)
+        request.accepted_response_types.append(RESPONSE_TYPE_SAMPLES)
+        try:
+            res = await self._client.post(
+                uri=self._read_uri,
+                data=snappy.compress(request.SerializeToString()),
+                headers={
+                    'Content-Encoding': 'snappy',
+                    'Content-Type': 'application/x-protobuf',
+                    'X-Prometheus-Remote-Read-Version': '0.1.0',
+                },
+                response_format=ResponseFormat.PROTOBUF,
+            )
+        except AsyncRestClientException as e:
+            msg = e.get_msg() + ' Unable to fetch data from source'
+            self._throw_query_error(msg=msg)
+        with time_stage(stage='decode'):
+            try:
+                data = self._decode_read_response(
+                    body=res,
+                    start=start,
+                    end=end,
+                    step=step,
+                )
+            except ValueError:
+                self._throw_query_error(
+                    msg='Unable to parse result from source'
+                )
+        if len(data) == 0:
+            self._throw_query_error(msg='No results returned')
+        return data
+
+    def _decode_read_response(
+        self,
+        body: bytes,
+        start: int,
+        end: int,
+        step: float,
+    ) -> List[Timeseries]:
+        """
+        helper method to decode raw samples of a remote read response
+        and evaluate them at each step like the range query api, so
+        both return the same points
+        """
+        steps = np.arange(start, end + 1, step)
+        data = {}
+        for labels, timestamps, values in decode_read_response(body=body):
+            timestamps, values = evaluate_at_steps(
+                timestamps=timestamps / 1000.0,
+                values=values,
+                steps=steps,
+            )
+            if len(timestamps) == 0:
+                continue
+            data.setdefault(tuple(sorted(labels)), []).append(
+                (timestamps, values)
+            )
+        return self._name_series(data=data)
+
+    def _decode_range_result(
+        self,
+        result: dict
+    ) -> List[Timeseries]:
+        """helper method to decode response from prom range data query"""
+        data = {}
+        for metric in result['data']['result']:
+            key = tuple(sorted(metric['metric'].items()))
+            if len(metric['values']) == 0:
+                continue
+            # values are [timestamp, "value"] pairs
+            timestamps, values = zip(*metric['values'])
+            data.setdefault(key, []).append((
+                np.array(timestamps, dtype=float),
+                np.array(values, dtype=float),
+            ))
+        return self._name_series(data=data)
+
+    def _name_series(
+        self,
+        data: Dict[
+            Tuple[Tuple[str, str], ...],
+            List[Tuple[np.ndarray, np.ndarray]],
+        ],
+    ) -> List[Timeseries]:
+        """
+        helper method to name series by their metric name from
+        chunks of timestamps and values by label set. labels are
+        added to names of series sharing a metric name or without
+        one (i.e results of functions), so each series is kept apart
+        """
+        label_sets = [dict(key) for key in data]
+        names = [labels.get('__name__', '') for labels in label_sets]
+        counts = Counter(names)
+        series = []
+        for name, labels, chunks in zip(names, label_sets, data.values()):
+            if not name or counts[name] > 1:
+                matchers = ', '.join(
+                    f'{label}="{value}"'
+                    for label, value in sorted(labels.items())
+                    if label != '__name__'
+                )
+                name = f'{name}{{{matchers}}}'
+            series.append(Timeseries.from_arrays(
+                name=name,
+                timestamps=np.concatenate([ts for ts, _ in chunks]),
+                values=np.concatenate([vals for _, vals in chunks]),
+                labels=labels,
+            ))
+        return series
+
     def _validate_range_result(self, result: dict) -> None:
         """helper method to validate response from prom range data query"""
         status = result.get('status', None)
@@ -101,3 +377,124 @@ class PrometheusQuery(Query):
             query=self._query,
             error=msg
         )
+
+
+def gen_rank_query(
+    query: str,
+    rank: SeriesRank,
+    limit: int,
+    start: int,
+    end: int,
+    step: str,
+) -> str:
+    """
+    function to generate a range query of the series of a query
+    ranked first by their average from start to end. topk/bottomk
+    of the query itself would rank series at each step, leaving
+    gaps in series that only rank first at some steps, so series
+    are ranked once by their average over the range (pinned to end
+    with the @ modifier) and the query is filtered to them with and
+
+    Parameters
+    ----------
+    query: str
+        promql query to rank series of
+    rank: SeriesRank
+        which series to keep
+    limit: int
+        number of series to keep
+    start: int
+        unix timestamp of the start of the range
+    end: int
+        unix timestamp of the end of the range
+    step: str
+        resolution of the range query
+    """
+    function = RANK_FUNCTIONS[rank]
+    average = f'avg_over_time(({query})[{end - start}s:{step}] @ {end})'
+    return f'({query}) and {function}({limit}, {average})'
+
+
+def parse_duration(duration: str) -> float:
+    """
+    function to parse prometheus duration (i.e 1h30m or 3600) into
+    seconds
+
+    Parameters
+    ----------
+    duration: str
+        duration to parse
+    """
+    duration = duration.strip()
+    try:
+        return float(duration)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(duration)
+    if not parts or ''.join(n + u for n, u in parts) != duration:
+        raise ValueError(f'invalid duration {duration}')
+    return sum(int(n) * DURATION_UNITS[u] for n, u in parts)
+
+
+def parse_selector(query: str) -> Optional[List[Tuple[str, str, str]]]:
+    """
+    function to parse a plain series selector into (label, operator,
+    value) matchers. returns None if query is any other expression
+
+    Parameters
+    ----------
+    query: str
+        promql query to parse
+    """
+    match = SELECTOR_RE.match(query)
+    if match is None:
+        return None
+    matchers = []
+    if match.group('name'):
+        matchers.append(('__name__', '=', match.group('name')))
+    text = match.group('matchers') or ''
+    position = 0
+    while text[position:].strip():
+        matcher = MATCHER_RE.match(text, position)
+        if matcher is None:
+            return None
+        value = matcher.group('value')
+        if value.startswith('`'):
+            value = value[1:-1]
+        else:
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        matchers.append((matcher.group('label'), matcher.group('op'), value))
+        position = matcher.end()
+    if len(matchers) == 0:
+        return None
+    return matchers
+
+
+def evaluate_at_steps(
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    steps: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    function to evaluate raw samples at each step the way prometheus
+    evaluates range queries of a selector: the latest sample within
+    LOOKBACK_DELTA before the step. stale (NaN) samples end a series
+
+    Parameters
+    ----------
+    timestamps: np.ndarray
+        sorted unix timestamps of samples
+    values: np.ndarray
+        values of samples
+    steps: np.ndarray
+        unix timestamps of steps
+    """
+    index = np.searchsorted(timestamps, steps, side='right') - 1
+    present = index >= 0
+    index = np.where(present, index, 0)
+    if len(timestamps):
+        present &= timestamps[index] > steps - LOOKBACK_DELTA
+        present &= ~np.isnan(values[index])
+    else:
+        present[:] = False
+    return steps[present], values[index[present]]
@@ -0,0 +1,323 @@
+"""
+subset of the prometheus remote read protocol (prompb remote.proto
+and types.proto) needed to read samples. message classes are built
+at runtime from a descriptor, so no generated code has to be kept in
+sync with the installed protobuf version. only field numbers and
+wire types matter for compatibility, so enums are declared as int32.
+
+samples of read responses are decoded straight from the wire format
+into arrays (see decode_read_response) rather than as a message per
+sample
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+import threading
+import numpy as np
+from utils.imports import LazyModule
+
+descriptor_pb2 = LazyModule('google.protobuf.descriptor_pb2')
+descriptor_pool = LazyModule('google.protobuf.descriptor_pool')
+message_factory = LazyModule('google.protobuf.message_factory')
+protobuf_message = LazyModule('google.protobuf.message')
+
+# protobuf package of the messages
+PACKAGE = 'prometheus'
+# prometheus.LabelMatcher.Type values by promql operator
+MATCHER_TYPES = {'=': 0, '!=': 1, '=~': 2, '!~': 3}
+# prometheus.ReadRequest.ResponseType for raw samples
+RESPONSE_TYPE_SAMPLES = 0
+# protobuf wire types
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LEN = 2
+WIRE_FIXED32 = 5
+# tags of the fields of a Sample (value as fixed64, timestamp as
+# varint) and of TimeSeries.samples (length delimited)
+SAMPLE_VALUE_TAG = (1 << 3) | WIRE_FIXED64
+SAMPLE_TIMESTAMP_TAG = (2 << 3) | WIRE_VARINT
+SAMPLES_TAG = (2 << 3) | WIRE_LEN
+# fields of each message as (name, number, type) where type is a
+# scalar type or the name of a message. names ending with [] are
+# repeated fields
+MESSAGES = {
+    'Sample': [
+        ('value', 1, 'double'),
+        ('timestamp', 2, 'int64'),
+    ],
+    'Label': [
+        ('name', 1, 'string'),
+        ('value', 2, 'string'),
+    ],
+    'TimeSeries': [
+        ('labels[]', 1, 'Label'),
+        ('samples[]', 2, 'Sample'),
+    ],
+    'LabelMatcher': [
+        ('type', 1, 'int32'),
+        ('name', 2, 'string'),
+        ('value', 3, 'string'),
+    ],
+    'ReadHints': [
+        ('step_ms', 1, 'int64'),
+        ('func', 2, 'string'),
+        ('start_ms', 3, 'int64'),
+        ('end_ms', 4, 'int64'),
+    ],
+    'Query': [
+        ('start_timestamp_ms', 1, 'int64'),
+        ('end_timestamp_ms', 2, 'int64'),
+        ('matchers[]', 3, 'LabelMatcher'),
+        ('hints', 4, 'ReadHints'),
+    ],
+    'ReadRequest': [
+        ('queries[]', 1, 'Query'),
+        ('accepted_response_types[]', 2, 'int32'),
+    ],
+    'QueryResult': [
+        ('timeseries[]', 1, 'TimeSeries'),
+    ],
+    'ReadResponse': [
+        ('results[]', 1, 'QueryResult'),
+    ],
+}
+
+_classes: Dict[str, type] = {}
+_classes_lock = threading.Lock()
+
+
+def get_message_class(name: str) -> type:
+    """
+    function to get the class of a prompb message
+
+    Parameters
+    ----------
+    name: str
+        name of the message (i.e ReadRequest)
+    """
+    if not _classes:
+        with _classes_lock:
+            if not _classes:
+                _classes.update(_build_classes())
+    return _classes[name]
+
+
+def decode_message(name: str, body: bytes) -> object:
+    """
+    function to decode a prompb message, raising ValueError if the
+    body is not a valid message
+
+    Parameters
+    ----------
+    name: str
+        name of the message (i.e ReadResponse)
+    body: bytes
+        encoded message
+    """
+    try:
+        return get_message_class(name).FromString(body)
+    except protobuf_message.DecodeError as e:
+        raise ValueError(str(e))
+
+
+def decode_read_response(
+    body: bytes,
+) -> List[Tuple[List[Tuple[str, str]], np.ndarray, np.ndarray]]:
+    """
+    function to decode the series of a ReadResponse into their
+    labels, timestamps (unix ms) and values, raising ValueError if
+    the body is not a valid message.
+
+    samples of a series are usually encoded as records of the same
+    length (every value set and timestamps of the same magnitude), so
+    they are decoded all at once as columns of a 2d byte array. other
+    series are decoded as messages
+
+    Parameters
+    ----------
+    body: bytes
+        encoded ReadResponse
+    """
+    series = []
+    for number, start, end in _iter_len_fields(body, 0, len(body)):
+        if number != 1:
+            continue
+        for inner, series_start, series_end in _iter_len_fields(
+            body, start, end,
+        ):
+            if inner == 1:
+                series.append(_decode_series(body, series_start, series_end))
+    return series
+
+
+def _decode_series(
+    body: bytes,
+    start: int,
+    end: int,
+) -> Tuple[List[Tuple[str, str]], np.ndarray, np.ndarray]:
+    """
+    helper function to decode labels and samples of an encoded
+    TimeSeries between start and end of body
+    """
+    label_class = get_message_class('Label')
+    labels = []
+    for number, field_start, field_end in _iter_len_fields(body, start, end):
+        if number == 1:
+            try:
+                label = label_class.FromString(body[field_start:field_end])
+            except protobuf_message.DecodeError as e:
+                raise ValueError(str(e))
+            labels.append((label.name, label.value))
+        elif number == 2:
+            # samples follow the labels, up to the end of the series.
+            # the tag is 2 bytes before samples of up to 127 bytes,
+            # longer ones are not decoded as records anyway
+            samples = _decode_sample_records(body, field_start - 2, end)
+            if samples is not None:
+                return (labels, *samples)
+            break
+    else:
+        return (labels, np.empty(0, dtype=np.int64), np.empty(0))
+    message = decode_message(name='TimeSeries', body=body[start:end])
+    count = len(message.samples)
+    timestamps = np.empty(count, dtype=np.int64)
+    values = np.empty(count)
+    for index, sample in enumerate(message.samples):
+        timestamps[index] = sample.timestamp
+        values[index] = sample.value
+    labels = [(label.name, label.value) for label in message.labels]
+    return (labels, timestamps, values)
+
+
+def _decode_sample_records(
+    body: bytes,
+    start: int,
+    end: int,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    helper function to decode consecutive TimeSeries.samples fields
+    between start and end of body as records of the same length:
+    tag and length of the field, tag and 8 bytes of the value, and
+    tag and varint of the timestamp. returns timestamps and values,
+    or None if the samples are not laid out that way
+    """
+    if start < 0 or end - start < 2 or body[start] != SAMPLES_TAG:
+        return None
+    size = body[start + 1] + 2
+    # value and a timestamp of 1 to 9 bytes (so it is positive)
+    if not 13 <= size <= 21 or (end - start) % size:
+        return None
+    records = np.frombuffer(
+        body,
+        dtype=np.uint8,
+        count=end - start,
+        offset=start,
+    ).reshape(-1, size)
+    varint = records[:, 12:].astype(np.int64)
+    valid = (
+        (records[:, 0] == SAMPLES_TAG)
+        & (records[:, 1] == size - 2)
+        & (records[:, 2] == SAMPLE_VALUE_TAG)
+        & (records[:, 11] == SAMPLE_TIMESTAMP_TAG)
+        & (varint[:, -1] < 0x80)
+        & (varint[:, :-1] >= 0x80).all(axis=1)
+    )
+    if not valid.all():
+        return None
+    values = np.ascontiguousarray(records[:, 3:11]).view('<f8').ravel()
+    shifts = 7 * np.arange(size - 12, dtype=np.int64)
+    timestamps = ((varint & 0x7f) << shifts).sum(axis=1)
+    return timestamps, values.astype(float)
+
+
+def _iter_len_fields(
+    body: bytes,
+    start: int,
+    end: int,
+) -> Iterator[Tuple[int, int, int]]:
+    """
+    helper function to iterate over fields of an encoded message
+    between start and end of body, yielding the number, start and
+    end of length delimited fields and skipping others
+    """
+    position = start
+    while position < end:
+        key, position = _read_varint(body, position, end)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_VARINT:
+            _, position = _read_varint(body, position, end)
+        elif wire_type == WIRE_FIXED64:
+            position += 8
+        elif wire_type == WIRE_FIXED32:
+            position += 4
+        elif wire_type == WIRE_LEN:
+            length, position = _read_varint(body, position, end)
+            yield number, position, position + length
+            position += length
+        else:
+            raise ValueError(f'unsupported wire type {wire_type}')
+        if position > end:
+            raise ValueError('truncated message')
+
+
+def _read_varint(body: bytes, position: int, end: int) -> Tuple[int, int]:
+    """
+    helper function to read a varint at position of body, returning
+    its value and the position after it
+    """
+    value = 0
+    shift = 0
+    while position < end and shift < 64:
+        byte = body[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+    raise ValueError('truncated varint')
+
+
+def _build_classes() -> Dict[str, type]:
+    """helper function to build message classes from MESSAGES"""
+    field_proto = descriptor_pb2.FieldDescriptorProto
+    scalar_types = {
+        'double': field_proto.TYPE_DOUBLE,
+        'int64': field_proto.TYPE_INT64,
+        'int32': field_proto.TYPE_INT32,
+        'string': field_proto.TYPE_STRING,
+    }
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name='capmon/prompb.proto',
+        package=PACKAGE,
+        syntax='proto3',
+    )
+    for message_name, fields in MESSAGES.items():
+        message = file_proto.message_type.add(name=message_name)
+        for field_name, number, field_type in fields:
+            field = message.field.add(
+                name=field_name.rstrip('[]'),
+                number=number,
+                label=(
+                    field_proto.LABEL_REPEATED
+                    if field_name.endswith('[]')
+                    else field_proto.LABEL_OPTIONAL
+                ),
+            )
+            if field_type in scalar_types:
+                field.type = scalar_types[field_type]
+            else:
+                field.type = field_proto.TYPE_MESSAGE
+                field.type_name = f'.{PACKAGE}.{field_type}'
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    classes = {}
+    for message_name in MESSAGES:
+        descriptor = pool.FindMessageTypeByName(f'{PACKAGE}.{message_name}')
+        if hasattr(message_factory, 'GetMessageClass'):
+            classes[message_name] = message_factory.GetMessageClass(
+                descriptor
+            )
+        else:
+            # protobuf < 4.21
+            classes[message_name] = message_factory.MessageFactory(
+                pool
+            ).GetPrototype(descriptor)
+    return classes
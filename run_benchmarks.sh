@@ -0,0 +1,9 @@
+#!/bin/sh
+# usage: ./run_benchmarks.sh [e2e|micro|load|imports] [options]
+# runs a benchmark suite (e2e by default) compared against its local
+# baseline (pass --save-baseline to record it, baselines are not committed)
+SUITE=e2e
+case "$1" in
+  e2e|micro|load|imports) SUITE=$1; shift ;;
+esac
+python -m benchmarks.$SUITE --baseline benchmarks/baselines/$SUITE.json "$@"
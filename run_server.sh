@@ -1,3 +1,5 @@
 #!/bin/sh
-CMD_ARGS=$( python get_gunicorn_args.py 2>&1)
-GUNICORN_CMD_ARGS="$CMD_ARGS" gunicorn app:server
+# directory used to aggregate /metrics across gunicorn workers
+prometheus_multiproc_dir=${prometheus_multiproc_dir:-$(mktemp -d)}
+export prometheus_multiproc_dir
+gunicorn --config gunicorn_conf.py app:server
@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+from metrics.common import Timeseries
+from analysis.common import Report, Trend
+
+
+class ReportTest(unittest.TestCase):
+
+    def test_report_round_trip(self) -> None:
+        """test reports are decoded as encoded"""
+        forecast = Timeseries(
+            name='cpu_forecast',
+            values={0: 1.0, 3600: 2.0},
+        )
+        lower = Timeseries(name='cpu_forecast_lower', values={0: 0.5})
+        upper = Timeseries(name='cpu_forecast_upper', values={0: 1.5})
+        report = Report.from_bytes(Report(
+            forecasts=[forecast, Timeseries(name='empty_forecast')],
+            daily_trend=Trend(trend_vals={'Monday': 1.0, 'Tuesday': 2.0}),
+            hourly_trend=Trend(trend_vals={np.int64(0): 3.0, 1: 4.0}),
+            forecast_bounds={'cpu_forecast': (lower, upper)},
+            anomaly_scores={'cpu': Timeseries(
+                name='cpu_anomaly_score',
+                values={0: -0.5, 3600: 4.0},
+            )},
+        ).to_bytes())
+        forecasts = report.get_forecasts()
+        self.assertEqual(
+            [f.get_name() for f in forecasts],
+            ['cpu_forecast', 'empty_forecast'],
+        )
+        self.assertEqual(forecasts[0].get_raw_vals(), {0: 1.0, 3600: 2.0})
+        self.assertEqual(forecasts[1].get_length(), 0)
+        bounds = report.get_forecast_bounds()
+        self.assertEqual(list(bounds), ['cpu_forecast'])
+        self.assertEqual(
+            [b.get_raw_vals() for b in bounds['cpu_forecast']],
+            [{0: 0.5}, {0: 1.5}],
+        )
+        scores = report.get_anomaly_scores()
+        self.assertEqual(list(scores), ['cpu'])
+        self.assertEqual(scores['cpu'].get_raw_vals(), {0: -0.5, 3600: 4.0})
+        self.assertEqual(
+            report.get_daily_trends().get_trend_vals(),
+            {'Monday': 1.0, 'Tuesday': 2.0},
+        )
+        self.assertEqual(
+            report.get_hourly_trends().get_trend_vals(),
+            {0: 3.0, 1: 4.0},
+        )
+
+    def test_partial_report_round_trip(self) -> None:
+        """test missing parts of reports stay missing"""
+        report = Report.from_bytes(Report().to_bytes())
+        self.assertIsNone(report.get_forecasts())
+        self.assertIsNone(report.get_forecast_bounds())
+        self.assertIsNone(report.get_daily_trends())
+        self.assertIsNone(report.get_hourly_trends())
+        self.assertIsNone(report.get_anomaly_scores())
+        trend = Trend.from_bytes(Trend(trend_vals={5: 1.25}).to_bytes())
+        self.assertEqual(trend.get_trend_vals(), {5: 1.25})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import unittest
+import numpy as np
+from metrics.common import Timeseries
+from analysis.common import ReporterError
+from analysis.evaluation import (
+    Backtester,
+    gen_accuracy,
+    gen_cutoffs,
+)
+from analysis.forecast import PredictMode
+
+
+class BacktesterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """method executed before every test"""
+        hours = np.arange(10 * 24)
+        self.series = Timeseries(
+            name='sin',
+            columns=(
+                1595823193 + hours * 3600,
+                np.abs(np.sin(hours * np.pi / 24)) + 1,
+            ),
+        )
+
+    def test_cutoffs(self) -> None:
+        """test cutoffs roll back from the end keeping initial history"""
+        timestamps = np.arange(0, 10 * 86400 + 1, 3600)
+        cutoffs = gen_cutoffs(
+            timestamps=timestamps,
+            horizon=86400,
+            folds=4,
+            initial=3 * 86400,
+        )
+        self.assertEqual(cutoffs.tolist(), [86400 * d for d in (6, 7, 8, 9)])
+        cutoffs = gen_cutoffs(
+            timestamps=timestamps,
+            horizon=86400,
+            folds=10,
+            initial=7 * 86400,
+        )
+        self.assertEqual(cutoffs.tolist(), [86400 * d for d in (7, 8, 9)])
+        self.assertEqual(len(gen_cutoffs(
+            timestamps=timestamps[:24],
+            horizon=86400,
+            folds=4,
+            initial=86400,
+        )), 0)
+        # cutoffs followed by a gap of a horizon have nothing to test
+        gap = timestamps[(timestamps < 7 * 86400) | (timestamps > 9 * 86400)]
+        cutoffs = gen_cutoffs(
+            timestamps=gap,
+            horizon=86400,
+            folds=4,
+            initial=3 * 86400,
+        )
+        self.assertEqual(cutoffs.tolist(), [86400 * d for d in (6, 9)])
+        # cutoffs need enough points to fit on
+        sparse = np.array([0, 5 * 86400, 5 * 86400 + 3600, 6 * 86400])
+        cutoffs = gen_cutoffs(
+            timestamps=sparse,
+            horizon=86400,
+            folds=3,
+            initial=3 * 86400,
+        )
+        self.assertEqual(cutoffs.tolist(), [5 * 86400])
+
+    def test_accuracy(self) -> None:
+        """test metrics are computed over the points of all folds"""
+        folds = [
+            (np.array([1.0, 2.0]), np.array([1.5, 2.0]),
+             np.array([0.0, 2.5]), np.array([2.0, 3.0])),
+            (np.array([0.0, 4.0]), np.array([1.0, 3.0]),
+             np.array([-1.0, 0.0]), np.array([1.0, 5.0])),
+        ]
+        accuracy = gen_accuracy(name='up', folds=folds, with_bounds=True)
+        self.assertEqual(accuracy.get_folds(), 2)
+        self.assertEqual(accuracy.get_points(), 4)
+        # the 0 actual is left out of the percentage error
+        self.assertAlmostEqual(accuracy.get_mape(), (0.5 + 0 + 0.25) / 3)
+        self.assertAlmostEqual(accuracy.get_rmse(), np.sqrt(2.25 / 4))
+        self.assertAlmostEqual(accuracy.get_coverage(), 0.75)
+        accuracy = gen_accuracy(
+            name='up',
+            folds=[fold[:2] + (None, None) for fold in folds],
+            with_bounds=False,
+        )
+        self.assertIsNone(accuracy.get_coverage())
+        self.assertEqual(
+            gen_accuracy(name='up', folds=[], with_bounds=False).to_dict(),
+            {
+                'name': 'up', 'folds': 0, 'points': 0,
+                'mape': None, 'rmse': None, 'coverage': None,
+            },
+        )
+
+    def test_backtest(self) -> None:
+        """test folds run in processes give the same accuracy"""
+        short = Timeseries(name='short', values={1595823193: 1.0})
+        results = []
+        for workers in (0, 2):
+            results.append(Backtester(
+                series=[self.series, short],
+                folds=2,
+                predict_mode=PredictMode.NONE,
+                workers=workers,
+            ).execute_sync())
+        serial, parallel = results
+        self.assertEqual(serial[0].get_folds(), 2)
+        self.assertEqual(serial[0].get_points(), 48)
+        self.assertLess(serial[0].get_mape(), 0.1)
+        self.assertIsNone(serial[0].get_coverage())
+        self.assertEqual(serial[1].get_folds(), 0)
+        self.assertEqual(
+            [a.to_dict() for a in serial],
+            [a.to_dict() for a in parallel],
+        )
+
+    def test_backtest_gap(self) -> None:
+        """test folds over a gap of the series are skipped"""
+        timestamps = self.series.get_timestamps()
+        keep = (timestamps < timestamps[0] + 6 * 86400) | (
+            timestamps >= timestamps[0] + 8 * 86400
+        )
+        series = Timeseries(
+            name='gap',
+            columns=(timestamps[keep], self.series.get_values()[keep]),
+        )
+        accuracy = Backtester(
+            series=[series],
+            folds=4,
+            predict_mode=PredictMode.NONE,
+        ).execute_sync()[0]
+        self.assertEqual(accuracy.get_folds(), 2)
+        self.assertGreater(accuracy.get_points(), 0)
+
+    def test_coverage(self) -> None:
+        """test coverage of uncertainty intervals is evaluated"""
+        accuracy = Backtester(
+            series=[self.series],
+            folds=1,
+            predict_mode=PredictMode.FAST,
+        ).execute_sync()[0]
+        self.assertGreater(accuracy.get_coverage(), 0.5)
+
+    def test_failed_fold(self) -> None:
+        """test failures of folds fail the evaluation"""
+        values = np.full(self.series.get_length(), np.inf)
+        series = Timeseries(
+            name='inf',
+            columns=(self.series.get_timestamps(), values),
+        )
+        with self.assertRaises(ReporterError):
+            Backtester(series=[series], folds=1).execute_sync()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,11 @@ from typing import Iterable
 import numpy as np
 from metrics.common import Timeseries
 from analysis.common import Reporter, Report
-from analysis.forecast import FBProphetForecaster
+from analysis.forecast import (
+    FBProphetForecaster,
+    PredictMode,
+    gen_horizon_offsets,
+)
 
 
 def rmse(
@@ -175,6 +179,112 @@ class ForecasterTests(unittest.TestCase):
         report = self.gen_report_from_forecaster(forecaster)
         # verify report data
         self.verify_report_data(report=report)
+        # uncertainty is not simulated by default
+        self.assertFalse(report.contains_forecast_bounds())
+
+    def test_fbprophet_forecast_bounds(self) -> None:
+        """
+        method to test uncertainty bounds of FBProphetForecaster
+        """
+        forecaster = FBProphetForecaster(
+            series=self.series,
+            forecast_days=self.days_forecast,
+            predict_mode=PredictMode.FAST,
+        )
+        report = self.gen_report_from_forecaster(forecaster)
+        self.verify_report_data(report=report)
+        self.assertTrue(report.contains_forecast_bounds())
+        bounds = report.get_forecast_bounds()
+        self.assertEqual(sorted(bounds), ['cos_forecast', 'sin_forecast'])
+        forecast = report.get_forecasts()[0].get_raw_vals()
+        lower, upper = bounds['sin_forecast']
+        self.assertEqual(lower.get_name(), 'sin_forecast_lower')
+        lower = lower.get_raw_vals()
+        upper = upper.get_raw_vals()
+        self.assertEqual(list(lower), list(forecast))
+        for ts in forecast:
+            self.assertLessEqual(lower[ts], forecast[ts])
+            self.assertGreaterEqual(upper[ts], forecast[ts])
+
+    def test_fbprophet_anomaly_scores(self) -> None:
+        """
+        method to test historical points are scored against the
+        in-sample prediction of the fitted model
+        """
+        sin = self.series[0]
+        values = sin.get_values().copy()
+        spike = len(values) // 2
+        values[spike] = 10.0
+        series = Timeseries(
+            name='sin',
+            columns=(sin.get_timestamps(), values),
+        )
+        report = self.gen_report_from_forecaster(FBProphetForecaster(
+            series=[series],
+            forecast_days=self.days_forecast,
+            score_anomalies=True,
+        ))
+        scores = report.get_anomaly_scores()['sin']
+        self.assertEqual(scores.get_name(), 'sin_anomaly_score')
+        np.testing.assert_array_equal(
+            scores.get_timestamps(),
+            series.get_timestamps(),
+        )
+        scores = np.abs(scores.get_values())
+        self.assertEqual(int(np.argmax(scores)), spike)
+        self.assertGreater(scores[spike], 3)
+        self.assertLess(np.mean(scores >= 3), 0.05)
+        # anomalies are only scored when asked for
+        self.assertFalse(self.gen_report_from_forecaster(FBProphetForecaster(
+            series=[series],
+            forecast_days=self.days_forecast,
+        )).contains_anomaly_scores())
+
+    def test_fbprophet_mixed_resolution(self) -> None:
+        """
+        method to test coarse forecast points after hourly days
+        keep the trends of an all hourly forecast
+        """
+        hourly = self.gen_report_from_forecaster(FBProphetForecaster(
+            series=self.series[:1],
+            forecast_days=14,
+            hourly_days=14,
+        ))
+        mixed = self.gen_report_from_forecaster(FBProphetForecaster(
+            series=self.series[:1],
+            forecast_days=14,
+            hourly_days=2,
+            coarse_hours=6,
+        ))
+        forecast = list(mixed.get_forecasts()[0].get_raw_vals())
+        self.assertEqual(len(forecast), 2 * 24 + 12 * 4)
+        self.assertEqual(forecast[47] - forecast[46], 3600)
+        self.assertEqual(forecast[48] - forecast[47], 6 * 3600)
+        self.assertEqual(forecast[-1], self.now + 14 * 86400)
+        for name in ('get_daily_trends', 'get_hourly_trends'):
+            expected = getattr(hourly, name)().get_trend_vals()
+            actual = getattr(mixed, name)().get_trend_vals()
+            self.assertEqual(list(actual), list(expected))
+            np.testing.assert_allclose(
+                list(actual.values()),
+                list(expected.values()),
+                rtol=1e-6,
+            )
+
+    def test_gen_horizon_offsets(self) -> None:
+        """method to test hours forecast of the horizon"""
+        self.assertEqual(
+            list(gen_horizon_offsets(4, 8, 6)),
+            [1, 2, 3, 4],
+        )
+        self.assertEqual(
+            list(gen_horizon_offsets(16, 2, 6)),
+            [1, 2, 8, 14, 16],
+        )
+        self.assertEqual(
+            list(gen_horizon_offsets(14, 0, 6)),
+            [6, 12, 14],
+        )
 
 
 if __name__ == '__main__':
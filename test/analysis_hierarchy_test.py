@@ -0,0 +1,123 @@
+import asyncio
+import unittest
+from math import sin
+import numpy as np
+from metrics.common import Timeseries
+from analysis.forecast import FBProphetForecaster, PredictMode
+from analysis.hierarchy import (
+    HierarchicalForecaster,
+    gen_shares,
+    group_series,
+)
+
+
+class HierarchicalForecasterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """method executed before every test"""
+        self.now = 1595823193
+        hours = np.arange(14 * 24)
+        timestamps = self.now - 3600 * hours[::-1]
+        base = np.abs(np.sin(hours)) + 1.0
+        self.series = [
+            Timeseries.from_arrays(
+                name=f'cpu{index}',
+                timestamps=timestamps,
+                values=base * scale,
+                labels={'job': job},
+            )
+            for index, (job, scale) in enumerate(
+                [('api', 1.0), ('api', 3.0), ('db', 2.0)]
+            )
+        ]
+
+    def test_group_series(self) -> None:
+        """test series are summed by label in order of appearance"""
+        groups = group_series(series=self.series, group_by='job')
+        self.assertEqual(
+            [aggregate.get_name() for aggregate, _ in groups],
+            ['total{job="api"}', 'total{job="db"}'],
+        )
+        self.assertEqual([len(members) for _, members in groups], [2, 1])
+        aggregate = groups[0][0].get_raw_vals()
+        expected = 4 * (abs(sin(14 * 24 - 1)) + 1)
+        self.assertAlmostEqual(aggregate[self.now], expected)
+        groups = group_series(series=self.series)
+        self.assertEqual(groups[0][0].get_name(), 'total')
+        self.assertEqual(len(groups[0][1]), 3)
+        groups = group_series(series=self.series, group_by='instance')
+        self.assertEqual(groups[0][0].get_name(), 'total{instance=""}')
+
+    def test_gen_shares(self) -> None:
+        """test shares follow contributions to the historical total"""
+        np.testing.assert_allclose(
+            gen_shares(series=self.series),
+            [1 / 6, 3 / 6, 2 / 6],
+        )
+        # a series present for half of the history contributes half
+        # as much as one as large present for all of it
+        timestamps = np.arange(4)
+        partial = [
+            Timeseries(name='a', columns=(timestamps, np.ones(4))),
+            Timeseries(name='b', columns=(timestamps[2:], np.ones(2))),
+        ]
+        np.testing.assert_allclose(gen_shares(series=partial), [2 / 3, 1 / 3])
+        zeros = [
+            Timeseries(name='a', values={0: 0.0}),
+            Timeseries(name='b', values={}),
+        ]
+        self.assertEqual(gen_shares(series=zeros), [0.5, 0.5])
+
+    def test_forecast(self) -> None:
+        """test forecasts of aggregates are split to their members"""
+        forecaster = HierarchicalForecaster(
+            series=self.series,
+            group_by='job',
+            forecast_days=2,
+            predict_mode=PredictMode.FAST,
+            score_anomalies=True,
+        )
+        report = asyncio.run(forecaster.report())
+        forecasts = {f.get_name(): f for f in report.get_forecasts()}
+        self.assertEqual(list(forecasts), [
+            'total{job="api"}_forecast',
+            'cpu0_forecast',
+            'cpu1_forecast',
+            'total{job="db"}_forecast',
+            'cpu2_forecast',
+        ])
+        api = forecasts['total{job="api"}_forecast'].get_raw_vals()
+        cpu0 = forecasts['cpu0_forecast'].get_raw_vals()
+        cpu1 = forecasts['cpu1_forecast'].get_raw_vals()
+        self.assertEqual(len(cpu0), 48)
+        for ts in api:
+            self.assertAlmostEqual(cpu0[ts] + cpu1[ts], api[ts])
+            self.assertAlmostEqual(cpu1[ts], 3 * cpu0[ts])
+        self.assertEqual(
+            forecasts['cpu2_forecast'].get_raw_vals(),
+            forecasts['total{job="db"}_forecast'].get_raw_vals(),
+        )
+        lower, upper = report.get_forecast_bounds()['cpu1_forecast']
+        self.assertEqual(lower.get_name(), 'cpu1_forecast_lower')
+        for ts in cpu1:
+            self.assertLessEqual(lower.get_raw_vals()[ts], cpu1[ts])
+            self.assertGreaterEqual(upper.get_raw_vals()[ts], cpu1[ts])
+        # aggregates are what is fit, so they are what is scored
+        self.assertEqual(
+            list(report.get_anomaly_scores()),
+            ['total{job="api"}', 'total{job="db"}'],
+        )
+        # trends average over the members like forecasting each does
+        each = asyncio.run(FBProphetForecaster(
+            series=self.series,
+            forecast_days=2,
+        ).report())
+        np.testing.assert_allclose(
+            list(report.get_daily_trends().get_vals()),
+            list(each.get_daily_trends().get_vals()),
+            rtol=0.05,
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
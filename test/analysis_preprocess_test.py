@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+from metrics.common import Timeseries
+from analysis.preprocess import Aggregation, GapFill, Resampler
+
+
+class ResamplerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """method executed before every test"""
+        # minutely points of hours 0 and 1, none in hour 2 and a
+        # single point in hour 3
+        values = {60 * i: float(i % 60) for i in range(120)}
+        values[3 * 3600 + 60] = 7.0
+        values[3 * 3600 + 120] = float('nan')
+        self.series = Timeseries(name='cpu', values=values)
+
+    def resample(self, **kwargs) -> dict:
+        """helper method to resample series to hourly raw values"""
+        resampler = Resampler(resolution=3600, **kwargs)
+        result = resampler.resample(series=[self.series])
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].get_name(), 'cpu')
+        return result[0].get_raw_vals()
+
+    def test_aggregations(self) -> None:
+        """test points of an interval are combined by aggregation"""
+        self.assertEqual(
+            self.resample(aggregation=Aggregation.MEAN),
+            {0: 29.5, 3600: 29.5, 3 * 3600: 7.0},
+        )
+        self.assertEqual(
+            self.resample(aggregation=Aggregation.MAX),
+            {0: 59.0, 3600: 59.0, 3 * 3600: 7.0},
+        )
+        p95 = self.resample(aggregation=Aggregation.P95)
+        self.assertAlmostEqual(p95[0], np.percentile(np.arange(60), 95))
+        self.assertEqual(p95[3 * 3600], 7.0)
+
+    def test_gap_fill(self) -> None:
+        """test intervals without points are filled or dropped"""
+        self.assertNotIn(2 * 3600, self.resample(fill=GapFill.DROP))
+        linear = self.resample(fill=GapFill.LINEAR)
+        self.assertEqual(list(linear), [0, 3600, 2 * 3600, 3 * 3600])
+        self.assertAlmostEqual(linear[2 * 3600], (29.5 + 7.0) / 2)
+        previous = self.resample(fill=GapFill.PREVIOUS)
+        self.assertEqual(previous[2 * 3600], 29.5)
+
+    def test_passthrough_and_empty(self) -> None:
+        """test resolution 0 passes series through and empty series"""
+        resampler = Resampler(resolution=0)
+        self.assertIs(resampler.resample(series=[self.series])[0], self.series)
+        empty = Timeseries(name='empty', values={0: float('nan')})
+        result = Resampler(resolution=60).resample(series=[empty])
+        self.assertEqual(result[0].get_raw_vals(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
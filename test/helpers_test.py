@@ -0,0 +1,103 @@
+import json
+import unittest
+from plotly.utils import PlotlyJSONEncoder
+from analysis.common import Report
+from metrics.common import Timeseries
+from helpers import (
+    flag_anomalies,
+    gen_forecast_graph_figure,
+    gen_line_points,
+    gen_report_key,
+    is_valid_data,
+    warm_up,
+)
+
+
+class HelpersTest(unittest.TestCase):
+
+    def test_is_valid_data(self) -> None:
+        """test queries need a datasource and a query"""
+        valid = is_valid_data(source='prom', query='up')
+        self.assertEqual(valid, (True, None))
+        self.assertFalse(is_valid_data(source=' ', query='up')[0])
+        self.assertFalse(is_valid_data(source='prom', query=None)[0])
+
+    def test_warm_up(self) -> None:
+        """test warm up runs every stage of a synthetic analysis"""
+        timings = warm_up(lookback_days=7, forecast_days=7)
+        for stage in ('import', 'fit', 'predict', 'trends', 'figure'):
+            self.assertIn(stage, timings)
+            self.assertGreaterEqual(timings[stage], 0.0)
+
+    def test_forecast_bands(self) -> None:
+        """test uncertainty intervals are drawn as bands"""
+        series = Timeseries(name='up', values={0: 1.0, 3600: 2.0})
+        forecast = Timeseries(name='up_forecast', values={7200: 3.0})
+        lower = Timeseries(name='up_forecast_lower', values={7200: 2.0})
+        upper = Timeseries(name='up_forecast_upper', values={7200: 4.0})
+        figure = gen_forecast_graph_figure(
+            series=[series],
+            report=Report(
+                forecasts=[forecast],
+                forecast_bounds={'up_forecast': (lower, upper)},
+            ),
+        )
+        names = [line['name'] for line in figure['data']]
+        self.assertEqual(names, [
+            'up_forecast_upper',
+            'up_forecast_interval',
+            'up_forecast',
+            'up',
+        ])
+        self.assertEqual(figure['data'][1]['fill'], 'tonexty')
+        self.assertEqual(list(figure['data'][1]['y']), [2.0])
+
+    def test_line_points(self) -> None:
+        """test lines are plain lists of epoch milliseconds and values"""
+        series = Timeseries(name='up', values={0: 1.0, 3600: float('nan')})
+        forecast = Timeseries(name='up_forecast', values={7200: 3.0})
+        x, y = gen_line_points(series=[series, forecast])
+        self.assertEqual(x, [0, 3600000, 7200000])
+        self.assertEqual(y, [1.0, None, 3.0])
+        figure = gen_forecast_graph_figure(
+            series=[series],
+            report=Report(forecasts=[forecast]),
+        )
+        self.assertEqual(figure['layout']['xaxis']['type'], 'date')
+        self.assertEqual(figure['data'][0]['x'], x)
+        encoded = json.dumps(figure, cls=PlotlyJSONEncoder)
+        self.assertNotIn('NaN', encoded)
+        self.assertEqual(json.loads(encoded)['data'][1]['y'], [1.0, None])
+
+    def test_anomaly_markers(self) -> None:
+        """test points scored beyond the threshold are marked"""
+        series = Timeseries(name='up', values={0: 1.0, 3600: 9.0, 7200: 1.0})
+        scores = Timeseries(
+            name='up_anomaly_score',
+            values={0: 0.5, 3600: 4.0, 7200: -3.5},
+        )
+        anomalies = flag_anomalies(series=series, scores=scores, threshold=3)
+        self.assertEqual(anomalies.get_raw_vals(), {3600: 9.0, 7200: 1.0})
+        figure = gen_forecast_graph_figure(
+            series=[series],
+            report=Report(
+                forecasts=[Timeseries(name='up_forecast', values={0: 1.0})],
+                anomaly_scores={'up': scores},
+            ),
+            anomaly_threshold=3.8,
+        )
+        markers = figure['data'][-1]
+        self.assertEqual(markers['name'], 'up anomalies')
+        self.assertEqual(markers['mode'], 'markers')
+        self.assertEqual(markers['x'], [3600000])
+        self.assertEqual(markers['y'], [9.0])
+
+    def test_report_key(self) -> None:
+        """test reports are keyed by series data and parameters"""
+        series = [Timeseries(name='up', values={0: 1.0, 3600: 2.0})]
+        key = gen_report_key(series=series, forecast_days=7)
+        same = [Timeseries(name='up', values={0: 1.0, 3600: 2.0})]
+        self.assertEqual(key, gen_report_key(series=same, forecast_days=7))
+        self.assertNotEqual(key, gen_report_key(series=same, forecast_days=8))
+        other = [Timeseries(name='up', values={0: 1.0, 3600: 3.0})]
+        self.assertNotEqual(key, gen_report_key(series=other, forecast_days=7))
@@ -0,0 +1,212 @@
+import asyncio
+import time
+import unittest
+from typing import Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+from metrics.common import (
+    CachedQuery,
+    MultiQuery,
+    Query,
+    QueryExecError,
+    SeriesCap,
+    SeriesRank,
+    Timeseries,
+    gen_other_series,
+    sum_series,
+)
+from utils.cache import MemoryCache
+
+
+class SleepQuery(Query):
+    """Query returning series named names after sleeping"""
+
+    def __init__(
+        self,
+        names: Iterable[str],
+        delay: float,
+        capped: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        self._names = names
+        self._delay = delay
+        self._capped = capped
+
+    def get_capped(self) -> Optional[Tuple[int, int]]:
+        return self._capped
+
+    async def fetch_result(self) -> Optional[Iterable[Timeseries]]:
+        await asyncio.sleep(self._delay)
+        if not self._names:
+            raise QueryExecError('test', 'sleep', 'No results returned')
+        return [
+            Timeseries(name=name, values={1595823193: 1.0})
+            for name in self._names
+        ]
+
+
+class MultiQueryTest(unittest.TestCase):
+
+    def test_concurrent_fetch(self) -> None:
+        """test queries are fetched concurrently"""
+        query = MultiQuery(
+            queries=[
+                SleepQuery(names=['cpu'], delay=0.1),
+                SleepQuery(names=['mem', 'disk'], delay=0.1),
+                SleepQuery(names=['net'], delay=0.1),
+            ],
+            labels=['a', 'b', 'c'],
+        )
+        start = time.perf_counter()
+        series = query.execute_sync()
+        self.assertLess(time.perf_counter() - start, 0.25)
+        self.assertEqual(
+            [s.get_name() for s in series],
+            ['cpu', 'mem', 'disk', 'net'],
+        )
+
+    def test_same_names(self) -> None:
+        """test series of the same name are told apart by query label"""
+        query = MultiQuery(
+            queries=[
+                SleepQuery(names=['up', 'cpu'], delay=0.0),
+                SleepQuery(names=['up'], delay=0.0),
+            ],
+            labels=['prom-1: up', 'prom-2: up'],
+        )
+        self.assertEqual(
+            [s.get_name() for s in query.execute_sync()],
+            ['up [prom-1: up]', 'cpu', 'up [prom-2: up]'],
+        )
+
+    def test_failed_query(self) -> None:
+        """test a failed query fails the analysis"""
+        query = MultiQuery(
+            queries=[
+                SleepQuery(names=['cpu'], delay=0.0),
+                SleepQuery(names=[], delay=0.0),
+            ],
+            labels=['a', 'b'],
+        )
+        with self.assertRaises(QueryExecError):
+            query.execute_sync()
+
+    def test_capped_queries(self) -> None:
+        """test capped queries are reported by label"""
+        query = MultiQuery(
+            queries=[
+                SleepQuery(names=['cpu'], delay=0.0, capped=(1, 10)),
+                SleepQuery(names=['mem'], delay=0.0),
+                SleepQuery(names=['net'], delay=0.0, capped=(1, 5)),
+            ],
+            labels=['a', 'b', 'c'],
+        )
+        query.execute_sync()
+        self.assertEqual(
+            query.get_capped_queries(),
+            {'a': (1, 10), 'c': (1, 5)},
+        )
+        self.assertEqual(query.get_capped(), (2, 15))
+
+
+class CachedQueryTest(unittest.TestCase):
+
+    def test_cached_fetch(self) -> None:
+        """test results are fetched once and then served from cache"""
+        cache = MemoryCache(name='test_queries', max_bytes=1 << 20)
+        query = CachedQuery(
+            query=SleepQuery(names=['cpu'], delay=0.1, capped=(1, 3)),
+            cache=cache,
+            key='cpu',
+            ttl=60,
+        )
+        self.assertEqual(query.execute_sync()[0].get_name(), 'cpu')
+        again = CachedQuery(
+            query=SleepQuery(names=[], delay=1.0),
+            cache=cache,
+            key='cpu',
+            ttl=60,
+        )
+        start = time.perf_counter()
+        series = again.execute_sync()
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(series[0].get_name(), 'cpu')
+        self.assertEqual(series[0].get_values().tolist(), [1.0])
+        self.assertEqual(again.get_capped(), (1, 3))
+
+
+class TimeseriesTest(unittest.TestCase):
+
+    def test_columns(self) -> None:
+        """test dictionary and columns are views of the same points"""
+        series = Timeseries.from_arrays(
+            name='cpu',
+            timestamps=np.array([0, 3600, 7200]),
+            values=np.array([1.0, np.nan, 3.0]),
+        )
+        self.assertEqual(series.get_length(), 2)
+        self.assertEqual(series.get_raw_vals(), {0: 1.0, 7200: 3.0})
+        series = Timeseries(name='cpu', values={0: 1.0, 3600: 2.0})
+        self.assertEqual(series.get_timestamps().tolist(), [0, 3600])
+        self.assertEqual(series.get_values().tolist(), [1.0, 2.0])
+        self.assertEqual(Timeseries(name='empty').get_length(), 0)
+        self.assertIsNone(Timeseries(name='empty').get_dataframe())
+
+    def test_bytes_round_trip(self) -> None:
+        """test timeseries are decoded as encoded"""
+        series = Timeseries.from_bytes(Timeseries(
+            name='cpu',
+            values={0: 1.0, 3600: 2.5},
+            labels={'job': 'api'},
+        ).to_bytes())
+        self.assertEqual(series.get_name(), 'cpu')
+        self.assertEqual(series.get_labels(), {'job': 'api'})
+        self.assertEqual(series.get_raw_vals(), {0: 1.0, 3600: 2.5})
+
+    def test_from_df(self) -> None:
+        """test dataframes are converted without being modified"""
+        df = pd.DataFrame({
+            'ds': pd.to_datetime([0, 3600], unit='s'),
+            'yhat': [1, 2],
+        })
+        series = Timeseries.from_df(name='cpu', df=df, val_col='yhat')
+        self.assertEqual(list(df.columns), ['ds', 'yhat'])
+        self.assertEqual(series.get_raw_vals(), {0: 1.0, 3600: 2.0})
+        frame = series.get_dataframe()
+        self.assertTrue(frame['ds'].equals(df['ds']))
+        self.assertEqual(frame['y'].tolist(), [1.0, 2.0])
+
+    def test_sum_series(self) -> None:
+        """test series are summed by timestamp and others subtracted"""
+        series = [
+            Timeseries(name='a', values={3600: 1.0, 0: 2.0}),
+            Timeseries(name='b', values={0: 3.0, 7200: 4.0}),
+        ]
+        total = sum_series(name='sum', series=series)
+        self.assertEqual(total.get_raw_vals(), {0: 5.0, 3600: 1.0, 7200: 4.0})
+        others = gen_other_series(total=total, kept=series[:1])
+        self.assertEqual(others.get_raw_vals(), {0: 3.0, 3600: 0.0, 7200: 4.0})
+        self.assertEqual(sum_series(name='sum', series=[]).get_length(), 0)
+
+
+class SeriesCapTest(unittest.TestCase):
+
+    def test_apply(self) -> None:
+        """test series ranked first by average are kept in order"""
+        series = [
+            Timeseries(name='low', values={1: 1.0, 2: 1.0}),
+            Timeseries(name='empty', values={}),
+            Timeseries(name='high', values={1: 9.0, 2: 7.0}),
+            Timeseries(name='mid', values={1: 5.0}),
+        ]
+        names = [
+            s.get_name() for s in SeriesCap(limit=2).apply(series=series)
+        ]
+        self.assertEqual(names, ['high', 'mid'])
+        cap = SeriesCap(limit=2, rank=SeriesRank.BOTTOM)
+        names = [s.get_name() for s in cap.apply(series=series)]
+        self.assertEqual(names, ['low', 'mid'])
+        self.assertEqual(len(SeriesCap(limit=0).apply(series=series)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from metrics.common import QueryExecError
+from metrics.file import FileQuery
+
+# unix timestamp of the first row of test files
+START = 1595808000
+# seconds between rows of test files
+STEP = 3600
+
+
+class FileQueryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.source = tempfile.mkdtemp(prefix='capmon-file-test-')
+        self.addCleanup(shutil.rmtree, self.source)
+
+    def gen_wide_table(self, hours: int, offset: int = 0) -> pa.Table:
+        """helper method to generate wide table with a column per series"""
+        timestamps = START + STEP * np.arange(offset, offset + hours)
+        return pa.table({
+            'timestamp': pa.array(timestamps * 1000, pa.timestamp('ms')),
+            'cpu_user': np.arange(offset, offset + hours, dtype=float),
+            'cpu_system': np.ones(hours),
+            'mem_used': np.full(hours, 2.0),
+        })
+
+    def gen_long_table(self, hours: int) -> pa.Table:
+        """helper method to generate long table with name/value rows"""
+        timestamps = START + STEP * np.arange(hours)
+        return pa.table({
+            'timestamp': np.concatenate([timestamps, timestamps]),
+            'name': ['a'] * hours + ['b'] * hours,
+            'value': np.concatenate([np.zeros(hours), np.ones(hours)]),
+        })
+
+    def get_path(self, name: str) -> str:
+        """helper method to get path of a file in source"""
+        return os.path.join(self.source, name)
+
+    def run_query(self, query: str, **kwargs) -> dict:
+        """helper method to run query and get raw values by name"""
+        series = FileQuery(
+            query=query,
+            source=self.source,
+            **kwargs,
+        ).execute_sync()
+        return {s.get_name(): s.get_raw_vals() for s in series}
+
+    def test_parquet_select_columns(self) -> None:
+        """test columns are selected by name and glob"""
+        pq.write_table(self.gen_wide_table(48), self.get_path('a.parquet'))
+        result = self.run_query('cpu_*', lookback_days=7)
+        self.assertEqual(sorted(result), ['cpu_system', 'cpu_user'])
+        self.assertEqual(len(result['cpu_user']), 48)
+        self.assertEqual(result['cpu_user'][START + STEP], 1.0)
+
+    def test_lookback_from_latest(self) -> None:
+        """test lookback is counted back from the latest point"""
+        pq.write_table(
+            self.gen_wide_table(24 * 10),
+            self.get_path('a.parquet'),
+            row_group_size=24,
+        )
+        result = self.run_query('mem_used', lookback_days=2)
+        timestamps = sorted(result['mem_used'])
+        self.assertEqual(len(timestamps), 49)
+        self.assertEqual(timestamps[-1], START + STEP * (24 * 10 - 1))
+
+    def test_time_range(self) -> None:
+        """test explicit unix and iso time ranges"""
+        pq.write_table(self.gen_wide_table(48), self.get_path('a.parquet'))
+        result = self.run_query(f'cpu_user @ {START}..{START + 3 * STEP}')
+        self.assertEqual(len(result['cpu_user']), 4)
+        result = self.run_query('cpu_user @ 2020-07-28..')
+        self.assertEqual(min(result['cpu_user']), 1595894400)
+
+    def test_row_group_pruning(self) -> None:
+        """test row groups outside of time range are skipped"""
+        pq.write_table(
+            self.gen_wide_table(24 * 4),
+            self.get_path('a.parquet'),
+            row_group_size=24,
+        )
+        query = FileQuery(query='cpu_user', source=self.source)
+        parquet_file = pq.ParquetFile(self.get_path('a.parquet'))
+        groups = query._prune_row_groups(
+            parquet_file=parquet_file,
+            start=START + STEP * 30,
+            end=START + STEP * 50,
+        )
+        self.assertEqual(groups, [1, 2])
+
+    def test_arrow_ipc_and_csv(self) -> None:
+        """test wide arrow ipc and csv files across several files"""
+        table = self.gen_wide_table(24, offset=24)
+        with pa.OSFile(self.get_path('b.arrow'), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=6)
+        csv_table = self.gen_wide_table(24).set_column(
+            0,
+            'timestamp',
+            pa.array(START + STEP * np.arange(24)),
+        )
+        pa_csv.write_csv(csv_table, self.get_path('a.csv'))
+        result = self.run_query('cpu_user')
+        timestamps = list(result['cpu_user'])
+        self.assertEqual(len(timestamps), 48)
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_long_format(self) -> None:
+        """test series are selected by name from long files"""
+        pq.write_table(self.gen_long_table(24), self.get_path('a.parquet'))
+        result = self.run_query('b')
+        self.assertEqual(list(result), ['b'])
+        self.assertEqual(set(result['b'].values()), {1.0})
+
+    def test_long_format_integer_names(self) -> None:
+        """test series of integer name columns are selected"""
+        table = self.gen_long_table(24)
+        table = table.set_column(
+            1,
+            'name',
+            pa.array([7] * 24 + [8] * 24),
+        )
+        pq.write_table(table, self.get_path('a.parquet'))
+        result = self.run_query('8')
+        self.assertEqual(list(result), ['8'])
+        self.assertEqual(set(result['8'].values()), {1.0})
+
+    def test_non_numeric_columns(self) -> None:
+        """test columns that are not numeric are skipped or raise"""
+        table = self.gen_wide_table(24).append_column(
+            'host',
+            pa.array(['a'] * 24),
+        )
+        pq.write_table(table, self.get_path('a.parquet'))
+        result = self.run_query('*')
+        self.assertEqual(
+            sorted(result),
+            ['cpu_system', 'cpu_user', 'mem_used'],
+        )
+        with self.assertRaises(QueryExecError):
+            self.run_query('host')
+        table = self.gen_long_table(24)
+        table = table.set_column(
+            2,
+            'value',
+            pa.array(['x'] * table.num_rows),
+        )
+        pq.write_table(table, self.get_path('b.parquet'))
+        with self.assertRaises(QueryExecError):
+            self.run_query('b')
+
+    def test_errors(self) -> None:
+        """test unmatched and malformed queries raise"""
+        with self.assertRaises(QueryExecError):
+            self.run_query('cpu_user')
+        pq.write_table(self.gen_wide_table(24), self.get_path('a.parquet'))
+        for query in ('missing', 'cpu_user @ yesterday..', 'cpu @ 1', ' '):
+            with self.assertRaises(QueryExecError):
+                self.run_query(query)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
 import unittest
+import pickle
+import msgpack
 from typing import Optional, Iterable, Dict, Tuple
 from urllib.parse import parse_qs
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 from aiohttp import web
-from metrics.common import QueryExecError, Timeseries
+from metrics.common import QueryExecError, SeriesCap, Timeseries
 from metrics.graphite import GraphiteQuery
+from utils.clients import ResponseFormat
 
 
 class GraphiteQueryTest(AioHTTPTestCase):
@@ -75,6 +78,49 @@ class GraphiteQueryTest(AioHTTPTestCase):
             }
         ]
 
+    def gen_info_response_with_single(self) -> dict:
+        """
+        helper method to return graphite msgpack/pickle query with
+        single metric response
+        """
+        return [
+            {
+                'name': 'summarize(example_metric_a, "1h", "sum")',
+                'pathExpression': 'example_metric_a',
+                'tags': {'name': 'example_metric_a', 'summarize': '1h'},
+                'start': 1595823013,
+                'end': 1595823313,
+                'step': 60,
+                'values': [6.0, 7.0, 9.0, 10.0, None],
+            }
+        ]
+
+    def gen_info_response_with_multi(self) -> dict:
+        """
+        helper method to return graphite msgpack/pickle query with
+        multi metric response
+        """
+        return [
+            {
+                # older graphite versions do not send tags
+                'name': 'summarize(example_metric_a, "1h", "sum")',
+                'pathExpression': 'example_metric_*',
+                'start': 1595823013,
+                'end': 1595823313,
+                'step': 60,
+                'values': [3.0, 4.0, 6.0, 11.0, None],
+            },
+            {
+                # older graphite versions do not send tags
+                'name': 'summarize(example_metric_b, "1h", "sum")',
+                'pathExpression': 'example_metric_*',
+                'start': 1595823013,
+                'end': 1595823313,
+                'step': 60,
+                'values': [3.5, 4.5, 6.5, 11.5, None],
+            }
+        ]
+
     def verify_series(
         self,
         ts: Optional[Timeseries],
@@ -177,12 +223,43 @@ class GraphiteQueryTest(AioHTTPTestCase):
             'summarize(empty.res,"1h")',
             'summarize(single.data,"1h")',
             'summarize(multi.data,"1h")',
+            'summarize(single.msgpack,"1h")',
+            'summarize(multi.pickle,"1h")',
+            'summarize(highestAverage(multi.data,2),"1h")',
+            'summarize(countSeries(multi.data),"1h","max")',
+            'summarize(sumSeries(multi.data),"1h")',
         ]
         # setup query to response mapping
         query_to_res = {
             'summarize(empty.res,"1h")': self.gen_response_with_empty(),
             'summarize(single.data,"1h")': self.gen_response_with_single(),
             'summarize(multi.data,"1h")': self.gen_response_with_multi(),
+            'summarize(single.msgpack,"1h")': msgpack.packb(
+                self.gen_info_response_with_single(),
+                use_bin_type=True,
+            ),
+            'summarize(multi.pickle,"1h")': pickle.dumps(
+                self.gen_info_response_with_multi(),
+                protocol=-1,
+            ),
+            'summarize(highestAverage(multi.data,2),"1h")': (
+                self.gen_response_with_multi()
+            ),
+            'summarize(countSeries(multi.data),"1h","max")': [{
+                'target': 'countSeries(multi.data)',
+                'tags': {'name': 'countSeries(multi.data)'},
+                'datapoints': [[2.0, 1595823013], [2.0, 1595823073]],
+            }],
+            'summarize(sumSeries(multi.data),"1h")': [{
+                'target': 'sumSeries(multi.data)',
+                'tags': {'name': 'sumSeries(multi.data)'},
+                'datapoints': [
+                    [6.5, 1595823013],
+                    [8.5, 1595823073],
+                    [12.5, 1595823133],
+                    [22.5, 1595823193],
+                ],
+            }],
         }
         # setup query to expected params mapping
         query_to_params = {
@@ -201,7 +278,19 @@ class GraphiteQueryTest(AioHTTPTestCase):
                 'format': 'json',
                 'from': '-5d',
             },
+            'summarize(single.msgpack,"1h")': {
+                'target': 'summarize(single.msgpack,"1h")',
+                'format': 'msgpack',
+                'from': '-5d',
+            },
+            'summarize(multi.pickle,"1h")': {
+                'target': 'summarize(multi.pickle,"1h")',
+                'format': 'pickle',
+                'from': '-5d',
+            },
         }
+        for query in queries:
+            query_to_params.setdefault(query, {'format': 'json'})
 
         async def handle_range_request(request: web.Request) -> web.Response:
             # test server range query request handler
@@ -223,6 +312,8 @@ class GraphiteQueryTest(AioHTTPTestCase):
                     query_to_params[query][key]
                 )
             # return listed query response
+            if query_to_params[query]['format'] != 'json':
+                return web.Response(body=query_to_res[query])
             return web.json_response(data=query_to_res[query])
 
         # setup test server
@@ -255,6 +346,20 @@ class GraphiteQueryTest(AioHTTPTestCase):
                 lookback_days=5,
                 step='1h'
             ),
+            'single.msgpack': GraphiteQuery(
+                query='single.msgpack',
+                source=src,
+                lookback_days=5,
+                step='1h',
+                render_format=ResponseFormat.MSGPACK,
+            ),
+            'multi.pickle': GraphiteQuery(
+                query='multi.pickle',
+                source=src,
+                lookback_days=5,
+                step='1h',
+                render_format=ResponseFormat.PICKLE,
+            ),
         }
         return instances.get(query, None)
 
@@ -274,6 +379,27 @@ class GraphiteQueryTest(AioHTTPTestCase):
         res = await query.execute()
         self.verify_multi_metric_matches(res)
 
+    @unittest_run_loop
+    async def test_query_single_metric_msgpack(self) -> None:
+        """test get result with single metric msgpack result"""
+        query = self.get_query_for_query('single.msgpack')
+        self.assertIsNotNone(query)
+        res = await query.execute()
+        self.verify_single_metric_matches(res)
+        # series are named and labeled by tags like in json responses
+        self.assertEqual(res[0].get_labels(), {
+            'name': 'example_metric_a',
+            'summarize': '1h',
+        })
+
+    @unittest_run_loop
+    async def test_query_multi_metric_pickle(self) -> None:
+        """test get result with multiple metric pickle result"""
+        query = self.get_query_for_query('multi.pickle')
+        self.assertIsNotNone(query)
+        res = await query.execute()
+        self.verify_multi_metric_matches(res)
+
     @unittest_run_loop
     async def test_query_empty_result(self) -> None:
         """test get result with empty result"""
@@ -282,6 +408,27 @@ class GraphiteQueryTest(AioHTTPTestCase):
         with self.assertRaises(QueryExecError):
             await query.execute()
 
+    @unittest_run_loop
+    async def test_query_capped(self) -> None:
+        """test series caps are pushed down with highestAverage"""
+        query = GraphiteQuery(
+            query='multi.data',
+            source=self.get_source_url(),
+            lookback_days=5,
+            series_cap=SeriesCap(limit=1, other=True),
+        )
+        res = await query.execute()
+        self.assertEqual(
+            [ts.get_name() for ts in res],
+            ['example_metric_b', 'other'],
+        )
+        # other is the sum of all series less the series kept
+        self.assertEqual(
+            list(res[1].get_raw_vals().values()),
+            [3.0, 4.0, 6.0, 11.0],
+        )
+        self.assertEqual(query.get_capped(), (1, 2))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,30 @@
 import unittest
 import mock
+import numpy as np
+import snappy
 from typing import Optional, Iterable, Dict, Tuple
 from urllib.parse import parse_qs
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 from aiohttp import web
-from metrics.common import QueryExecError, Timeseries
-from metrics.prometheus import PrometheusQuery
+from metrics.common import (
+    QueryExecError,
+    SeriesCap,
+    SeriesRank,
+    Timeseries,
+)
+from metrics.prometheus import (
+    PrometheusQuery,
+    evaluate_at_steps,
+    gen_rank_query,
+    parse_duration,
+    parse_selector,
+)
+from metrics.prompb import (
+    decode_message,
+    decode_read_response,
+    get_message_class,
+)
+from utils.clients import ResponseFormat
 
 
 class PrometheusQueryTest(AioHTTPTestCase):
@@ -112,6 +131,66 @@ class PrometheusQueryTest(AioHTTPTestCase):
             }
         }
 
+    def gen_rank_query(self, query: str, limit: int) -> str:
+        """helper method to get query of top series over 5 days"""
+        return gen_rank_query(
+            query=query,
+            rank=SeriesRank.TOP,
+            limit=limit,
+            start=1595391193,
+            end=1595823193,
+            step='1h',
+        )
+
+    def gen_prom_range_response_with_labels(
+        self,
+        series: Iterable[Tuple[Dict[str, str], Iterable[float]]],
+    ) -> dict:
+        """
+        helper method to return prometheus range query response with
+        series of given labels and values
+        """
+        timestamps = [1595823013.0, 1595823073.0, 1595823133.0, 1595823193.0]
+        return {
+            'status': 'success',
+            'data': {
+                'resultType': 'matrix',
+                'result': [
+                    {
+                        'metric': labels,
+                        'values': [
+                            [ts, str(val)] for ts, val in zip(timestamps, vals)
+                        ],
+                    }
+                    for labels, vals in series
+                ]
+            }
+        }
+
+    def gen_prom_read_response(self) -> bytes:
+        """
+        helper method to return prometheus remote read response with
+        raw samples of series
+        """
+        response = get_message_class('ReadResponse')()
+        result = response.results.add()
+        samples = {
+            'example_metric_a': [
+                (1595819500000, 1.0),
+                (1595819593000, 2.0),
+                (1595823100000, 3.0),
+            ],
+            'example_metric_b': [(1595815900000, 5.0)],
+            'example_metric_c': [(1595000000000, 1.0)],
+        }
+        for name, values in samples.items():
+            series = result.timeseries.add()
+            series.labels.add(name='__name__', value=name)
+            series.labels.add(name='job', value='mock_prometheus_server')
+            for timestamp, value in values:
+                series.samples.add(timestamp=timestamp, value=value)
+        return snappy.compress(response.SerializeToString())
+
     def verify_series(
         self,
         ts: Optional[Timeseries],
@@ -215,7 +294,16 @@ class PrometheusQueryTest(AioHTTPTestCase):
             'error_res',
             'empty_data',
             'single_data',
-            'multi_data'
+            'multi_data',
+            'sum(single_data)',
+            self.gen_rank_query('multi_data', 2),
+            self.gen_rank_query('multi_data', 3),
+            'count(multi_data)',
+            'sum(multi_data)',
+            'labeled_data',
+            self.gen_rank_query('swap_data', 2),
+            'count(swap_data)',
+            'sum(swap_data)',
         ]
         # setup query to response mapping
         query_to_res = {
@@ -224,6 +312,38 @@ class PrometheusQueryTest(AioHTTPTestCase):
             'empty_data': self.gen_prom_range_response_with_nodata(),
             'single_data': self.gen_prom_range_response_with_single(),
             'multi_data': self.gen_prom_range_response_with_multi(),
+            'sum(single_data)': self.gen_prom_range_response_with_single(),
+            self.gen_rank_query('multi_data', 2): (
+                self.gen_prom_range_response_with_multi()
+            ),
+            self.gen_rank_query('multi_data', 3): (
+                self.gen_prom_range_response_with_multi()
+            ),
+            'count(multi_data)': self.gen_prom_range_response_with_labels([
+                ({}, [2, 2, 2, 2]),
+            ]),
+            'sum(multi_data)': self.gen_prom_range_response_with_labels([
+                ({}, [6.5, 8.5, 12.5, 22.5]),
+            ]),
+            'labeled_data': self.gen_prom_range_response_with_labels([
+                ({'__name__': 'up', 'job': 'a'}, [1, 1, 1, 1]),
+                ({'__name__': 'up', 'job': 'b'}, [0, 0, 0, 0]),
+                ({'job': 'a'}, [2, 2, 2, 2]),
+            ]),
+            # a and b swap ranks half way through the range, so a
+            # per step topk would return each with gaps
+            self.gen_rank_query('swap_data', 2): (
+                self.gen_prom_range_response_with_labels([
+                    ({'__name__': 'swap', 'job': 'a'}, [9, 9, 1, 1]),
+                    ({'__name__': 'swap', 'job': 'b'}, [1, 1, 8, 8]),
+                ])
+            ),
+            'count(swap_data)': self.gen_prom_range_response_with_labels([
+                ({}, [3, 3, 3, 3]),
+            ]),
+            'sum(swap_data)': self.gen_prom_range_response_with_labels([
+                ({}, [12, 12, 11, 11]),
+            ]),
         }
         # setup query to expected params mapping
         query_to_params = {
@@ -257,7 +377,15 @@ class PrometheusQueryTest(AioHTTPTestCase):
                 'step': '1h',
                 'query': 'multi_data'
             },
+            'sum(single_data)': {
+                'start': '1595391193',
+                'end': '1595823193',
+                'step': '1h',
+                'query': 'sum(single_data)'
+            },
         }
+        for query in queries:
+            query_to_params.setdefault(query, {'query': query})
 
         async def handle_range_request(request: web.Request) -> web.Response:
             # test server range query request handler
@@ -281,10 +409,35 @@ class PrometheusQueryTest(AioHTTPTestCase):
             # return listed query response
             return web.json_response(data=query_to_res[query])
 
+        async def handle_read_request(request: web.Request) -> web.Response:
+            # test server remote read request handler
+            self.assertEqual(
+                request.headers['Content-Type'],
+                'application/x-protobuf',
+            )
+            body = snappy.uncompress(await request.read())
+            read_request = decode_message(name='ReadRequest', body=body)
+            query = read_request.queries[0]
+            matchers = [
+                (m.type, m.name, m.value) for m in query.matchers
+            ]
+            if matchers == [(0, '__name__', 'bad_read')]:
+                return web.Response(body=snappy.compress(b'\xff\xff'))
+            # verify lookback delta is read ahead of the range
+            self.assertEqual(query.start_timestamp_ms, 1595390893000)
+            self.assertEqual(query.end_timestamp_ms, 1595823193000)
+            self.assertEqual(query.hints.step_ms, 3600000)
+            self.assertEqual(matchers, [
+                (2, '__name__', 'example_metric_.*'),
+                (1, 'job', 'other'),
+            ])
+            return web.Response(body=self.gen_prom_read_response())
+
         # setup test server
         app = web.Application()
         # setup paths
         app.router.add_get('/api/v1/query_range', handle_range_request)
+        app.router.add_post('/api/v1/read', handle_read_request)
         return app
 
     def get_prom_query_for_query(self, query: str) -> PrometheusQuery:
@@ -371,6 +524,220 @@ class PrometheusQueryTest(AioHTTPTestCase):
         with self.assertRaises(QueryExecError):
             await query.execute()
 
+    @mock.patch('time.time', mock.MagicMock(return_value=1595823193))
+    @unittest_run_loop
+    async def test_remote_read(self) -> None:
+        """test remote read samples are evaluated at each step"""
+        query = PrometheusQuery(
+            query='{__name__=~"example_metric_.*", job!="other"}',
+            source=self.get_source_url(),
+            lookback_days=5,
+            step='1h',
+            response_format=ResponseFormat.PROTOBUF,
+        )
+        res = await query.execute()
+        vals = {ts.get_name(): ts.get_raw_vals() for ts in res}
+        self.assertEqual(vals['example_metric_a'], {
+            1595819593: 2.0,
+            1595823193: 3.0,
+        })
+        self.assertEqual(vals['example_metric_b'], {1595815993: 5.0})
+        # series without samples at any step are dropped like range queries
+        self.assertNotIn('example_metric_c', vals)
+
+    @mock.patch('time.time', mock.MagicMock(return_value=1595823193))
+    @unittest_run_loop
+    async def test_remote_read_capped(self) -> None:
+        """test remote reads are capped after decoding"""
+        query = PrometheusQuery(
+            query='{__name__=~"example_metric_.*", job!="other"}',
+            source=self.get_source_url(),
+            lookback_days=5,
+            step='1h',
+            response_format=ResponseFormat.PROTOBUF,
+            series_cap=SeriesCap(limit=1, other=True),
+        )
+        res = await query.execute()
+        self.assertEqual(
+            [ts.get_name() for ts in res],
+            ['example_metric_b', 'other'],
+        )
+        self.assertEqual(res[1].get_raw_vals(), {
+            1595815993: 0.0,
+            1595819593: 2.0,
+            1595823193: 3.0,
+        })
+        self.assertEqual(query.get_capped(), (1, 2))
+
+    @mock.patch('time.time', mock.MagicMock(return_value=1595823193))
+    @unittest_run_loop
+    async def test_query_capped(self) -> None:
+        """test series caps are pushed down with topk"""
+        query = PrometheusQuery(
+            query='multi_data',
+            source=self.get_source_url(),
+            lookback_days=5,
+            series_cap=SeriesCap(limit=1, other=True),
+        )
+        res = await query.execute()
+        self.assertEqual(
+            [ts.get_name() for ts in res],
+            ['example_metric_b', 'other'],
+        )
+        # other is the sum of all series less the series kept
+        self.assertEqual(
+            list(res[1].get_raw_vals().values()),
+            [3.0, 4.0, 6.0, 11.0],
+        )
+        self.assertEqual(query.get_capped(), (1, 2))
+        # series are only counted when more than the limit matched
+        query = PrometheusQuery(
+            query='multi_data',
+            source=self.get_source_url(),
+            lookback_days=5,
+            series_cap=SeriesCap(limit=2),
+        )
+        self.verify_multi_metric_matches(await query.execute())
+        self.assertIsNone(query.get_capped())
+
+    @mock.patch('time.time', mock.MagicMock(return_value=1595823193))
+    @unittest_run_loop
+    async def test_query_capped_rank_swap(self) -> None:
+        """test capped series are ranked over the whole range"""
+        query = PrometheusQuery(
+            query='swap_data',
+            source=self.get_source_url(),
+            lookback_days=5,
+            series_cap=SeriesCap(limit=1, other=True),
+        )
+        res = await query.execute()
+        self.assertEqual([ts.get_name() for ts in res], [
+            'swap{job="a"}',
+            'other',
+        ])
+        # kept series have their whole history
+        self.assertEqual(list(res[0].get_raw_vals().values()), [9, 9, 1, 1])
+        self.assertEqual(
+            list(res[1].get_raw_vals().values()),
+            [3.0, 3.0, 10.0, 10.0],
+        )
+        self.assertEqual(query.get_capped(), (1, 3))
+
+    @mock.patch('time.time', mock.MagicMock(return_value=1595823193))
+    @unittest_run_loop
+    async def test_query_series_names(self) -> None:
+        """test series sharing a metric name or without one are kept"""
+        query = PrometheusQuery(
+            query='labeled_data',
+            source=self.get_source_url(),
+            lookback_days=5,
+        )
+        res = await query.execute()
+        self.assertEqual([ts.get_name() for ts in res], [
+            'up{job="a"}',
+            'up{job="b"}',
+            '{job="a"}',
+        ])
+        self.assertEqual(res[1].get_labels(), {'__name__': 'up', 'job': 'b'})
+
+    @mock.patch('time.time', mock.MagicMock(return_value=1595823193))
+    @unittest_run_loop
+    async def test_remote_read_fallback(self) -> None:
+        """test queries which are not selectors use range queries"""
+        query = PrometheusQuery(
+            query='sum(single_data)',
+            source=self.get_source_url(),
+            lookback_days=5,
+            step='1h',
+            response_format=ResponseFormat.PROTOBUF,
+        )
+        res = await query.execute()
+        self.verify_single_metric_matches(res)
+
+    @mock.patch('time.time', mock.MagicMock(return_value=1595823193))
+    @unittest_run_loop
+    async def test_remote_read_bad_response(self) -> None:
+        """test undecodable remote read response raises"""
+        query = PrometheusQuery(
+            query='bad_read',
+            source=self.get_source_url(),
+            lookback_days=5,
+            response_format=ResponseFormat.PROTOBUF,
+        )
+        with self.assertRaises(QueryExecError):
+            await query.execute()
+
+
+class PrometheusHelpersTest(unittest.TestCase):
+
+    def test_parse_duration(self) -> None:
+        """test prometheus durations are parsed to seconds"""
+        self.assertEqual(parse_duration('1h'), 3600.0)
+        self.assertEqual(parse_duration('1h30m'), 5400.0)
+        self.assertEqual(parse_duration('500ms'), 0.5)
+        self.assertEqual(parse_duration('90'), 90.0)
+        with self.assertRaises(ValueError):
+            parse_duration('1 hour')
+
+    def test_parse_selector(self) -> None:
+        """test plain selectors are parsed to matchers"""
+        self.assertEqual(parse_selector('up'), [('__name__', '=', 'up')])
+        self.assertEqual(
+            parse_selector('up{job="api", code=~"5.."}'),
+            [
+                ('__name__', '=', 'up'),
+                ('job', '=', 'api'),
+                ('code', '=~', '5..'),
+            ],
+        )
+        for query in ('rate(up[5m])', 'up + 1', 'sum(up)', 'up[5m]'):
+            self.assertIsNone(parse_selector(query))
+
+    def test_evaluate_at_steps(self) -> None:
+        """test latest sample within lookback is taken at each step"""
+        timestamps, values = evaluate_at_steps(
+            timestamps=np.array([0.0, 50.0, 1000.0]),
+            values=np.array([1.0, 2.0, 3.0]),
+            steps=np.array([-10.0, 60.0, 500.0, 1000.0]),
+        )
+        self.assertEqual(timestamps.tolist(), [60.0, 1000.0])
+        self.assertEqual(values.tolist(), [2.0, 3.0])
+
+    def test_decode_read_response(self) -> None:
+        """test samples are decoded as records or as messages"""
+        response = get_message_class('ReadResponse')()
+        result = response.results.add()
+        samples = {
+            # records of the same length
+            'a': [(1595819500000, 1.5), (1595819593000, float('nan'))],
+            # values of 0 and small timestamps change the record length
+            'b': [(1595819500000, 0.0), (1000, 2.0), (-5, 3.0)],
+            'c': [],
+        }
+        for name, values in samples.items():
+            series = result.timeseries.add()
+            series.labels.add(name='__name__', value=name)
+            for timestamp, value in values:
+                series.samples.add(timestamp=timestamp, value=value)
+        body = response.SerializeToString()
+        decoded = decode_read_response(body=body)
+        self.assertEqual(len(decoded), 3)
+        for (labels, timestamps, values), name in zip(decoded, samples):
+            self.assertEqual(labels, [('__name__', name)])
+            self.assertEqual(timestamps.dtype, np.int64)
+            expected = samples[name]
+            self.assertEqual(
+                timestamps.tolist(),
+                [timestamp for timestamp, _ in expected],
+            )
+            np.testing.assert_array_equal(
+                values,
+                [value for _, value in expected],
+            )
+        for bad in (b'\xff\xff', body[:-3]):
+            with self.assertRaises(ValueError):
+                decode_read_response(body=bad)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,198 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+from prometheus_client import REGISTRY
+from utils.cache import (
+    CacheBackend,
+    HTTPCache,
+    MemoryCache,
+    SQLiteCache,
+    create_cache,
+    gen_cache_key,
+)
+
+
+class CacheServiceHandler(BaseHTTPRequestHandler):
+    """handler of a cache service keeping entries in a dict"""
+
+    entries = {}
+
+    def do_GET(self) -> None:
+        if self.path.endswith('/short'):
+            # close the connection before the whole value is sent
+            self.send_response(200)
+            self.send_header('Content-Length', '10')
+            self.end_headers()
+            self.wfile.write(b'abc')
+            self.close_connection = True
+            return
+        value = self.entries.get(self.path)
+        if value is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(value)))
+        self.end_headers()
+        self.wfile.write(value)
+
+    def do_PUT(self) -> None:
+        length = int(self.headers['Content-Length'])
+        self.entries[self.path] = self.rfile.read(length)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class CacheTest(unittest.TestCase):
+
+    def get_value(self, name: str, cache: str) -> float:
+        """helper method to get current value of a cache metric"""
+        val = REGISTRY.get_sample_value(name, {'cache': cache})
+        return val if val is not None else 0.0
+
+    def test_memory_cache(self) -> None:
+        """test memory caches expire and evict least recently used"""
+        cache = MemoryCache(name='test_memory', max_bytes=10)
+        cache.set(key='a', value=b'aaaa', ttl=60)
+        cache.set(key='b', value=b'bbbb', ttl=60)
+        self.assertEqual(cache.get(key='a'), b'aaaa')
+        # b is least recently used
+        cache.set(key='c', value=b'cccc', ttl=60)
+        self.assertIsNone(cache.get(key='b'))
+        self.assertEqual(cache.get(key='a'), b'aaaa')
+        self.assertEqual(cache.get_size(), 8)
+        # too large values are not cached
+        cache.set(key='d', value=b'd' * 11, ttl=60)
+        self.assertIsNone(cache.get(key='d'))
+        cache.set(key='e', value=b'e', ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(key='e'))
+        self.assertEqual(
+            self.get_value('capmon_cache_evictions_total', 'test_memory'),
+            1,
+        )
+        self.assertEqual(
+            self.get_value('capmon_cache_hits_total', 'test_memory'),
+            2,
+        )
+        self.assertEqual(
+            self.get_value('capmon_cache_misses_total', 'test_memory'),
+            3,
+        )
+
+    def get_accessed(self, path: str, key: str) -> float:
+        """helper method to get recorded access of a sqlite entry"""
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute(
+                'SELECT accessed FROM cache_test_sqlite WHERE key = ?',
+                (key,),
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_sqlite_cache(self) -> None:
+        """test sqlite caches are shared and evict least recently used"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite')
+            cache = SQLiteCache(name='test_sqlite', max_bytes=10, path=path)
+            # another worker of the host
+            other = SQLiteCache(name='test_sqlite', max_bytes=10, path=path)
+            cache.set(key='a', value=b'aaaa', ttl=1)
+            self.assertEqual(other.get(key='a'), b'aaaa')
+            other.set(key='b', value=b'bbbb', ttl=60)
+            # hits soon after the last access do not record it
+            accessed = self.get_accessed(path=path, key='a')
+            self.assertEqual(cache.get(key='a'), b'aaaa')
+            self.assertEqual(self.get_accessed(path=path, key='a'), accessed)
+            time.sleep(0.15)
+            self.assertEqual(cache.get(key='a'), b'aaaa')
+            self.assertGreater(
+                self.get_accessed(path=path, key='a'),
+                accessed,
+            )
+            cache.set(key='c', value=b'cccc', ttl=60)
+            self.assertIsNone(other.get(key='b'))
+            self.assertEqual(other.get(key='c'), b'cccc')
+            cache.set(key='d', value=b'd', ttl=0.01)
+            time.sleep(0.02)
+            self.assertIsNone(other.get(key='d'))
+            self.assertEqual(
+                self.get_value('capmon_cache_evictions_total', 'test_sqlite'),
+                1,
+            )
+
+    def test_http_cache(self) -> None:
+        """test http caches store entries in the cache service"""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), CacheServiceHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/'
+            cache = HTTPCache(name='test_http', url=url)
+            self.assertIsNone(cache.get(key='a'))
+            cache.set(key='a', value=b'aaaa', ttl=60)
+            self.assertEqual(cache.get(key='a'), b'aaaa')
+            self.assertIn('/test_http/a', CacheServiceHandler.entries)
+            # incomplete responses are misses
+            before = self.get_value('capmon_cache_errors_total', 'test_http')
+            self.assertIsNone(cache.get(key='short'))
+            after = self.get_value('capmon_cache_errors_total', 'test_http')
+            self.assertEqual(after - before, 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+        # unreachable services are misses
+        before = self.get_value('capmon_cache_errors_total', 'test_http')
+        self.assertIsNone(cache.get(key='a'))
+        cache.set(key='a', value=b'aaaa', ttl=60)
+        after = self.get_value('capmon_cache_errors_total', 'test_http')
+        self.assertEqual(after - before, 2)
+
+    def test_create_cache(self) -> None:
+        """test caches are created for their backend"""
+        self.assertIsNone(create_cache(
+            backend=CacheBackend.NONE,
+            name='test_none',
+            max_bytes=1,
+        ))
+        self.assertIsInstance(
+            create_cache(
+                backend=CacheBackend.MEMORY,
+                name='test_create',
+                max_bytes=1,
+            ),
+            MemoryCache,
+        )
+        with self.assertRaises(ValueError):
+            create_cache(backend=CacheBackend.HTTP, name='test', max_bytes=1)
+        with self.assertRaises(ValueError):
+            MemoryCache(name='bad name', max_bytes=1)
+
+    def test_gen_cache_key(self) -> None:
+        """test keys digest parts"""
+        key = gen_cache_key(parts=['up', 7, np.array([1.0, 2.0])])
+        self.assertEqual(
+            key,
+            gen_cache_key(parts=['up', 7, np.array([1.0, 2.0])]),
+        )
+        self.assertNotEqual(
+            key,
+            gen_cache_key(parts=['up', 7, np.array([1.0, 2.5])]),
+        )
+        self.assertNotEqual(
+            gen_cache_key(parts=['ab', 'c']),
+            gen_cache_key(parts=['a', 'bc']),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
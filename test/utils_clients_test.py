@@ -1,17 +1,42 @@
+import asyncio
+import time
 import unittest
+import pickle
+import mock
+import msgpack
+import snappy
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 from aiohttp import web
-from utils.clients import AsyncRestClient, AsyncRestClientException
+from utils.clients import (
+    AsyncRestClient,
+    AsyncRestClientException,
+    CircuitBreaker,
+    ResponseFormat,
+)
+
+
+class UnsafePayload(object):
+    """object that should never be unpickled by the client"""
 
 
 class AsyncRestClientTest(AioHTTPTestCase):
 
-    def get_rest_client(self) -> AsyncRestClient:
+    def get_rest_client(self, **kwargs) -> AsyncRestClient:
         """method to get rest client"""
         url = f'http://{self.server.host}:{self.server.port}'
-        return AsyncRestClient(base_url=url)
+        return AsyncRestClient(base_url=url, **kwargs)
 
     async def get_application(self) -> web.Application:
+        # number of requests made to each path
+        self.calls = {}
+        # requests in flight to /getconcurrent and their peak
+        self.in_flight = [0, 0]
+
+        def count_call(request: web.Request) -> int:
+            # count request to path and return number of requests to it
+            self.calls[request.path] = self.calls.get(request.path, 0) + 1
+            return self.calls[request.path]
+
         """method to setup test server for testing rest client"""
         # setup test api calls
 
@@ -37,12 +62,76 @@ class AsyncRestClientTest(AioHTTPTestCase):
             self.assertEqual(request.method, 'GET')
             return web.Response(text='Hello World')
 
+        async def get_msgpack(request: web.Request) -> web.Response:
+            # test simple get with msgpack response
+            self.assertEqual(request.method, 'GET')
+            return web.Response(body=msgpack.packb({
+                'name': 'example',
+                'values': [1.0, None],
+            }))
+
+        async def get_pickle(request: web.Request) -> web.Response:
+            # test simple get with pickle response of plain types
+            self.assertEqual(request.method, 'GET')
+            return web.Response(body=pickle.dumps([{
+                'name': 'example',
+                'values': [1.0, None],
+            }]))
+
+        async def get_unsafe_pickle(request: web.Request) -> web.Response:
+            # test simple get with pickle response containing a class
+            self.assertEqual(request.method, 'GET')
+            return web.Response(body=pickle.dumps(UnsafePayload()))
+
+        async def post_snappy(request: web.Request) -> web.Response:
+            # test post echoing snappy compressed body
+            self.assertEqual(request.method, 'POST')
+            self.assertEqual(request.headers['Content-Encoding'], 'snappy')
+            body = snappy.uncompress(await request.read())
+            if body == b'bad':
+                return web.Response(body=b'not snappy')
+            return web.Response(body=snappy.compress(body[::-1]))
+
+        async def get_slow(request: web.Request) -> web.Response:
+            # test get with a response slower than read timeouts
+            count_call(request)
+            await asyncio.sleep(1.0)
+            return web.json_response(data={})
+
+        async def get_flaky(request: web.Request) -> web.Response:
+            # test get failing with 503 for the first two requests
+            if count_call(request) <= 2:
+                return web.Response(status=503)
+            return web.json_response(data={'name': 'example'})
+
+        async def down(request: web.Request) -> web.Response:
+            # test request to a datasource which is down
+            count_call(request)
+            return web.Response(status=503)
+
+        async def get_concurrent(request: web.Request) -> web.Response:
+            # test get tracking peak requests in flight
+            self.in_flight[0] += 1
+            self.in_flight[1] = max(self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight[0] -= 1
+            return web.json_response(data={})
+
         # setup test server
         app = web.Application()
         # setup paths
         app.router.add_get('/getjson', get_json)
         app.router.add_get('/getjsonparams', get_json_with_params)
         app.router.add_get('/gettext', get_text)
+        app.router.add_get('/getmsgpack', get_msgpack)
+        app.router.add_get('/getpickle', get_pickle)
+        app.router.add_get('/getunsafepickle', get_unsafe_pickle)
+        app.router.add_post('/postsnappy', post_snappy)
+        app.router.add_get('/getslow', get_slow)
+        app.router.add_get('/getflaky', get_flaky)
+        app.router.add_get('/down', down)
+        app.router.add_post('/down', down)
+        app.router.add_get('/getconcurrent', get_concurrent)
         return app
 
     @unittest_run_loop
@@ -73,6 +162,129 @@ class AsyncRestClientTest(AioHTTPTestCase):
         with self.assertRaises(AsyncRestClientException):
             await client.get('/gettext')
 
+    @unittest_run_loop
+    async def test_get_msgpack(self) -> None:
+        """test simple msgpack get request"""
+        client = self.get_rest_client()
+        res = await client.get(
+            uri='/getmsgpack',
+            response_format=ResponseFormat.MSGPACK,
+        )
+        self.assertEqual(res['name'], 'example')
+        self.assertEqual(res['values'], [1.0, None])
+
+    @unittest_run_loop
+    async def test_get_pickle(self) -> None:
+        """test simple pickle get request with plain types"""
+        client = self.get_rest_client()
+        res = await client.get(
+            uri='/getpickle',
+            response_format=ResponseFormat.PICKLE,
+        )
+        self.assertEqual(res[0]['name'], 'example')
+        self.assertEqual(res[0]['values'], [1.0, None])
+
+    @unittest_run_loop
+    async def test_get_unsafe_pickle(self) -> None:
+        """test pickle get request refuses to load classes"""
+        client = self.get_rest_client()
+        with self.assertRaises(AsyncRestClientException):
+            await client.get(
+                uri='/getunsafepickle',
+                response_format=ResponseFormat.PICKLE,
+            )
+
+    @unittest_run_loop
+    async def test_post_protobuf(self) -> None:
+        """test post request with snappy compressed response"""
+        client = self.get_rest_client()
+        res = await client.post(
+            uri='/postsnappy',
+            data=snappy.compress(b'example'),
+            headers={'Content-Encoding': 'snappy'},
+            response_format=ResponseFormat.PROTOBUF,
+        )
+        self.assertEqual(res, b'elpmaxe')
+        with self.assertRaises(AsyncRestClientException):
+            await client.post(
+                uri='/postsnappy',
+                data=snappy.compress(b'bad'),
+                headers={'Content-Encoding': 'snappy'},
+                response_format=ResponseFormat.PROTOBUF,
+            )
+
+    @unittest_run_loop
+    async def test_read_timeout(self) -> None:
+        """test slow responses time out"""
+        client = self.get_rest_client(read_timeout=0.1)
+        start = time.perf_counter()
+        with self.assertRaises(AsyncRestClientException):
+            await client.get('/getslow')
+        self.assertLess(time.perf_counter() - start, 0.9)
+
+    @unittest_run_loop
+    async def test_retries(self) -> None:
+        """test get requests are retried while datasource is unavailable"""
+        client = self.get_rest_client(retries=2, retry_backoff=0.01)
+        res = await client.get('/getflaky')
+        self.assertEqual(res['name'], 'example')
+        self.assertEqual(self.calls['/getflaky'], 3)
+        # post requests are not idempotent so they are never retried
+        with self.assertRaises(AsyncRestClientException):
+            await client.post(uri='/down', data=b'')
+        self.assertEqual(self.calls['/down'], 1)
+
+    @unittest_run_loop
+    async def test_circuit_breaker(self) -> None:
+        """test requests fail fast once the circuit breaker opens"""
+        client = self.get_rest_client(breaker_failures=2)
+        for _ in range(3):
+            with self.assertRaises(AsyncRestClientException):
+                await client.get('/down')
+        self.assertEqual(self.calls['/down'], 2)
+        breaker = client.get_circuit_breaker()
+        self.assertEqual(breaker.get_state(), CircuitBreaker.OPEN)
+        # responses which cannot be decoded do not count as failures
+        client = self.get_rest_client(breaker_failures=1)
+        with self.assertRaises(AsyncRestClientException):
+            await client.get('/gettext')
+        breaker = client.get_circuit_breaker()
+        self.assertEqual(breaker.get_state(), CircuitBreaker.CLOSED)
+
+    @unittest_run_loop
+    async def test_max_in_flight(self) -> None:
+        """test requests in flight are limited"""
+        client = self.get_rest_client(max_in_flight=1)
+        await asyncio.gather(*(client.get('/getconcurrent') for _ in range(3)))
+        self.assertEqual(self.in_flight, [0, 1])
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    @mock.patch('time.monotonic')
+    def test_half_open(self, monotonic: mock.MagicMock) -> None:
+        """test a single trial request is let through after timeout"""
+        monotonic.return_value = 100.0
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0)
+        breaker.record_result(success=False)
+        self.assertEqual(breaker.get_state(), CircuitBreaker.CLOSED)
+        breaker.record_result(success=False)
+        self.assertFalse(breaker.allow_request())
+        monotonic.return_value = 110.0
+        self.assertEqual(breaker.get_state(), CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        # failed trial opens the breaker again
+        breaker.record_result(success=False)
+        self.assertEqual(breaker.get_state(), CircuitBreaker.OPEN)
+        monotonic.return_value = 120.0
+        self.assertTrue(breaker.allow_request())
+        # cancelled trial lets another trial through
+        breaker.record_result(success=None)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_result(success=True)
+        self.assertEqual(breaker.get_state(), CircuitBreaker.CLOSED)
+
 
 if __name__ == '__main__':
     unittest.main()
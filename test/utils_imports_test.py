@@ -0,0 +1,39 @@
+import sys
+import unittest
+from utils import imports
+from utils.imports import (
+    LazyModule,
+    get_import_report,
+    import_lazy_modules,
+)
+
+
+class LazyModuleTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        sys.modules.pop('colorsys', None)
+
+    def test_import_on_first_use(self) -> None:
+        """test module is only imported once an attribute is used"""
+        colorsys = LazyModule('colorsys')
+        self.assertFalse(colorsys.is_loaded())
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertEqual(colorsys.rgb_to_hsv(1.0, 0.0, 0.0), (0.0, 1.0, 1.0))
+        self.assertTrue(colorsys.is_loaded())
+        self.assertIn('colorsys', sys.modules)
+        self.assertGreater(get_import_report()['colorsys'], 0.0)
+
+    def test_import_lazy_modules(self) -> None:
+        """test warm up imports every lazily declared module"""
+        colorsys = LazyModule('colorsys')
+        report = import_lazy_modules()
+        self.assertIn('colorsys', sys.modules)
+        self.assertIn('colorsys', report)
+        self.assertIs(colorsys.load(), sys.modules['colorsys'])
+
+    def test_missing_module(self) -> None:
+        """test missing module fails on first use"""
+        missing = LazyModule('capmon_missing_module')
+        self.addCleanup(imports._import_times.pop, 'capmon_missing_module')
+        with self.assertRaises(ImportError):
+            missing.load()
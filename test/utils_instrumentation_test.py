@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import unittest
+import tracemalloc
+from unittest import mock
+from prometheus_client import REGISTRY
+from utils.instrumentation import (
+    time_stage,
+    collect_stage_timings,
+    collect_stage_memory,
+    record_series,
+    record_cache_lookup,
+    record_datasource_error,
+    render_metrics,
+    mark_worker_dead,
+    MULTIPROC_DIR_ENV,
+)
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def get_value(self, name: str, labels: dict = None) -> float:
+        """helper method to get current value of a metric sample"""
+        val = REGISTRY.get_sample_value(name, labels or {})
+        return val if val is not None else 0.0
+
+    def test_time_stage(self) -> None:
+        """test time_stage observes stage histogram"""
+        labels = {'stage': 'fit'}
+        before = self.get_value('capmon_stage_duration_seconds_count', labels)
+        with time_stage(stage='fit'):
+            pass
+        after = self.get_value('capmon_stage_duration_seconds_count', labels)
+        self.assertEqual(after - before, 1)
+
+    def test_time_stage_with_error(self) -> None:
+        """test time_stage observes stage histogram on errors"""
+        labels = {'stage': 'decode'}
+        before = self.get_value('capmon_stage_duration_seconds_count', labels)
+        with self.assertRaises(ValueError):
+            with time_stage(stage='decode'):
+                raise ValueError('bad data')
+        after = self.get_value('capmon_stage_duration_seconds_count', labels)
+        self.assertEqual(after - before, 1)
+
+    def test_collect_stage_timings(self) -> None:
+        """test stage timings collected only while collecting"""
+        with collect_stage_timings() as timings:
+            with time_stage(stage='fit'):
+                pass
+            with time_stage(stage='fit'):
+                pass
+            with time_stage(stage='predict'):
+                pass
+        with time_stage(stage='trends'):
+            pass
+        self.assertEqual(set(timings.keys()), {'fit', 'predict'})
+        self.assertTrue(timings['fit'] >= 0)
+
+    def test_collect_stage_memory(self) -> None:
+        """test stage memory collected only while tracing"""
+        with collect_stage_memory() as peaks:
+            with time_stage(stage='fit'):
+                pass
+        self.assertIsNone(peaks)
+        tracemalloc.start()
+        try:
+            with collect_stage_memory() as peaks:
+                with time_stage(stage='fit'):
+                    data = [0.0] * 100000
+                with time_stage(stage='predict'):
+                    pass
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(set(peaks.keys()), {'fit', 'predict'})
+        self.assertTrue(peaks['fit'] >= 8 * len(data))
+
+    def test_nested_stage_memory(self) -> None:
+        """test nested stages do not reset peaks of outer stages"""
+        tracemalloc.start()
+        try:
+            with collect_stage_memory() as peaks:
+                with time_stage(stage='fetch'):
+                    data = [0.0] * 100000
+                    del data
+                    with time_stage(stage='decode'):
+                        pass
+        finally:
+            tracemalloc.stop()
+        self.assertTrue(peaks['fetch'] >= 7 * 100000)
+        self.assertTrue(peaks['decode'] < 7 * 100000)
+
+    def test_record_series(self) -> None:
+        """test series and points counters"""
+        series = self.get_value('capmon_series_processed_total')
+        points = self.get_value('capmon_points_processed_total')
+        record_series(points=[10, 20])
+        self.assertEqual(
+            self.get_value('capmon_series_processed_total') - series,
+            2
+        )
+        self.assertEqual(
+            self.get_value('capmon_points_processed_total') - points,
+            30
+        )
+
+    def test_record_cache_lookup(self) -> None:
+        """test cache hit and miss counters"""
+        labels = {'cache': 'test'}
+        hits = self.get_value('capmon_cache_hits_total', labels)
+        misses = self.get_value('capmon_cache_misses_total', labels)
+        record_cache_lookup(cache='test', hit=True)
+        record_cache_lookup(cache='test', hit=False)
+        record_cache_lookup(cache='test', hit=False)
+        self.assertEqual(
+            self.get_value('capmon_cache_hits_total', labels) - hits,
+            1
+        )
+        self.assertEqual(
+            self.get_value('capmon_cache_misses_total', labels) - misses,
+            2
+        )
+
+    def test_render_metrics(self) -> None:
+        """test metrics rendered in prometheus format"""
+        record_datasource_error(datasource='http://localhost:9090')
+        body, content_type = render_metrics()
+        self.assertTrue(content_type.startswith('text/plain'))
+        body = body.decode('utf-8')
+        self.assertIn('capmon_stage_duration_seconds', body)
+        sample = (
+            'capmon_datasource_errors_total'
+            '{datasource="http://localhost:9090"}'
+        )
+        self.assertIn(sample, body)
+
+    def test_mark_worker_dead(self) -> None:
+        """test live gauges of exited workers are removed"""
+        path = tempfile.mkdtemp(prefix='capmon-metrics-test-')
+        self.addCleanup(shutil.rmtree, path)
+        files = [
+            'gauge_livesum_123.db',
+            'counter_123.db',
+            'gauge_livesum_4.db',
+        ]
+        for name in files:
+            open(os.path.join(path, name), 'w').close()
+        mark_worker_dead(pid=123)
+        self.assertEqual(sorted(os.listdir(path)), sorted(files))
+        with mock.patch.dict(os.environ, {MULTIPROC_DIR_ENV: path}):
+            mark_worker_dead(pid=123)
+        self.assertEqual(
+            sorted(os.listdir(path)),
+            ['counter_123.db', 'gauge_livesum_4.db'],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
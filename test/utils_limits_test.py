@@ -0,0 +1,81 @@
+import asyncio
+import shutil
+import tempfile
+import threading
+import unittest
+from utils.limits import ConcurrencyLimiter
+
+
+class ConcurrencyLimiterTest(unittest.TestCase):
+
+    def test_limit_across_threads(self) -> None:
+        """test limit is shared by event loops of all threads"""
+        limiter = ConcurrencyLimiter(name='test', limit=2)
+        peak = []
+        lock = threading.Lock()
+
+        async def request() -> None:
+            slot = await limiter.acquire()
+            with lock:
+                peak.append(limiter.get_in_flight())
+            await asyncio.sleep(0.02)
+            limiter.release(slot=slot)
+
+        async def requests() -> None:
+            await asyncio.gather(*(request() for _ in range(3)))
+
+        threads = [
+            threading.Thread(target=asyncio.run, args=(requests(),))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(peak), 9)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(limiter.get_in_flight(), 0)
+
+    def test_cancelled_waiter(self) -> None:
+        """test cancelled waiters do not leak slots"""
+        limiter = ConcurrencyLimiter(name='test', limit=1)
+
+        async def run() -> None:
+            slot = await limiter.acquire()
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(limiter.acquire(), timeout=0.01)
+            limiter.release(slot=slot)
+            self.assertEqual(limiter.get_in_flight(), 0)
+            slot = await asyncio.wait_for(limiter.acquire(), timeout=1.0)
+            self.assertEqual(limiter.get_in_flight(), 1)
+            limiter.release(slot=slot)
+
+        asyncio.run(run())
+
+    def test_host_limit(self) -> None:
+        """test host limit is shared by limiters of the same name"""
+        lock_dir = tempfile.mkdtemp(prefix='capmon-limits-test-')
+        self.addCleanup(shutil.rmtree, lock_dir)
+        limiters = [
+            ConcurrencyLimiter(
+                name='test',
+                limit=0,
+                host_limit=1,
+                lock_dir=lock_dir,
+            )
+            for _ in range(2)
+        ]
+
+        async def run() -> None:
+            slot = await limiters[0].acquire()
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(limiters[1].acquire(), timeout=0.05)
+            limiters[0].release(slot=slot)
+            slot = await asyncio.wait_for(limiters[1].acquire(), timeout=1.0)
+            limiters[1].release(slot=slot)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
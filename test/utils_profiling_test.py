@@ -0,0 +1,81 @@
+import unittest
+import os
+import tempfile
+import threading
+from utils.profiling import Profiler
+
+
+def busy_work() -> int:
+    """function to give the profiler something to record"""
+    return sum(i * i for i in range(1000))
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """method executed before every test"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(output_dir=self.tmp_dir.name, top_n=5)
+
+    def tearDown(self) -> None:
+        """method executed after every test"""
+        self.tmp_dir.cleanup()
+
+    def test_disarmed_profiler(self) -> None:
+        """test disarmed profiler does not profile"""
+        with self.profiler.profile(label='disarmed') as profile:
+            busy_work()
+        self.assertIsNone(profile)
+        self.assertIsNone(self.profiler.get_last_result())
+        self.assertEqual(self.profiler.get_saved_results(), [])
+
+    def test_armed_profiler(self) -> None:
+        """test armed profiler profiles requested number of runs"""
+        self.profiler.arm(count=1)
+        self.assertEqual(self.profiler.get_remaining(), 1)
+        with self.profiler.profile(label='armed') as profile:
+            busy_work()
+        self.assertIsNotNone(profile)
+        self.assertEqual(self.profiler.get_remaining(), 0)
+        result = self.profiler.get_last_result()
+        self.assertEqual(result.get_label(), 'armed')
+        self.assertTrue(os.path.exists(result.get_path()))
+        top = result.get_top()
+        self.assertTrue(0 < len(top) <= 5)
+        functions = [row['function'] for row in top]
+        self.assertTrue(any('busy_work' in f for f in functions))
+        # next run should not be profiled
+        with self.profiler.profile(label='after') as profile:
+            busy_work()
+        self.assertIsNone(profile)
+        saved = self.profiler.get_saved_results()
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(saved[0]['label'], 'armed')
+
+    def test_forced_profile(self) -> None:
+        """test forced profile runs without arming"""
+        with self.profiler.profile(label='forced', force=True) as profile:
+            busy_work()
+        self.assertIsNotNone(profile)
+        self.assertEqual(self.profiler.get_last_result().get_label(), 'forced')
+
+    def test_last_result_per_thread(self) -> None:
+        """test profiles of other threads are not returned as last"""
+        with self.profiler.profile(label='main', force=True):
+            busy_work()
+        results = []
+
+        def profile_other() -> None:
+            with self.profiler.profile(label='other', force=True):
+                busy_work()
+            results.append(self.profiler.get_last_result().get_label())
+
+        thread = threading.Thread(target=profile_other)
+        thread.start()
+        thread.join()
+        self.assertEqual(results, ['other'])
+        self.assertEqual(self.profiler.get_last_result().get_label(), 'main')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+from utils.serialization import (
+    FORMAT_VERSION,
+    decode_columns,
+    encode_columns,
+)
+
+
+class SerializationTest(unittest.TestCase):
+
+    def test_round_trip(self) -> None:
+        """test columns and metadata are decoded as encoded"""
+        data = encode_columns(
+            columns={
+                'timestamp': np.array([0, 3600], dtype=np.int64),
+                'value': np.array([1.5, np.nan]),
+            },
+            metadata={'name': 'cpu'},
+        )
+        columns, metadata = decode_columns(data=data)
+        self.assertEqual(metadata, {'name': 'cpu'})
+        self.assertEqual(columns['timestamp'].tolist(), [0, 3600])
+        self.assertEqual(columns['timestamp'].dtype, np.int64)
+        np.testing.assert_array_equal(columns['value'], [1.5, np.nan])
+        # arrays are views of the data, not copies
+        self.assertFalse(columns['value'].flags.writeable)
+        self.assertFalse(columns['value'].flags.owndata)
+
+    def test_invalid_data(self) -> None:
+        """test data that is not a container is rejected"""
+        with self.assertRaises(ValueError):
+            decode_columns(data=b'not a container')
+        data = encode_columns(columns={'value': np.zeros(1)}, metadata={})
+        with self.assertRaises(ValueError):
+            decode_columns(data=data.replace(
+                f'"version": {FORMAT_VERSION}'.encode(),
+                b'"version": 0',
+            ))
+
+
+if __name__ == '__main__':
+    unittest.main()
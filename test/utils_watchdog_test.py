@@ -0,0 +1,39 @@
+import unittest
+import mock
+from utils.watchdog import RSSWatchdog, get_rss
+
+
+class RSSWatchdogTest(unittest.TestCase):
+
+    def test_get_rss(self) -> None:
+        """test rss of the process is reported"""
+        self.assertTrue(get_rss() > 0)
+
+    @mock.patch('os.kill')
+    def test_disabled_watchdog(self, kill: mock.MagicMock) -> None:
+        """test watchdog without budget never recycles"""
+        watchdog = RSSWatchdog(max_rss=0)
+        self.assertFalse(watchdog.is_enabled())
+        self.assertIsNone(watchdog.check())
+        kill.assert_not_called()
+
+    @mock.patch('os.kill')
+    def test_under_budget(self, kill: mock.MagicMock) -> None:
+        """test watchdog under budget does not recycle"""
+        watchdog = RSSWatchdog(max_rss=get_rss() * 100)
+        self.assertIsNone(watchdog.check())
+        self.assertFalse(watchdog.is_recycling())
+        kill.assert_not_called()
+
+    @mock.patch('os.kill')
+    def test_over_budget(self, kill: mock.MagicMock) -> None:
+        """test watchdog over budget recycles once"""
+        watchdog = RSSWatchdog(max_rss=1)
+        self.assertIsNotNone(watchdog.check())
+        self.assertTrue(watchdog.is_recycling())
+        self.assertIsNone(watchdog.check())
+        kill.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,438 @@
+from collections import OrderedDict
+from enum import Enum
+from typing import Iterable, Optional, Tuple
+from urllib import error as url_error, request as url_request
+import abc
+import hashlib
+import http.client
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
+from utils.instrumentation import (
+    record_cache_error,
+    record_cache_eviction,
+    record_cache_lookup,
+)
+
+# default path of the sqlite database of sqlite caches
+CACHE_PATH = os.path.join(tempfile.gettempdir(), 'capmon-cache.sqlite')
+# seconds to wait for responses of network caches
+HTTP_TIMEOUT = 1.0
+# header network caches are told the ttl of an entry with
+TTL_HEADER = 'X-Capmon-TTL'
+# cache names are used as sqlite table names and url paths
+NAME_RE = re.compile(r'^[a-z][a-z0-9_]*$')
+# share of the time from the last recorded access of a sqlite cache
+# entry to its expiry that has to pass before a hit records a new
+# access, so hits do not all write to the database
+ACCESS_REFRESH = 0.1
+# errors of backends that caches treat as misses
+BACKEND_ERRORS = (OSError, sqlite3.Error, http.client.HTTPException)
+
+
+class CacheBackend(Enum):
+    """
+    CacheBackend is where caches store their entries
+    """
+    # NONE disables caching
+    NONE = 'none'
+    # MEMORY keeps entries in each worker
+    MEMORY = 'memory'
+    # SQLITE keeps entries in a sqlite database shared by the workers
+    # of a host
+    SQLITE = 'sqlite'
+    # HTTP keeps entries in a cache service shared across hosts
+    HTTP = 'http'
+
+
+class Cache(object, metaclass=abc.ABCMeta):
+    """
+    Cache stores encoded values (i.e series or reports encoded with
+    to_bytes) by key for a number of seconds, so analyses repeated
+    within a worker, across workers or across hosts are served
+    without being redone. caches fail open: errors of the backend
+    are recorded and treated as misses
+
+    Parameters
+    ----------
+    name: str
+        name of the cache (lowercase letters, digits and _), used
+        to record lookups and keep entries of caches sharing a
+        backend apart
+    """
+
+    def __init__(self, name: str) -> None:
+        if not NAME_RE.match(name):
+            raise ValueError(f'invalid cache name {name}')
+        self._name = name
+
+    def get_name(self) -> str:
+        """method to get name of the cache"""
+        return self._name
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        method to get value of key, or None if key is missing or
+        expired
+
+        Parameters
+        ----------
+        key: str
+            key to look up
+        """
+        try:
+            value = self._get(key=key)
+        except BACKEND_ERRORS:
+            record_cache_error(cache=self._name)
+            value = None
+        record_cache_lookup(cache=self._name, hit=value is not None)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """
+        method to set value of key for ttl seconds
+
+        Parameters
+        ----------
+        key: str
+            key to set
+        value: bytes
+            value to store
+        ttl: float
+            seconds until the entry expires
+        """
+        try:
+            self._set(key=key, value=value, ttl=ttl)
+        except BACKEND_ERRORS:
+            record_cache_error(cache=self._name)
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> Optional[bytes]:
+        """helper method to get value of key from the backend"""
+        pass
+
+    @abc.abstractmethod
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        """helper method to set value of key in the backend"""
+        pass
+
+
+class MemoryCache(Cache):
+    """
+    MemoryCache is a Cache keeping entries in the worker, evicting
+    least recently used entries once their size exceeds max_bytes
+
+    Parameters
+    ----------
+    name: str
+        name of the cache
+    max_bytes: int
+        max total size of values
+    """
+
+    def __init__(self, name: str, max_bytes: int) -> None:
+        super().__init__(name=name)
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._entries: 'OrderedDict[str, Tuple[float, bytes]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_size(self) -> int:
+        """method to get total size of values in the cache"""
+        return self._size
+
+    def _get(self, key: str) -> Optional[bytes]:
+        """helper method to get value of key from the backend"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.time():
+                self._remove(key=key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        """helper method to set value of key in the backend"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key=key)
+            if len(value) > self._max_bytes:
+                return
+            self._entries[key] = (time.time() + ttl, value)
+            self._size += len(value)
+            evicted = 0
+            while self._size > self._max_bytes:
+                self._remove(key=next(iter(self._entries)))
+                evicted += 1
+        if evicted:
+            record_cache_eviction(cache=self._name, count=evicted)
+
+    def _remove(self, key: str) -> None:
+        """helper method to remove an entry, holding the lock"""
+        _, value = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class SQLiteCache(Cache):
+    """
+    SQLiteCache is a Cache keeping entries in a sqlite database, so
+    all workers of a host share them. the database is memory mapped,
+    so reads do not go through read calls, but values are still
+    copied out of it. least recently used entries are evicted once
+    their size exceeds max_bytes. accesses are recorded lazily (once
+    ACCESS_REFRESH of the time left to the expiry of an entry since
+    its last recorded access has passed), so most hits only read.
+    each cache has a table of its own in the database
+
+    Parameters
+    ----------
+    name: str
+        name of the cache
+    max_bytes: int
+        max total size of values
+    path: Optional[str] (default: CACHE_PATH)
+        path of the sqlite database
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int,
+        path: Optional[str] = CACHE_PATH,
+    ) -> None:
+        super().__init__(name=name)
+        self._max_bytes = max_bytes
+        self._path = path
+        self._table = f'cache_{name}'
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        helper method to get connection of the worker, holding the
+        lock. connections are not shared across forks (i.e workers
+        forked from a preloaded app)
+        """
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(
+                self._path,
+                timeout=HTTP_TIMEOUT * 5,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA mmap_size={self._max_bytes}')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self._table} ('
+                'key TEXT PRIMARY KEY, value BLOB, size INTEGER, '
+                'expires REAL, accessed REAL)'
+            )
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS {self._table}_accessed '
+                f'ON {self._table} (accessed)'
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _get(self, key: str) -> Optional[bytes]:
+        """helper method to get value of key from the backend"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                f'SELECT value, expires, accessed FROM {self._table} '
+                'WHERE key = ?',
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires, accessed = row
+            if expires <= now:
+                conn.execute(
+                    f'DELETE FROM {self._table} WHERE key = ?',
+                    (key,),
+                )
+                return None
+            if now - accessed >= ACCESS_REFRESH * (expires - accessed):
+                conn.execute(
+                    f'UPDATE {self._table} SET accessed = ? WHERE key = ?',
+                    (now, key),
+                )
+            return value
+
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        """helper method to set value of key in the backend"""
+        if len(value) > self._max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    f'INSERT OR REPLACE INTO {self._table} '
+                    '(key, value, size, expires, accessed) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, sqlite3.Binary(value), len(value), now + ttl, now),
+                )
+                evicted = self._evict(conn=conn, now=now)
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+        if evicted:
+            record_cache_eviction(cache=self._name, count=evicted)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> int:
+        """
+        helper method to remove expired entries and then least
+        recently used entries until values fit in max_bytes. returns
+        number of entries evicted
+        """
+        expired = conn.execute(
+            f'DELETE FROM {self._table} WHERE expires <= ?',
+            (now,),
+        ).rowcount
+        total = conn.execute(
+            f'SELECT COALESCE(SUM(size), 0) FROM {self._table}'
+        ).fetchone()[0]
+        excess = total - self._max_bytes
+        evicted = 0
+        if excess > 0:
+            keys = []
+            rows = conn.execute(
+                f'SELECT key, size FROM {self._table} ORDER BY accessed'
+            )
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= size
+            conn.executemany(
+                f'DELETE FROM {self._table} WHERE key = ?',
+                keys,
+            )
+            evicted = len(keys)
+        return expired + evicted
+
+
+class HTTPCache(Cache):
+    """
+    HTTPCache is a Cache keeping entries in a cache service shared
+    across hosts. entries are read with GET {url}/{name}/{key}
+    (200 with the value, 404 if missing) and written with PUT of
+    the value and its ttl in seconds in the X-Capmon-TTL header.
+    eviction is up to the service
+
+    Parameters
+    ----------
+    name: str
+        name of the cache
+    url: str
+        base url of the cache service
+    timeout: Optional[float] (default: HTTP_TIMEOUT)
+        seconds to wait for responses
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        timeout: Optional[float] = HTTP_TIMEOUT,
+    ) -> None:
+        super().__init__(name=name)
+        self._url = url.rstrip('/')
+        self._timeout = timeout
+
+    def _get(self, key: str) -> Optional[bytes]:
+        """helper method to get value of key from the backend"""
+        req = url_request.Request(f'{self._url}/{self._name}/{key}')
+        try:
+            with url_request.urlopen(req, timeout=self._timeout) as res:
+                return res.read()
+        except url_error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        """helper method to set value of key in the backend"""
+        req = url_request.Request(
+            f'{self._url}/{self._name}/{key}',
+            data=value,
+            method='PUT',
+            headers={
+                'Content-Type': 'application/octet-stream',
+                TTL_HEADER: str(ttl),
+            },
+        )
+        with url_request.urlopen(req, timeout=self._timeout):
+            pass
+
+
+def create_cache(
+    backend: CacheBackend,
+    name: str,
+    max_bytes: int,
+    path: Optional[str] = CACHE_PATH,
+    url: Optional[str] = None,
+) -> Optional[Cache]:
+    """
+    function to create a cache of a backend, or None if caching is
+    disabled
+
+    Parameters
+    ----------
+    backend: CacheBackend
+        where the cache stores entries
+    name: str
+        name of the cache
+    max_bytes: int
+        max total size of values of memory and sqlite caches
+    path: Optional[str] (default: CACHE_PATH)
+        path of the database of sqlite caches
+    url: Optional[str] (default: None)
+        base url of the service of http caches
+    """
+    if backend == CacheBackend.MEMORY:
+        return MemoryCache(name=name, max_bytes=max_bytes)
+    if backend == CacheBackend.SQLITE:
+        return SQLiteCache(name=name, max_bytes=max_bytes, path=path)
+    if backend == CacheBackend.HTTP:
+        if not url:
+            raise ValueError('http caches need a url')
+        return HTTPCache(name=name, url=url)
+    return None
+
+
+def gen_cache_key(parts: Iterable[object]) -> str:
+    """
+    function to generate a cache key digesting parts. arrays and
+    bytes are digested as raw bytes, anything else as json
+
+    Parameters
+    ----------
+    parts: Iterable[object]
+        parts identifying the cached value
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(str(part.dtype).encode())
+            part = np.ascontiguousarray(part).tobytes()
+        elif not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, default=str).encode()
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
@@ -1,5 +1,149 @@
+from enum import Enum
 from typing import Optional, Mapping
+import asyncio
+import io
+import pickle
+import random
+import threading
+import time
 import aiohttp
+import msgpack
+from utils.imports import LazyModule
+from utils.limits import ConcurrencyLimiter
+from utils.instrumentation import (
+    time_stage,
+    record_datasource_error,
+    record_datasource_queue_wait,
+    record_datasource_rejection,
+    record_datasource_retry,
+)
+
+snappy = LazyModule('snappy')
+
+# http statuses of a datasource that is overloaded or restarting.
+# requests failing with them are retried and count as failures for
+# the circuit breaker
+RETRY_STATUSES = (429, 502, 503, 504)
+# http methods that are safe to retry
+RETRY_METHODS = ('GET',)
+# max seconds to back off between retries
+MAX_RETRY_BACKOFF = 10.0
+
+
+class ResponseFormat(Enum):
+    """
+    ResponseFormat is the body encoding AsyncRestClient expects
+    from an external API
+    """
+    # JSON is the default json encoded body
+    JSON = 'json'
+    # MSGPACK is a msgpack encoded body (i.e graphite format=msgpack)
+    MSGPACK = 'msgpack'
+    # PICKLE is a pickled body of plain lists/dicts (i.e graphite
+    # format=pickle), decoded with SafeUnpickler
+    PICKLE = 'pickle'
+    # PROTOBUF is a snappy compressed protobuf body (i.e prometheus
+    # remote read), decoded to the uncompressed message bytes
+    PROTOBUF = 'protobuf'
+
+
+class SafeUnpickler(pickle.Unpickler):
+    """
+    SafeUnpickler is an Unpickler that only allows builtin
+    primitives (lists, dicts, strings and numbers) to be loaded.
+    Any attempt to resolve a global (class or function) is rejected
+    """
+
+    def find_class(self, module: str, name: str) -> None:
+        """method to reject loading of any globals from pickle"""
+        raise pickle.UnpicklingError(
+            f'global {module}.{name} is not allowed'
+        )
+
+
+class CircuitBreaker(object):
+    """
+    CircuitBreaker fails requests to a datasource fast while it is
+    down. it opens after failure_threshold consecutive failures and
+    rejects requests for reset_timeout seconds. then it is half open
+    and lets a single trial request through, closing if it succeeds
+    and opening again if it fails. it is thread safe, so a single
+    breaker can be shared by every query of a worker
+
+    Parameters
+    ----------
+    failure_threshold: Optional[int] (default: 5)
+        consecutive failures after which the breaker opens
+    reset_timeout: Optional[float] (default: 30.0)
+        seconds the breaker stays open before a trial request
+    """
+    # CLOSED lets every request through
+    CLOSED = 'closed'
+    # OPEN rejects every request
+    OPEN = 'open'
+    # HALF_OPEN lets a single trial request through
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        failure_threshold: Optional[int] = 5,
+        reset_timeout: Optional[float] = 30.0,
+    ) -> None:
+        self._threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def get_state(self) -> str:
+        """method to get state of the breaker"""
+        with self._lock:
+            return self._get_state()
+
+    def allow_request(self) -> bool:
+        """method to check if a request may be made and claim it"""
+        with self._lock:
+            state = self._get_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_result(self, success: Optional[bool]) -> None:
+        """
+        method to record the result of an allowed request
+
+        Parameters
+        ----------
+        success: Optional[bool]
+            whether the datasource was available. None if the request
+            did not finish (i.e it was cancelled)
+        """
+        with self._lock:
+            self._trial = False
+            if success is None:
+                return
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if (
+                self._opened_at is not None
+                or self._failures >= self._threshold
+            ):
+                self._opened_at = time.monotonic()
+
+    def _get_state(self) -> str:
+        """helper method to get state of the breaker holding the lock"""
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
 
 
 class AsyncRestClientException(Exception):
@@ -48,22 +192,87 @@ class AsyncRestClient(object):
     ----------
     base_url: str
         base url to make requests to
+    connect_timeout: Optional[float] (default: None)
+        seconds to wait for a connection. None waits forever
+    read_timeout: Optional[float] (default: None)
+        seconds to wait for each read of the response. None waits
+        forever
+    retries: Optional[int] (default: 0)
+        times to retry GET requests failing because the datasource
+        is unreachable, timed out or answered with RETRY_STATUSES
+    retry_backoff: Optional[float] (default: 0.5)
+        base seconds to back off before retrying. backoff doubles
+        with every retry (up to MAX_RETRY_BACKOFF) and is jittered
+        so workers do not retry in lockstep
+    breaker_failures: Optional[int] (default: 0)
+        consecutive failed requests after which requests fail fast
+        (see CircuitBreaker). 0 disables the circuit breaker
+    breaker_reset_timeout: Optional[float] (default: 30.0)
+        seconds to fail fast for before trying the datasource again
+    max_in_flight: Optional[int] (default: 0)
+        max requests in flight to the datasource across all threads
+        of the process using the client. 0 means no limit
+    host_max_in_flight: Optional[int] (default: 0)
+        max requests in flight to the datasource across all processes
+        of the host. 0 means no limit
     """
 
-    def __init__(self, base_url: str) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        retries: Optional[int] = 0,
+        retry_backoff: Optional[float] = 0.5,
+        breaker_failures: Optional[int] = 0,
+        breaker_reset_timeout: Optional[float] = 30.0,
+        max_in_flight: Optional[int] = 0,
+        host_max_in_flight: Optional[int] = 0,
+    ) -> None:
         self._base = base_url
+        self._timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        self._retries = retries
+        self._backoff = retry_backoff
+        self._breaker = None
+        if breaker_failures > 0:
+            self._breaker = CircuitBreaker(
+                failure_threshold=breaker_failures,
+                reset_timeout=breaker_reset_timeout,
+            )
+        self._limiter = None
+        if max_in_flight > 0 or host_max_in_flight > 0:
+            self._limiter = ConcurrencyLimiter(
+                name=base_url,
+                limit=max_in_flight,
+                host_limit=host_max_in_flight,
+            )
         self._client_exceptions = (
             aiohttp.ClientResponseError,
             aiohttp.ClientConnectionError,
             aiohttp.ClientPayloadError,
-            aiohttp.ServerTimeoutError,
+            asyncio.TimeoutError,
+        )
+        self._decode_exceptions = (
+            msgpack.UnpackException,
+            pickle.UnpicklingError,
+            ValueError,
+            EOFError,
         )
 
+    def get_circuit_breaker(self) -> Optional[CircuitBreaker]:
+        """method to get circuit breaker of the datasource, if any"""
+        return self._breaker
+
     async def get(
         self,
         uri: str,
-        params: Optional[Mapping[str, str]] = None
-    ) -> dict:
+        params: Optional[Mapping[str, str]] = None,
+        response_format: Optional[ResponseFormat] = ResponseFormat.JSON,
+    ) -> object:
         """
         method to make a get request
 
@@ -73,31 +282,211 @@ class AsyncRestClient(object):
             the uri to make request to
         params: Optional[Mapping[str, str]] (default None)
             the parameters to pass to request
+        response_format: Optional[ResponseFormat] (default JSON)
+            the encoding of the response body
 
-        returns json response
+        returns decoded response
         """
-        async with aiohttp.ClientSession() as session:
-            try:
-                return await self._get(
+        return await self._request(
+            method='GET',
+            uri=uri,
+            params=params,
+            response_format=response_format,
+        )
+
+    async def post(
+        self,
+        uri: str,
+        data: bytes,
+        headers: Optional[Mapping[str, str]] = None,
+        response_format: Optional[ResponseFormat] = ResponseFormat.JSON,
+    ) -> object:
+        """
+        method to make a post request
+
+        Parameters
+        ----------
+        uri: str
+            the uri to make request to
+        data: bytes
+            the body to send
+        headers: Optional[Mapping[str, str]] (default None)
+            the headers to send
+        response_format: Optional[ResponseFormat] (default JSON)
+            the encoding of the response body
+
+        returns decoded response
+        """
+        return await self._request(
+            method='POST',
+            uri=uri,
+            data=data,
+            headers=headers,
+            response_format=response_format,
+        )
+
+    async def _request(
+        self,
+        method: str,
+        uri: str,
+        params: Optional[Mapping[str, str]] = None,
+        data: Optional[bytes] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        response_format: Optional[ResponseFormat] = ResponseFormat.JSON,
+    ) -> object:
+        """helper method to make a request and handle its errors"""
+        breaker = self._breaker
+        if breaker is not None and not breaker.allow_request():
+            record_datasource_rejection(datasource=self._base)
+            raise AsyncRestClientException(
+                base=self._base,
+                uri=uri,
+                method=method,
+                error='datasource is unavailable (circuit breaker open)',
+            )
+        # whether the datasource was available, None if unknown
+        available = None
+        try:
+            session = aiohttp.ClientSession(timeout=self._timeout)
+            async with session:
+                res = await self._send_with_retries(
                     session=session,
+                    method=method,
                     uri=uri,
-                    params=params
+                    params=params,
+                    data=data,
+                    headers=headers,
+                    response_format=response_format,
                 )
-            except self._client_exceptions:
-                raise AsyncRestClientException(
-                    base=self._base,
+            available = True
+            return res
+        except self._client_exceptions as e:
+            available = not self._is_unavailable(e)
+            record_datasource_error(datasource=self._base)
+            raise AsyncRestClientException(
+                base=self._base,
+                uri=uri,
+                method=method,
+                error='unable to fetch data',
+            )
+        except self._decode_exceptions:
+            available = True
+            record_datasource_error(datasource=self._base)
+            raise AsyncRestClientException(
+                base=self._base,
+                uri=uri,
+                method=method,
+                error='unable to decode data',
+            )
+        finally:
+            if breaker is not None:
+                breaker.record_result(success=available)
+
+    async def _send_with_retries(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        uri: str,
+        **kwargs,
+    ) -> object:
+        """
+        helper method to send a request, retrying idempotent requests
+        while the datasource is unavailable
+        """
+        attempts = 1
+        if method in RETRY_METHODS:
+            attempts += self._retries
+        for attempt in range(attempts):
+            try:
+                return await self._send_limited(
+                    session=session,
+                    method=method,
                     uri=uri,
-                    method='GET',
-                    error='unable to fetch data',
+                    **kwargs,
                 )
+            except self._client_exceptions as e:
+                if attempt + 1 >= attempts or not self._is_unavailable(e):
+                    raise
+            record_datasource_retry(datasource=self._base)
+            await asyncio.sleep(self._get_backoff(attempt=attempt))
 
-    async def _get(
+    async def _send_limited(self, **kwargs) -> object:
+        """
+        helper method to send a request once the concurrency limit of
+        the datasource allows it
+        """
+        if self._limiter is None:
+            return await self._send(**kwargs)
+        start = time.perf_counter()
+        with time_stage(stage='queue'):
+            slot = await self._limiter.acquire()
+        record_datasource_queue_wait(
+            datasource=self._base,
+            seconds=time.perf_counter() - start,
+        )
+        try:
+            return await self._send(**kwargs)
+        finally:
+            self._limiter.release(slot=slot)
+
+    def _get_backoff(self, attempt: int) -> float:
+        """helper method to get jittered seconds to back off"""
+        backoff = min(MAX_RETRY_BACKOFF, self._backoff * 2 ** attempt)
+        return random.uniform(0, backoff)
+
+    def _is_unavailable(self, error: Exception) -> bool:
+        """
+        helper method to check if a request failed because the
+        datasource is unavailable rather than the request was bad
+        """
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status in RETRY_STATUSES
+        return True
+
+    async def _send(
         self,
         session: aiohttp.ClientSession,
+        method: str,
         uri: str,
-        params: Optional[Mapping[str, str]] = None
-    ) -> dict:
-        """helper method for get method"""
+        params: Optional[Mapping[str, str]] = None,
+        data: Optional[bytes] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        response_format: Optional[ResponseFormat] = ResponseFormat.JSON,
+    ) -> object:
+        """helper method for _request method"""
         url = self._base + uri
-        async with session.get(url, params=params) as response:
-            return await response.json()
+        with time_stage(stage='fetch'):
+            response = await session.request(
+                method,
+                url,
+                params=params,
+                data=data,
+                headers=headers,
+            )
+            async with response:
+                if (
+                    response_format != ResponseFormat.JSON
+                    or response.status in RETRY_STATUSES
+                ):
+                    response.raise_for_status()
+                body = await response.read()
+        with time_stage(stage='decode'):
+            if response_format == ResponseFormat.JSON:
+                # body is already read so this only parses it
+                return await response.json()
+            return self._decode(body=body, response_format=response_format)
+
+    def _decode(
+        self,
+        body: bytes,
+        response_format: ResponseFormat,
+    ) -> object:
+        """helper method to decode binary response body"""
+        if response_format == ResponseFormat.MSGPACK:
+            return msgpack.unpackb(body, raw=False)
+        if response_format == ResponseFormat.PROTOBUF:
+            try:
+                return snappy.uncompress(body)
+            except snappy.UncompressError as e:
+                raise ValueError(str(e))
+        return SafeUnpickler(io.BytesIO(body)).load()
@@ -0,0 +1,94 @@
+from types import ModuleType
+from typing import Dict, Optional
+import importlib
+import sys
+import threading
+import time
+from utils.instrumentation import record_lazy_import
+
+# seconds taken by each lazy module import, keyed by module name
+_import_times: Dict[str, Optional[float]] = {}
+_import_lock = threading.Lock()
+
+
+class LazyModule(object):
+    """
+    LazyModule stands in for a heavy module (i.e pandas or fbprophet)
+    and imports it on first attribute access, so importing capmon
+    does not pay for it until an analysis needs it. annotations using
+    the module must be quoted to not trigger the import
+
+    Parameters
+    ----------
+    name: str
+        fully qualified name of the module to import
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module = None
+        _import_times.setdefault(name, None)
+
+    def get_name(self) -> str:
+        """method to get name of the module"""
+        return self._name
+
+    def is_loaded(self) -> bool:
+        """method to check if the module was imported"""
+        return self._module is not None
+
+    def load(self) -> ModuleType:
+        """method to import the module if it is not yet imported"""
+        if self._module is None:
+            self._module = import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str) -> object:
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        return f'<LazyModule {self._name} loaded={self.is_loaded()}>'
+
+
+def import_module(name: str) -> ModuleType:
+    """
+    function to import a module and record how long the import took
+    if this was the first import of it
+
+    Parameters
+    ----------
+    name: str
+        fully qualified name of the module to import
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with _import_lock:
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - start
+    _import_times[name] = elapsed
+    record_lazy_import(module=name, seconds=elapsed)
+    return module
+
+
+def import_lazy_modules() -> Dict[str, Optional[float]]:
+    """
+    function to import every module declared lazily (i.e to warm up
+    a worker before it serves requests) and return the import report
+    """
+    for name in list(_import_times):
+        import_module(name)
+    return get_import_report()
+
+
+def get_import_report() -> Dict[str, Optional[float]]:
+    """
+    function to get seconds each lazily declared module took to
+    import. modules not imported yet, or that were already imported
+    by something else when first used, have no time
+    """
+    return dict(_import_times)
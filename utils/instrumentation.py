@@ -0,0 +1,407 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Iterable, List, Optional, Tuple
+import os
+import threading
+import time
+import tracemalloc
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+    multiprocess,
+)
+
+# env var prometheus_client uses to share metrics across processes
+MULTIPROC_DIR_ENV = 'prometheus_multiproc_dir'
+
+# stages of an analysis request
+STAGES = (
+    'queue', 'fetch', 'decode', 'resample', 'fit', 'predict', 'trends',
+    'figure', 'backtest',
+)
+
+STAGE_DURATION = Histogram(
+    'capmon_stage_duration_seconds',
+    'Time spent in each stage of an analysis',
+    ['stage'],
+    buckets=(
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+        1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+    ),
+)
+SERIES_PROCESSED = Counter(
+    'capmon_series_processed_total',
+    'Number of timeseries fetched for analysis',
+)
+POINTS_PROCESSED = Counter(
+    'capmon_points_processed_total',
+    'Number of datapoints fetched for analysis',
+)
+QUERIES_CAPPED = Counter(
+    'capmon_queries_capped_total',
+    'Number of queries that matched more series than their series cap',
+)
+SERIES_CAPPED = Counter(
+    'capmon_series_capped_total',
+    'Number of series left out of analyses by series caps',
+)
+CACHE_HITS = Counter(
+    'capmon_cache_hits_total',
+    'Number of cache lookups that found an entry',
+    ['cache'],
+)
+CACHE_MISSES = Counter(
+    'capmon_cache_misses_total',
+    'Number of cache lookups that did not find an entry',
+    ['cache'],
+)
+CACHE_EVICTIONS = Counter(
+    'capmon_cache_evictions_total',
+    'Number of cache entries evicted for size or expiry',
+    ['cache'],
+)
+CACHE_ERRORS = Counter(
+    'capmon_cache_errors_total',
+    'Number of failed cache lookups and writes',
+    ['cache'],
+)
+DATASOURCE_ERRORS = Counter(
+    'capmon_datasource_errors_total',
+    'Number of failed requests to datasources',
+    ['datasource'],
+)
+DATASOURCE_RETRIES = Counter(
+    'capmon_datasource_retries_total',
+    'Number of requests to datasources retried',
+    ['datasource'],
+)
+DATASOURCE_REJECTIONS = Counter(
+    'capmon_datasource_rejections_total',
+    'Number of requests to datasources failed fast by circuit breakers',
+    ['datasource'],
+)
+DATASOURCE_QUEUE_WAIT = Histogram(
+    'capmon_datasource_queue_seconds',
+    'Time requests waited for a free slot of the concurrency limit of '
+    'a datasource',
+    ['datasource'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+WORKER_RECYCLES = Counter(
+    'capmon_worker_recycles_total',
+    'Number of workers recycled for exceeding their RSS budget',
+)
+LAZY_IMPORT_DURATION = Histogram(
+    'capmon_lazy_import_seconds',
+    'Time spent importing modules declared lazily, once per worker',
+    ['module'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+# per request stage timings, only set while collect_stage_timings is active
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    'capmon_stage_timings',
+    default=None,
+)
+# per request stage peak memory, only set while collect_stage_memory
+# is active and tracemalloc is tracing
+_stage_memory: ContextVar[Optional[Dict[str, int]]] = ContextVar(
+    'capmon_stage_memory',
+    default=None,
+)
+# [start, peak] traced bytes of stages whose memory is collected and
+# that have not finished yet, across requests. the traced peak is
+# global, so it is folded into every active stage before a stage
+# resets it
+_active_peaks: List[List[int]] = []
+_peaks_lock = threading.Lock()
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    """
+    context manager to record the time spent in a stage of
+    an analysis
+
+    Parameters
+    ----------
+    stage: str
+        name of the stage (one of STAGES)
+    """
+    memory = _stage_memory.get()
+    if memory is not None:
+        frame = _start_memory_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.labels(stage=stage).observe(elapsed)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+        if memory is not None:
+            peak = _stop_memory_peak(frame=frame)
+            memory[stage] = max(memory.get(stage, 0), peak)
+
+
+@contextmanager
+def collect_stage_timings() -> Iterator[Dict[str, float]]:
+    """
+    context manager to collect total seconds spent in each stage
+    by the wrapped code. yields the dict the timings are added to
+    """
+    timings = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+
+@contextmanager
+def collect_stage_memory() -> Iterator[Optional[Dict[str, int]]]:
+    """
+    context manager to collect the peak bytes allocated (above what
+    was allocated when the stage started) in each stage by the
+    wrapped code. yields the dict the peaks are added to, or None
+    when tracemalloc is not tracing.
+
+    peaks are exact on python 3.9+. older versions cannot reset the
+    peak, so the peak since tracing started is used instead. peaks
+    of nested stages count towards the stages around them, and
+    stages running at the same time (i.e queries gathered by a
+    MultiQuery) count each other's allocations
+    """
+    if not tracemalloc.is_tracing():
+        yield None
+        return
+    memory = {}
+    token = _stage_memory.set(memory)
+    try:
+        yield memory
+    finally:
+        _stage_memory.reset(token)
+
+
+def _start_memory_peak() -> List[int]:
+    """
+    helper function to start tracking the traced memory peak of a
+    stage. returns the [start, peak] traced bytes of the stage
+    """
+    with _peaks_lock:
+        _fold_memory_peak()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        frame = [current, current]
+        _active_peaks.append(frame)
+        return frame
+
+
+def _stop_memory_peak(frame: List[int]) -> int:
+    """
+    helper function to stop tracking the traced memory peak of a
+    stage started with _start_memory_peak. returns the peak bytes
+    allocated above what was allocated when the stage started
+    """
+    with _peaks_lock:
+        _fold_memory_peak()
+        _active_peaks.remove(frame)
+        return frame[1] - frame[0]
+
+
+def _fold_memory_peak() -> None:
+    """
+    helper function to add the traced memory peak to the peaks of
+    active stages, holding the lock. the traced peak can then be
+    reset without losing the peaks of stages around or alongside
+    the stage resetting it
+    """
+    if not tracemalloc.is_tracing():
+        return
+    peak = tracemalloc.get_traced_memory()[1]
+    for frame in _active_peaks:
+        frame[1] = max(frame[1], peak)
+
+
+def record_series(points: Iterable[int]) -> None:
+    """
+    function to record series and points processed
+
+    Parameters
+    ----------
+    points: Iterable[int]
+        number of points in each series processed
+    """
+    points = list(points)
+    SERIES_PROCESSED.inc(len(points))
+    POINTS_PROCESSED.inc(sum(points))
+
+
+def record_capped_query(kept: int, total: int) -> None:
+    """
+    function to record a query capped to fewer series than it matched
+
+    Parameters
+    ----------
+    kept: int
+        number of series kept
+    total: int
+        number of series matched by the query
+    """
+    QUERIES_CAPPED.inc()
+    SERIES_CAPPED.inc(total - kept)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """
+    function to record a cache lookup
+
+    Parameters
+    ----------
+    cache: str
+        name of the cache looked up
+    hit: bool
+        whether an entry was found
+    """
+    if hit:
+        CACHE_HITS.labels(cache=cache).inc()
+    else:
+        CACHE_MISSES.labels(cache=cache).inc()
+
+
+def record_cache_eviction(cache: str, count: int) -> None:
+    """
+    function to record cache entries evicted
+
+    Parameters
+    ----------
+    cache: str
+        name of the cache entries were evicted from
+    count: int
+        number of entries evicted
+    """
+    CACHE_EVICTIONS.labels(cache=cache).inc(count)
+
+
+def record_cache_error(cache: str) -> None:
+    """
+    function to record a failed cache lookup or write
+
+    Parameters
+    ----------
+    cache: str
+        name of the cache
+    """
+    CACHE_ERRORS.labels(cache=cache).inc()
+
+
+def record_datasource_error(datasource: str) -> None:
+    """
+    function to record a failed request to a datasource
+
+    Parameters
+    ----------
+    datasource: str
+        url of the datasource
+    """
+    DATASOURCE_ERRORS.labels(datasource=datasource).inc()
+
+
+def record_datasource_retry(datasource: str) -> None:
+    """
+    function to record a request to a datasource being retried
+
+    Parameters
+    ----------
+    datasource: str
+        url of the datasource
+    """
+    DATASOURCE_RETRIES.labels(datasource=datasource).inc()
+
+
+def record_datasource_rejection(datasource: str) -> None:
+    """
+    function to record a request to a datasource failed fast by
+    its circuit breaker
+
+    Parameters
+    ----------
+    datasource: str
+        url of the datasource
+    """
+    DATASOURCE_REJECTIONS.labels(datasource=datasource).inc()
+
+
+def record_datasource_queue_wait(datasource: str, seconds: float) -> None:
+    """
+    function to record the time a request to a datasource waited
+    for a free slot of its concurrency limit
+
+    Parameters
+    ----------
+    datasource: str
+        url of the datasource
+    seconds: float
+        seconds the request waited
+    """
+    DATASOURCE_QUEUE_WAIT.labels(datasource=datasource).observe(seconds)
+
+
+def record_worker_recycle() -> None:
+    """
+    function to record a worker being recycled for its RSS
+    """
+    WORKER_RECYCLES.inc()
+
+
+def record_lazy_import(module: str, seconds: float) -> None:
+    """
+    function to record the first import of a lazily declared module
+
+    Parameters
+    ----------
+    module: str
+        name of the module imported
+    seconds: float
+        seconds the import took
+    """
+    LAZY_IMPORT_DURATION.labels(module=module).observe(seconds)
+
+
+def mark_worker_dead(pid: int) -> None:
+    """
+    function to clean up metrics of a gunicorn worker that exited
+    (i.e recycled for exceeding its RSS budget or max requests).
+    files of its live gauges are removed from prometheus_multiproc_dir
+    so they are not aggregated any more. counters and histograms are
+    kept so totals do not go backwards
+
+    Parameters
+    ----------
+    pid: int
+        pid of the worker
+    """
+    path = os.getenv(MULTIPROC_DIR_ENV)
+    if path:
+        multiprocess.mark_process_dead(pid, path)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    function to render metrics in prometheus exposition format.
+    when running under gunicorn with prometheus_multiproc_dir set
+    metrics are aggregated across all of the workers
+
+    returns body and content type
+    """
+    registry = REGISTRY
+    if os.getenv(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return (generate_latest(registry), CONTENT_TYPE_LATEST)
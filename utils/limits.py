@@ -0,0 +1,153 @@
+from collections import deque
+from typing import Optional
+import asyncio
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+
+# directory lock files of host wide limits are kept in
+LOCK_DIR = os.path.join(tempfile.gettempdir(), 'capmon-limits')
+# min and max seconds to wait between attempts to take a host wide slot
+HOST_POLL_MIN = 0.005
+HOST_POLL_MAX = 0.1
+
+
+class ConcurrencyLimiter(object):
+    """
+    ConcurrencyLimiter limits the number of requests in flight to a
+    datasource. the limit is shared by every thread (and so every
+    event loop) of a process, and optionally by every process on the
+    host through lock files. waiters in a process are served first
+    come first served
+
+    Parameters
+    ----------
+    name: str
+        name of the limited resource (i.e datasource url)
+    limit: int
+        max requests in flight in the process. 0 means no limit
+    host_limit: Optional[int] (default: 0)
+        max requests in flight across processes of the host. 0
+        means no limit
+    lock_dir: Optional[str] (default: LOCK_DIR)
+        directory to keep lock files of host wide slots in
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        host_limit: Optional[int] = 0,
+        lock_dir: Optional[str] = LOCK_DIR,
+    ) -> None:
+        self._name = name
+        self._limit = limit
+        self._host_limit = host_limit
+        self._lock_dir = lock_dir
+        self._in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def get_in_flight(self) -> int:
+        """method to get number of requests in flight in the process"""
+        with self._lock:
+            return self._in_flight
+
+    async def acquire(self) -> Optional[int]:
+        """
+        method to wait until a request may be made. returns the host
+        wide slot taken (if any) to pass to release
+        """
+        if self._limit > 0:
+            await self._acquire_local()
+        if self._host_limit <= 0:
+            return None
+        try:
+            return await self._acquire_host()
+        except BaseException:
+            if self._limit > 0:
+                self._release_local()
+            raise
+
+    def release(self, slot: Optional[int]) -> None:
+        """
+        method to release the request slot taken by acquire
+
+        Parameters
+        ----------
+        slot: Optional[int]
+            host wide slot returned by acquire
+        """
+        if slot is not None:
+            # closing the lock file releases its lock
+            os.close(slot)
+        if self._limit > 0:
+            self._release_local()
+
+    async def _acquire_local(self) -> None:
+        """helper method to take a slot of the process wide limit"""
+        with self._lock:
+            if self._in_flight < self._limit and not self._waiters:
+                self._in_flight += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # slot was handed over just before cancellation
+            if waiter[1].done() and not waiter[1].cancelled():
+                self._release_local()
+            raise
+
+    def _release_local(self) -> None:
+        """
+        helper method to release a slot of the process wide limit,
+        handing it over to the next waiter if any
+        """
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._wake, future)
+                    return
+                except RuntimeError:
+                    # loop of waiter is closed
+                    continue
+            self._in_flight -= 1
+
+    def _wake(self, future: asyncio.Future) -> None:
+        """helper method to hand a slot over to a waiter"""
+        if future.done():
+            # waiter was cancelled before its slot was handed over
+            self._release_local()
+        else:
+            future.set_result(None)
+
+    async def _acquire_host(self) -> int:
+        """
+        helper method to take a slot of the host wide limit. returns
+        the descriptor of the locked slot file. locks are released by
+        the os when a process dies, so slots never leak
+        """
+        digest = hashlib.sha1(self._name.encode()).hexdigest()[:16]
+        os.makedirs(self._lock_dir, exist_ok=True)
+        poll = HOST_POLL_MIN
+        while True:
+            for slot in range(self._host_limit):
+                path = os.path.join(self._lock_dir, f'{digest}-{slot}.lock')
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except OSError:
+                    os.close(fd)
+            await asyncio.sleep(poll)
+            poll = min(HOST_POLL_MAX, poll * 2)
@@ -0,0 +1,211 @@
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+
+class ProfileResult(object):
+    """
+    ProfileResult is the outcome of profiling a single analysis
+
+    Parameters
+    ----------
+    label: str
+        label describing what was profiled (i.e the query)
+    path: str
+        path the pstats dump was saved to
+    top: Iterable[Dict[str, object]]
+        flat summary of the functions with most time spent in them
+    """
+
+    def __init__(
+        self,
+        label: str,
+        path: str,
+        top: Iterable[Dict[str, object]],
+    ) -> None:
+        self._label = label
+        self._path = path
+        self._top = top
+
+    def get_label(self) -> str:
+        """method to get label of the profile"""
+        return self._label
+
+    def get_path(self) -> str:
+        """method to get path of the pstats dump"""
+        return self._path
+
+    def get_top(self) -> Iterable[Dict[str, object]]:
+        """method to get flat top functions summary"""
+        return self._top
+
+    def to_dict(self) -> Dict[str, object]:
+        """method to get result as a json serializable dict"""
+        return {
+            'label': self._label,
+            'path': self._path,
+            'top': self._top,
+        }
+
+
+class Profiler(object):
+    """
+    Profiler runs analyses under cProfile on demand. It is disarmed
+    by default, in which case profile() does nothing besides a
+    single counter check
+
+    Parameters
+    ----------
+    output_dir: str
+        directory to save pstats dumps and summaries to
+    top_n: Optional[int] (default: 25)
+        number of functions to include in flat summaries
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        top_n: Optional[int] = 25,
+    ) -> None:
+        self._dir = output_dir
+        self._top_n = top_n
+        self._remaining = 0
+        # results are kept per thread, so requests profiled at the
+        # same time each get their own
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def arm(self, count: int) -> None:
+        """
+        method to profile the next count analyses run in this process
+
+        Parameters
+        ----------
+        count: int
+            number of analyses to profile
+        """
+        with self._lock:
+            self._remaining = max(count, 0)
+
+    def get_remaining(self) -> int:
+        """method to get number of analyses left to profile"""
+        return self._remaining
+
+    @contextmanager
+    def profile(
+        self,
+        label: str,
+        force: Optional[bool] = False,
+    ) -> Iterator[Optional[cProfile.Profile]]:
+        """
+        context manager to profile the wrapped code if the profiler
+        is armed (or forced). yields None when not profiling
+
+        Parameters
+        ----------
+        label: str
+            label describing what is profiled
+        force: Optional[bool] (default: False)
+            profile regardless of whether profiler is armed
+        """
+        if not force and not self._take():
+            yield None
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            self._local.last = self._save(label=label, profile=profile)
+
+    def get_last_result(self) -> Optional[ProfileResult]:
+        """
+        method to get result of last profile taken by the calling
+        thread (i.e the request being served)
+        """
+        return getattr(self._local, 'last', None)
+
+    def get_saved_results(
+        self,
+        limit: Optional[int] = 20,
+    ) -> Iterable[Dict[str, object]]:
+        """
+        method to get summaries saved by all processes sharing the
+        output directory, most recent first
+
+        Parameters
+        ----------
+        limit: Optional[int] (default: 20)
+            max number of summaries to return
+        """
+        if not os.path.isdir(self._dir):
+            return []
+        paths = [
+            os.path.join(self._dir, name)
+            for name in os.listdir(self._dir)
+            if name.endswith('.json')
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        results = []
+        for path in paths[:limit]:
+            with open(path) as summary_file:
+                results.append(json.load(summary_file))
+        return results
+
+    def _take(self) -> bool:
+        """helper method to claim one armed profiling slot"""
+        if not self._remaining:
+            return False
+        with self._lock:
+            if not self._remaining:
+                return False
+            self._remaining -= 1
+            return True
+
+    def _save(
+        self,
+        label: str,
+        profile: cProfile.Profile,
+    ) -> ProfileResult:
+        """helper method to save pstats dump and flat summary"""
+        os.makedirs(self._dir, exist_ok=True)
+        name = f'capmon-{os.getpid()}-{int(time.time() * 1000)}'
+        path = os.path.join(self._dir, name + '.pstats')
+        profile.dump_stats(path)
+        result = ProfileResult(
+            label=label,
+            path=path,
+            top=self._summarize(profile=profile),
+        )
+        with open(os.path.join(self._dir, name + '.json'), 'w') as f:
+            json.dump(result.to_dict(), f)
+        return result
+
+    def _summarize(
+        self,
+        profile: cProfile.Profile,
+    ) -> Iterable[Dict[str, object]]:
+        """helper method to generate flat summary sorted by own time"""
+        stats = pstats.Stats(profile).stats
+        rows = sorted(
+            stats.items(),
+            key=lambda item: item[1][2],
+            reverse=True,
+        )
+        top = []
+        for (filename, line, func), (_, calls, tot, cum, _) in rows:
+            top.append({
+                'function': f'{filename}:{line}({func})',
+                'calls': calls,
+                'tottime': tot,
+                'cumtime': cum,
+            })
+            if len(top) == self._top_n:
+                break
+        return top
@@ -0,0 +1,65 @@
+from typing import Dict, Tuple
+import json
+import numpy as np
+from utils.imports import LazyModule
+
+pa = LazyModule('pyarrow')
+
+# schema metadata key of the json metadata of a container
+METADATA_KEY = b'capmon'
+# version of the container layout, bumped on incompatible changes
+FORMAT_VERSION = 2
+
+
+def encode_columns(columns: Dict[str, np.ndarray], metadata: dict) -> bytes:
+    """
+    function to encode numpy arrays of the same length and json
+    metadata into a compact binary container (an arrow ipc stream
+    of a single record batch). arrays are written as is, without
+    converting each value
+
+    Parameters
+    ----------
+    columns: Dict[str, np.ndarray]
+        1-d numeric arrays of the same length by column name
+    metadata: dict
+        json serializable metadata describing the columns
+    """
+    batch = pa.RecordBatch.from_arrays(
+        [pa.array(array) for array in columns.values()],
+        names=list(columns),
+    )
+    meta = json.dumps({'version': FORMAT_VERSION, **metadata})
+    schema = batch.schema.with_metadata({METADATA_KEY: meta.encode()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_columns(data: bytes) -> Tuple[Dict[str, np.ndarray], dict]:
+    """
+    function to decode a container written by encode_columns into
+    arrays by column name and metadata. arrays are read-only views
+    of data (no copies are made), so data must not be modified while
+    they are in use. raises ValueError if data is not a container of
+    a supported version
+
+    Parameters
+    ----------
+    data: bytes
+        encoded container
+    """
+    try:
+        reader = pa.ipc.open_stream(pa.py_buffer(data))
+        batch = reader.read_next_batch()
+        meta = json.loads(reader.schema.metadata[METADATA_KEY])
+    except (pa.ArrowException, KeyError, TypeError, StopIteration) as e:
+        raise ValueError(f'invalid container: {e}')
+    if meta.pop('version', None) != FORMAT_VERSION:
+        raise ValueError('unsupported container version')
+    columns = {
+        name: batch.column(index).to_numpy(zero_copy_only=True)
+        for index, name in enumerate(batch.schema.names)
+    }
+    return (columns, meta)
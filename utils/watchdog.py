@@ -0,0 +1,63 @@
+from typing import Optional
+import os
+import resource
+import signal
+import sys
+
+
+def get_rss() -> int:
+    """
+    function to get current resident set size of the process in
+    bytes. falls back to the max RSS where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        if sys.platform == 'darwin':
+            return max_rss
+        return max_rss * 1024
+
+
+class RSSWatchdog(object):
+    """
+    RSSWatchdog recycles a gunicorn worker once its resident set
+    size goes over a budget. it asks the worker to shut down
+    gracefully, so the request in flight is completed and the
+    gunicorn arbiter starts a fresh worker in its place
+
+    Parameters
+    ----------
+    max_rss: int
+        RSS budget in bytes for the process (0 disables the watchdog)
+    """
+
+    def __init__(self, max_rss: int) -> None:
+        self._max_rss = max_rss
+        self._recycling = False
+
+    def is_enabled(self) -> bool:
+        """method to check if watchdog has a budget to enforce"""
+        return self._max_rss > 0
+
+    def is_recycling(self) -> bool:
+        """method to check if watchdog already asked for a recycle"""
+        return self._recycling
+
+    def check(self) -> Optional[int]:
+        """
+        method to recycle the worker if it is over its RSS budget.
+        returns the RSS if a recycle was requested, otherwise None
+        """
+        if not self.is_enabled() or self._recycling:
+            return None
+        rss = get_rss()
+        if rss <= self._max_rss:
+            return None
+        self._recycling = True
+        # gunicorn workers treat SIGTERM as a graceful shutdown
+        os.kill(os.getpid(), signal.SIGTERM)
+        return rss